@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import asyncio
+import codecs
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Union
+
+from .ansi2image import Ansi2Image, Renderer
+from .libs.decoding import DEFAULT_ERRORS, codec_errors
+from .libs.encoder import DEFAULT_PROFILE
+
+Source = Union[str, bytes, Iterable[str], AsyncIterable[Union[bytes, str]]]
+
+
+class Cancelled(Exception):
+    ''' Raised inside a worker when the awaiting task was cancelled '''
+
+
+def _check(cancelled: Optional[threading.Event]) -> None:
+    if cancelled is not None and cancelled.is_set():
+        raise Cancelled()
+
+
+def _render_text(renderer: Renderer, lines: List[str], format: str, margin: float, profile: str,
+                 cancelled: Optional[threading.Event] = None) -> bytes:
+    document = renderer.document(lines)
+    _check(cancelled)
+    img = renderer.render_image(document, margin=margin)
+    _check(cancelled)
+    return Ansi2Image._encode(img, format=format, profile=profile)
+
+
+def _render_page(renderer: Renderer, lines: List[str], state: tuple, format: str, margin: float, profile: str,
+                 cancelled: Optional[threading.Event] = None) -> bytes:
+    start = Ansi2Image.TextColor(foreground=renderer.foreground, background=renderer.background,
+                                 palette=renderer.palette)
+    start.restore(state)
+    document = Ansi2Image.Document(lines, palette=renderer.palette, state=start).parse()
+    _check(cancelled)
+    return Ansi2Image._encode(renderer.render_image(document, margin=margin), format=format, profile=profile)
+
+
+def _render_screen_pages(renderer: Renderer, lines: List[str], max_lines: int, format: str, margin: float,
+                         profile: str, cancelled: Optional[threading.Event] = None) -> List[bytes]:
+    # The whole screen must be emulated before the final state is known
+    document = renderer.document(lines)
+    pages = []
+    for i in range(0, len(document.runs), max_lines):
+        _check(cancelled)
+        page = Ansi2Image.Document.from_runs(document.runs[i:i + max_lines], document.styles,
+                                             palette=renderer.palette)
+        pages.append(Ansi2Image._encode(renderer.render_image(page, margin=margin), format=format, profile=profile))
+    return pages
+
+
+async def aiter_lines(source: Source, encoding: str = 'utf-8', errors: str = DEFAULT_ERRORS) -> AsyncIterator[str]:
+    '''
+    Lines (with their \\n) of a text, of bytes, of an iterable of lines or of an async
+    iterable of byte or text chunks of any size, such as aiohttp's StreamReader.
+    Each element of an iterable of lines is one line, like the lines of readlines().
+    errors is the decode policy of invalid bytes (see libs.decoding).
+    '''
+    if not isinstance(source, (str, bytes)) and not hasattr(source, '__aiter__'):
+        for line in source:
+            yield codecs.decode(line, encoding, codec_errors(errors)) if isinstance(line, (bytes, bytearray)) else line
+        return
+
+    decoder = codecs.getincrementaldecoder(encoding)(codec_errors(errors))
+    # Parts of the line not ended yet, joined once its end arrives, so only new data is scanned
+    pending = []
+
+    def split(chunk: Union[bytes, str]) -> List[str]:
+        text = decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        *lines, rest = text.split('\n')
+        if lines and pending:
+            lines[0] = ''.join(pending) + lines[0]
+            pending.clear()
+        if rest != '':
+            pending.append(rest)
+        return lines
+
+    if isinstance(source, (str, bytes)):
+        for line in split(source):
+            yield line + '\n'
+    else:
+        async for chunk in source:
+            for line in split(chunk):
+                yield line + '\n'
+
+    pending.append(decoder.decode(b'', final=True))
+    rest = ''.join(pending)
+    if rest != '':
+        yield rest
+
+
+class AsyncRenderer(object):
+    '''
+    asyncio front end of a Renderer.
+
+    CPU work runs on an executor (a private thread pool by default, Renderer is thread-safe;
+    a ProcessPoolExecutor also works). At most max_concurrency renders are in flight: callers
+    wait on a semaphore that is only released when the worker is really done, so a slow
+    executor pushes back on the producers. Cancelling the awaiting task cancels a job that
+    has not started yet and stops a running one at its next stage (parse, draw, encode, page).
+    '''
+
+    def __init__(self, renderer: Optional[Renderer] = None, executor: Optional[Executor] = None,
+                 max_concurrency: int = 4, **options):
+        self.renderer = renderer if renderer is not None else Renderer(**options)
+        self.max_concurrency = max(1, max_concurrency)
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix='ansi2image')
+        self._semaphore = None  # type: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]]
+
+    def close(self) -> None:
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> 'AsyncRenderer':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def _cross_process(self) -> bool:
+        return isinstance(self.executor, ProcessPoolExecutor)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        semaphore = self._get_semaphore()
+        await semaphore.acquire()
+
+        # Events can not be sent to other processes, those jobs are only cancelled before they start
+        cancelled = None if self._cross_process else threading.Event()
+        try:
+            future = self.executor.submit(fn, *args, cancelled)
+        except BaseException:
+            semaphore.release()
+            raise
+
+        def done(_):
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+                pass  # loop already closed
+
+        future.add_done_callback(done)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if cancelled is not None:
+                cancelled.set()
+            future.cancel()
+            raise
+
+    async def render(self, source: Source, format: str = 'png', margin: float = 0.02,
+                     encoding: str = 'utf-8', errors: str = DEFAULT_ERRORS, profile: str = DEFAULT_PROFILE) -> bytes:
+        ''' Renders a text, bytes, lines or an async byte stream and returns the encoded image '''
+        lines = [line async for line in aiter_lines(source, encoding=encoding, errors=errors)]
+        if len(lines) == 0:
+            raise Exception('Data is empty')
+        return await self._run(_render_text, self.renderer, lines, format, margin, profile)
+
+    async def render_pages(self, source: Source, max_lines: Optional[int] = None,
+                           max_height: Optional[int] = None, format: str = 'png', margin: float = 0.02,
+                           encoding: str = 'utf-8', errors: str = DEFAULT_ERRORS,
+                           profile: str = DEFAULT_PROFILE) -> AsyncIterator[bytes]:
+        '''
+        Yields encoded pages as soon as enough lines of source have arrived.
+        The SGR state is carried across pages, so memory is bounded by one page.
+        '''
+        renderer = self.renderer
+        max_lines = renderer.page_lines(max_lines, max_height)
+        lines = aiter_lines(source, encoding=encoding, errors=errors)
+
+        if renderer.screen is not None:
+            pages = await self._run(_render_screen_pages, renderer, [line async for line in lines],
+                                    max_lines, format, margin, profile)
+            for page in pages:
+                yield page
+            return
+
+        state = Ansi2Image.TextColor(foreground=renderer.foreground, background=renderer.background,
+                                     palette=renderer.palette)
+        chunk = []
+        async for line in lines:
+            chunk.append(line)
+            if len(chunk) >= max_lines:
+                yield await self._page(chunk, state, format, margin, profile)
+                chunk = []
+        if chunk:
+            yield await self._page(chunk, state, format, margin, profile)
+
+    async def _page(self, lines: List[str], state: 'Ansi2Image.TextColor', format: str, margin: float,
+                    profile: str) -> bytes:
+        # Only SGR is scanned here, the worker parses and draws the page from the start state
+        start = state.key()
+        Ansi2Image._sgr_prescan(lines, [len(lines)], state)
+        return await self._run(_render_page, self.renderer, lines, start, format, margin, profile)
+
+
+async def render_async(source: Source, format: str = 'png', executor: Optional[Executor] = None,
+                       margin: float = 0.02, profile: str = DEFAULT_PROFILE, errors: str = DEFAULT_ERRORS,
+                       **options) -> bytes:
+    '''
+    Renders without blocking the event loop, options are the Renderer arguments:
+        png = await render_async(text, font_size=13)
+    '''
+    renderer = AsyncRenderer(executor=executor, max_concurrency=1, **options)
+    try:
+        return await renderer.render(source, format=format, margin=margin, errors=errors, profile=profile)
+    finally:
+        renderer.close()
+
+
+async def render_pages_async(source: Source, max_lines: Optional[int] = None, max_height: Optional[int] = None,
+                             format: str = 'png', executor: Optional[Executor] = None, margin: float = 0.02,
+                             profile: str = DEFAULT_PROFILE, errors: str = DEFAULT_ERRORS,
+                             **options) -> AsyncIterator[bytes]:
+    '''
+    Encoded pages of a text or an async byte stream:
+        async for page in render_pages_async(request.content, max_lines=200):
+            ...
+    '''
+    renderer = AsyncRenderer(executor=executor, max_concurrency=1, **options)
+    try:
+        async for page in renderer.render_pages(source, max_lines=max_lines, max_height=max_height,
+                                                format=format, margin=margin, errors=errors, profile=profile):
+            yield page
+    finally:
+        renderer.close()
@@ -2,16 +2,17 @@
 # -*- coding: UTF-8 -*-
 import datetime
 import io
+import itertools
 import json
 import re
-from typing import Iterator, Union, List, Optional, Tuple
-from PIL import Image, ImageDraw
-from PIL.ImageFont import FreeTypeFont
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional, Tuple, Union
 
+from .fonts.atlas import glyph_atlas
+from .fonts.metrics import metrics_cache
 from .fonts.truetypefont import TrueTypeFont
 from .libs.logger import Logger
-import colorama
-colorama.init(strip=False)
 
 try:
     from .config import Configuration
@@ -19,26 +20,56 @@ except (ValueError, ImportError) as e:
     raise Exception('You may need to run ansi2image from the root directory (which includes README.md)', e)
 
 import sys, os
+from .args import Arguments
 from .libs.color import Color
+from .libs.cache import RenderCache
+from .libs.decoding import DEFAULT_ERRORS, codec_errors
+from .libs.encoder import DEFAULT_PROFILE, Encoder
+from .libs.indexed import ColorIndex
+from .libs.mapped import MappedLines
+from .libs.palette import Palette
+from .libs.screen import Screen
+from .libs.stats import RenderStats
+from .vector import FORMATS as VECTOR_FORMATS
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from PIL import Image, ImageDraw
+    from PIL.ImageFont import FreeTypeFont
 
 # Based on https://en.wikipedia.org/wiki/_ANSI_escape_code#Escape_sequences
+# Single tokenizer for every escape sequence, CSI parameters and command are captured
 _ANSI_SEQUENCES = re.compile(r'''
     \x1B            # Sequence starts with ESC, i.e. hex 0x1B
     (?:
         [@-Z\\-_]   # Second byte:
                     #   all 0x40–0x5F range but CSI char, i.e ASCII @A–Z\]^_
+    |               # Or
+        [ -/]+      # nF escapes (e.g. ESC ( B from tput sgr0):
+        [0-~]       #   intermediate bytes 0x20–0x2F and a final byte
     |               # Or
         \[          # CSI sequences, starting with [
-        [0-?]*      # Parameter bytes:
+        ([0-?]*)    # Parameter bytes:
                     #   range 0x30–0x3F, ASCII 0–9:;<=>?
         [ -/]*      # Intermediate bytes:
                     #   range 0x20–0x2F, ASCII space and !"#$%&'()*+,-./
-        [@-~]       # Final byte
+        ([@-~])     # Final byte
                     #   range 0x40–0x7E, ASCII @A–Z[\]^_`a–z{|}~
     )
 ''', re.VERBOSE)
 
-_ANSI_CODES_PROG = re.compile("\033\\[([\\d;:]*)([a-zA-z])")
+# Only SGR sequences, used to find the state at a line without parsing everything before it
+_SGR_SEQUENCES = re.compile(r'\x1B\[([0-?]*)[ -/]*m')
+
+# Escape sequences plus the C0 control characters honored by the screen-buffer mode
+_TERMINAL_SEQUENCES = re.compile(_ANSI_SEQUENCES.pattern + r'''
+    |               # Or
+    ([\x00-\x1A\x1C-\x1F\x7F])   # C0 control character (CR, LF, BS, TAB...)
+''', re.VERBOSE)
+
+# The same tokenizers on undecoded lines, only the text between sequences is decoded
+_ANSI_SEQUENCES_BYTES = re.compile(_ANSI_SEQUENCES.pattern.encode('utf-8'), re.VERBOSE)
+_SGR_SEQUENCES_BYTES = re.compile(_SGR_SEQUENCES.pattern.encode('utf-8'))
 
 _ANSI_FULL_RESET = 0
 _ANSI_INTENSITY_INCREASED = 1
@@ -64,80 +95,21 @@ _ANSI_NEGATIVE_OFF = 27
 _ANSI_256_COLOR_ID = 5
 _ANSI_TRUECOLOR_ID = 2
 
-_BACKGROUND_COLOR = (0, 0, 0)
-_FOREGROUND_COLOR = (240, 240, 240)
-
+# SGR code: (target, index of the color at Palette.ansi)
 #https://en.wikipedia.org/wiki/_ANSI_escape_code#3-bit_and_4-bit
 _ANSI_COLORS = {
-    #Black
-    30:     (_ANSI_FOREGROUND, 0, 0, 0),
-    40:     (_ANSI_BACKGROUND, 0, 0, 0),
-
-    # Red
-    31: (_ANSI_FOREGROUND, 194, 54, 33),
-    41: (_ANSI_BACKGROUND, 194, 54, 33),
-
-    # Green
-    32: (_ANSI_FOREGROUND, 37, 188, 36 ),
-    42: (_ANSI_BACKGROUND, 37, 188, 36 ),
-
-    # Yellow
-    33: (_ANSI_FOREGROUND, 173, 173, 39),
-    43: (_ANSI_BACKGROUND, 173, 173, 39),
-
-    # Blue
-    34: (_ANSI_FOREGROUND, 0, 0, 187),
-    44: (_ANSI_BACKGROUND, 0, 0, 187),
-
-    # Magenta
-    35: (_ANSI_FOREGROUND, 211, 56, 211),
-    45: (_ANSI_BACKGROUND, 211, 56, 211),
-
-    # Cyan
-    36: (_ANSI_FOREGROUND, 0, 187, 187),
-    46: (_ANSI_BACKGROUND, 0, 187, 187),
-
-    # White
-    37: (_ANSI_FOREGROUND, 187, 187, 187),
-    47: (_ANSI_BACKGROUND, 187, 187, 187),
-
-    # Bright Black (Gray)
-    90: (_ANSI_FOREGROUND, 85, 85, 85),
-    100: (_ANSI_BACKGROUND,85, 85, 85),
-
-    # Bright Red
-    91: (_ANSI_FOREGROUND, 255, 85, 85),
-    101: (_ANSI_BACKGROUND, 255, 85, 85),
-
-    # Bright Green
-    92: (_ANSI_FOREGROUND, 85, 255, 85),
-    102: (_ANSI_BACKGROUND, 85, 255, 85),
-
-    # Bright Yellow
-    93: (_ANSI_FOREGROUND, 255, 255, 85),
-    103: (_ANSI_BACKGROUND, 255, 255, 85),
-
-    # Bright Blue
-    94: (_ANSI_FOREGROUND, 85, 85, 255),
-    104: (_ANSI_BACKGROUND, 85, 85, 255),
-
-    # Bright Magenta
-    95: (_ANSI_FOREGROUND, 255, 85, 255),
-    105: (_ANSI_BACKGROUND, 255, 85, 255),
-
-    # Bright Cyan
-    96: (_ANSI_FOREGROUND, 85, 255, 255),
-    106: (_ANSI_BACKGROUND, 85, 255, 255),
-
-    # Bright White
-    97: (_ANSI_FOREGROUND, 255, 255, 255),
-    107: (_ANSI_BACKGROUND, 255, 255, 255),
-
+    **{30 + i: (_ANSI_FOREGROUND, i) for i in range(8)},
+    **{40 + i: (_ANSI_BACKGROUND, i) for i in range(8)},
+    **{90 + i: (_ANSI_FOREGROUND, i + 8) for i in range(8)},
+    **{100 + i: (_ANSI_BACKGROUND, i + 8) for i in range(8)},
 }
 
-#https://www.ditig.com/downloads/256-colors.json
-here = os.path.abspath(os.path.dirname(__file__))
-_ANSI_256_COLORS = json.load(open(f'{here}/libs/256-colors.json', 'r'))
+
+@lru_cache(maxsize=1)
+def _text_features() -> Optional[List[str]]:
+    ''' Features disabling ligatures, None when libraqm is not available to apply them '''
+    from PIL import features
+    return ['-liga', '-clig', '-calt'] if features.check('raqm') else None
 
 
 class Ansi2Image(object):
@@ -145,7 +117,6 @@ class Ansi2Image(object):
     Parse ANSI escape codes
     Reference: https://en.wikipedia.org/wiki/_ANSI_escape_code
     '''
-    lines = []
     width = 0
     height = 0
     font_size = 20
@@ -154,25 +125,20 @@ class Ansi2Image(object):
     max_margin = 50
     line_height = 1.2
     font_name = 'JetBrains Mono Regular'
-    _background_color = None
-    _foreground_color = None
 
     class TextColor(object):
-        _background_color = None
-        _foreground_color = None
-        _background = None
-        _foreground = None
-        _text = None
-        _intensity = _ANSI_INTENSITY_NORMAL
-        _style = _ANSI_STYLE_NORMAL
-        _underline = _ANSI_UNDERLINE_OFF
-        _visibility = _ANSI_VISIBILITY_ON
-        _negative = _ANSI_NEGATIVE_OFF
-
-        def __init__(self, text: str = '', foreground=None, background=None):
+        '''
+        Mutable SGR state of the parser.
+        Runs do not keep a copy of it, they reference an interned Style by id.
+        '''
+        __slots__ = ('_background_color', '_foreground_color', '_background', '_foreground', '_text',
+                     '_intensity', '_style', '_underline', '_visibility', '_negative', '_palette')
+
+        def __init__(self, text: str = '', foreground=None, background=None, palette: Palette = None):
             self._text = text
-            self._background = background if background is not None else Ansi2Image._background_color
-            self._foreground = foreground if foreground is not None else Ansi2Image._foreground_color
+            self._palette = palette if palette is not None else Palette.default()
+            self._background = background if background is not None else self._palette.background
+            self._foreground = foreground if foreground is not None else self._palette.foreground
 
             self.reset()
 
@@ -185,27 +151,23 @@ class Ansi2Image(object):
         @property
         def background_color(self) -> Tuple[int]:
             if self._negative == _ANSI_NEGATIVE_ON:
-                return self._intensity_color(self._foreground_color)
-            return self._intensity_color(self._background_color)
+                return self._intensity_color(self._foreground_color, False)
+            return self._intensity_color(self._background_color, False)
 
         @property
         def foreground_color(self) -> Tuple[int]:
             if self._negative == _ANSI_NEGATIVE_ON:
-                return self._intensity_color(self._background_color)
-            return self._intensity_color(self._foreground_color)
+                return self._intensity_color(self._background_color, True)
+            return self._intensity_color(self._foreground_color, True)
 
-        def _intensity_color(self, color: Tuple[int]) -> Tuple[int]:
+        def _intensity_color(self, color: Tuple[int], foreground: bool = True) -> Tuple[int]:
             if color is None:
                 return None
-            if self._intensity in (_ANSI_INTENSITY_NORMAL, _ANSI_INTENSITY_INCREASED):
-                return color
-            else:
-                base_img = Image.new("RGB", (6, 6), self._foreground)
-                drw = ImageDraw.Draw(base_img, 'RGBA')
-                drw.polygon(xy=[(0, 0), (6, 6)], fill=color + (200,))
-                del drw
-                r, g, b = base_img.getpixel((3, 3))
-                return r, g, b
+            if self._intensity == _ANSI_INTENSITY_REDUCED:
+                return self._palette.dim(color, self._foreground)
+            if self._intensity == _ANSI_INTENSITY_INCREASED and foreground:
+                return self._palette.bold(color)
+            return color
 
         def set_color(self, ansi_code: int, r: int, g: int, b: int) -> None:
             if ansi_code == _ANSI_FOREGROUND:
@@ -228,93 +190,23 @@ class Ansi2Image(object):
                 self._visibility = ansi_code
             elif ansi_code in (_ANSI_NEGATIVE_ON, _ANSI_NEGATIVE_OFF):
                 self._negative = ansi_code
-            elif ansi_code in _ANSI_COLORS.keys():
+            elif ansi_code in _ANSI_COLORS:
                 # 3-bit and 4-bit colors
-                c = _ANSI_COLORS.get(ansi_code, None)
-                if c is not None:
-                    self.set_color(
-                        c[0], c[1], c[2], c[3]
-                    )
-            elif ansi_code == _ANSI_FOREGROUND:
-                c = next((
-                    color['rgb'] for color in _ANSI_256_COLORS
-                    if str(color['colorId']) == parameter
-                ), None)
-                if c is not None:
-                    self.set_color(
-                        _ANSI_FOREGROUND, c['r'], c['g'], c['b']
-                    )
-            elif ansi_code == _ANSI_BACKGROUND:
-                c = next((
-                    color['rgb'] for color in _ANSI_256_COLORS
-                    if str(color['colorId']) == parameter
-                ), None)
+                target, index = _ANSI_COLORS[ansi_code]
+                self.set_color(target, *self._palette.ansi[index])
+            elif ansi_code in (_ANSI_FOREGROUND, _ANSI_BACKGROUND) and parameter is not None:
+                # 8-bit (256) colors
+                try:
+                    c = self._palette.color(int(parameter))
+                except ValueError:
+                    c = None
                 if c is not None:
-                    self.set_color(
-                        _ANSI_BACKGROUND, c['r'], c['g'], c['b']
-                    )
-                pass
-
-        def reset(self):
-            self._background_color: Tuple[int] = self._background
-            self._foreground_color: Tuple[int] = self._foreground
-            self._intensity: int = _ANSI_INTENSITY_NORMAL
-            self._style: int = _ANSI_STYLE_NORMAL
-            self._underline: int = _ANSI_UNDERLINE_OFF
-            self._visibility: int = _ANSI_VISIBILITY_ON
-            self._negative: int = _ANSI_NEGATIVE_OFF
-
-        def clone(self, text: str):
-            ret = Ansi2Image.TextColor(text, self._foreground, self._background)
-            ret._background_color = self._background_color
-            ret._foreground_color = self._foreground_color
-            ret._intensity = self._intensity
-            ret._style = self._style
-            ret._underline = self._underline
-            ret._visibility = self._visibility
-            ret._negative = self._negative
-            return ret
-
-        def __str__(self):
-            return self.text
-
-        def __repr__(self):
-            return self.text
-
-    def __init__(self, width, height, font_name, font_size, line_height: float = 1.0):
-
-        self.width = width
-        self.height = height
-        self.font_size = font_size
-        self.font_name = font_name
-        self.line_height = line_height
-
-        Ansi2Image._background_color = _BACKGROUND_COLOR
-        Ansi2Image._foreground_color = _FOREGROUND_COLOR
-        self.background_color = _BACKGROUND_COLOR
-        self.foreground_color = _FOREGROUND_COLOR
-
-
-    @classmethod
-    def escape_ansi(cls, line):
-        return _ANSI_SEQUENCES.sub('', line)
-
-    @classmethod
-    def _handle_ansi_code(cls, ansi: str, last_state: TextColor = None) -> Iterator[TextColor]:
-        last_end = 0  # the index of the last end of a code we've seen
-        state_color = last_state.clone('') if last_state is not None else Ansi2Image.TextColor()
-        for match in _ANSI_CODES_PROG.finditer(ansi):
-            yield state_color.clone(ansi[last_end:match.start()])
-            last_end = match.end()
-
-            params: Union[str, List[int]]
-            params, command = match.groups()
-
-            # ESC [          = Control Sequence Introducer
-            # ESC [ n m      = Select Graphic Rendition (Sets colors and style of the characters following this code)
-            if command not in "m":
-                continue
+                    self.set_color(ansi_code, *c)
 
+        def apply_sgr(self, params: str) -> None:
+            '''
+            Applies the parameters of one SGR sequence (ESC [ params m)
+            '''
             while True:
                 param_len = len(params)
                 params = params.replace("::", ":")
@@ -349,9 +241,9 @@ class Ansi2Image(object):
             if last_null_index is not None:
                 params = params[last_null_index + 1 :]
 
-                state_color.reset()
+                self.reset()
                 if not params:
-                    continue
+                    return
 
             skip_after_index = -1
 
@@ -374,7 +266,7 @@ class Ansi2Image(object):
                     skip_after_index = i + 2
                 elif is_x_bit_color and is_truecolor:
                     try:
-                        state_color.set_color(
+                        self.set_color(
                             v, params[i + 2], params[i + 3], params[i + 4]
                         )
                     except IndexError:
@@ -383,166 +275,1039 @@ class Ansi2Image(object):
                     continue
                 else:
                     parameter = None
-                state_color.adjust(v, parameter=parameter)
+                self.adjust(v, parameter=parameter)
 
-        yield state_color.clone(ansi[last_end:])
+        def key(self) -> tuple:
+            ''' Hashable snapshot of the state, used to intern styles '''
+            return (self._foreground, self._background, self._foreground_color, self._background_color,
+                    self._intensity, self._style, self._underline, self._visibility, self._negative)
 
-    def load_from_file(self, filename: str):
-        with open(filename, 'rb') as f:
-            self.load(io.TextIOWrapper(f))
+        def restore(self, key: tuple) -> None:
+            (self._foreground, self._background, self._foreground_color, self._background_color,
+             self._intensity, self._style, self._underline, self._visibility, self._negative) = key
 
-    def load(self, stream: io.TextIOWrapper):
-        self.lines = stream.readlines()
+        def reset(self):
+            self._background_color: Tuple[int] = self._background
+            self._foreground_color: Tuple[int] = self._foreground
+            self._intensity: int = _ANSI_INTENSITY_NORMAL
+            self._style: int = _ANSI_STYLE_NORMAL
+            self._underline: int = _ANSI_UNDERLINE_OFF
+            self._visibility: int = _ANSI_VISIBILITY_ON
+            self._negative: int = _ANSI_NEGATIVE_OFF
 
-    def loads(self, text: str):
-        self.lines = text.replace('\r', '').split('\n')
+        def clone(self, text: str):
+            ret = Ansi2Image.TextColor(text, self._foreground, self._background, self._palette)
+            ret.restore(self.key())
+            return ret
+
+        def __str__(self):
+            return self.text
+
+        def __repr__(self):
+            return self.text
+
+    class Style(object):
+        '''
+        Immutable, interned text style.
+        Colors are resolved (intensity and negative applied) once, when the style is interned.
+        '''
+        __slots__ = ('id', 'key', 'foreground_color', 'background_color',
+                     'intensity', 'italic', 'underline', 'visible', 'negative')
+
+        def __init__(self, style_id: int, state: 'Ansi2Image.TextColor'):
+            values = dict(
+                id=style_id,
+                key=state.key(),
+                foreground_color=state.foreground_color,
+                background_color=state.background_color,
+                intensity=state._intensity,
+                italic=state._style == _ANSI_STYLE_ITALIC,
+                underline=state._underline == _ANSI_UNDERLINE_ON,
+                visible=state._visibility != _ANSI_VISIBILITY_OFF,
+                negative=state._negative == _ANSI_NEGATIVE_ON,
+            )
+            for k, v in values.items():
+                object.__setattr__(self, k, v)
+
+        def __setattr__(self, name, value):
+            raise AttributeError('Style is immutable')
+
+        def display(self, text: str) -> str:
+            ''' Text as it must be drawn (hidden text keeps its width) '''
+            return text if self.visible else ' ' * len(text)
+
+        def __repr__(self):
+            return f'Style(id={self.id}, fg={self.foreground_color}, bg={self.background_color})'
+
+    class StyleTable(object):
+        '''
+        Per-document table of interned styles. A run is just (text, style_id).
+        '''
+        __slots__ = ('_ids', 'styles')
+
+        def __init__(self):
+            self._ids = {}
+            self.styles = []
+
+        def intern(self, state: 'Ansi2Image.TextColor') -> int:
+            key = state.key()
+            style_id = self._ids.get(key)
+            if style_id is None:
+                style_id = len(self.styles)
+                self.styles.append(Ansi2Image.Style(style_id, state))
+                self._ids[key] = style_id
+            return style_id
+
+        def __getitem__(self, style_id: int) -> 'Ansi2Image.Style':
+            return self.styles[style_id]
+
+        def __len__(self):
+            return len(self.styles)
+
+    class Document(object):
+        '''
+        Parsed text: the (text, style_id) runs of each line and its width in columns.
+        Lines may be bytes, then only their text runs are decoded (errors is the policy
+        for invalid UTF-8, see libs.decoding).
+
+        The source is scanned once, on first access, and the result is shared by
+        calc_size and generate_image, so the same document can be rendered again
+        with other margins or fonts without parsing it again.
+        '''
+
+        def __init__(self, lines: List[str], foreground: Tuple[int] = None, background: Tuple[int] = None,
+                     palette: Palette = None, screen: Optional[Tuple[int, int]] = None, scrollback: int = 1000,
+                     state: 'Ansi2Image.TextColor' = None, styles: 'Ansi2Image.StyleTable' = None,
+                     errors: str = DEFAULT_ERRORS):
+            self.source = lines
+            self.foreground = foreground
+            self.background = background
+            self.palette = palette if palette is not None else Palette.default()
+            self.screen = screen
+            self.scrollback = scrollback
+            # A starting state and a shared style table carry SGR across documents (e.g. pages)
+            self.start_state = state
+            self.styles = styles if styles is not None else Ansi2Image.StyleTable()
+            self.errors = errors
+            self.end_state = None
+            self._runs = None
+            self._widths = None
+
+        @classmethod
+        def from_runs(cls, runs: List[List[Tuple[str, int]]], styles: 'Ansi2Image.StyleTable',
+                      **kwargs) -> 'Ansi2Image.Document':
+            ''' Document made of already parsed runs '''
+            doc = cls([], styles=styles, **kwargs)
+            doc._runs = runs
+            doc._widths = [sum(len(text) for text, _ in line_runs) for line_runs in runs]
+            return doc
+
+        def parse(self) -> 'Ansi2Image.Document':
+            if self._runs is not None:
+                return self
+
+            state = self.start_state
+            if state is None:
+                state = Ansi2Image.TextColor(foreground=self.foreground, background=self.background,
+                                             palette=self.palette)
+            styles = self.styles
+            if self.screen is not None:
+                runs = self._parse_screen(state)
+            else:
+                errors = codec_errors(self.errors)
+                runs = [
+                    list(Ansi2Image._handle_ansi_code(line.rstrip('\n').replace('\r', ''), state, styles))
+                    if isinstance(line, str) else
+                    list(Ansi2Image._handle_ansi_bytes(line.rstrip(b'\n').replace(b'\r', b''), state, styles, errors))
+                    for line in self.source
+                ]
+            widths = [sum(len(text) for text, _ in line_runs) for line_runs in runs]
+
+            self._runs = runs
+            self._widths = widths
+            self.end_state = state
+            return self
+
+        def _parse_screen(self, state: 'Ansi2Image.TextColor') -> List[List[Tuple[str, int]]]:
+            columns, rows = self.screen
+            screen = Screen(columns, rows, self.scrollback)
+            default_style = self.styles.intern(state)
+            last = len(self.source) - 1
+            errors = codec_errors(self.errors)
+            for n, line in enumerate(self.source):
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8', errors)
+                newline = n < last
+                if line.endswith('\n'):
+                    line = line[:-1]
+                    newline = True
+                Ansi2Image._handle_terminal(line, state, self.styles, screen)
+                if newline:
+                    screen.control('\n')
+            return screen.lines(default_style)
+
+        @property
+        def runs(self) -> List[List[Tuple[str, int]]]:
+            return self.parse()._runs
+
+        @property
+        def widths(self) -> List[int]:
+            return self.parse()._widths
+
+        @property
+        def max_width(self) -> int:
+            return max(self.widths, default=0)
+
+        def __len__(self):
+            return len(self.source)
+
+    def __init__(self, width, height, font_name, font_size, line_height: float = 1.0, palette: Palette = None,
+                 screen: Optional[Tuple[int, int]] = None, scrollback: int = 1000, indexed: bool = False,
+                 cache: Optional[RenderCache] = None, observer: Optional[Callable[[dict], None]] = None,
+                 errors: str = DEFAULT_ERRORS):
+
+        self.width = width
+        self.height = height
+        self.font_size = font_size
+        self.font_name = font_name
+        self.line_height = line_height
+        self.palette = palette if palette is not None else Palette.default()
+        self.screen = screen
+        self.scrollback = scrollback
+        self.indexed = indexed
+        self.cache = cache
+        # Policy for invalid UTF-8 in lines loaded as bytes (see libs.decoding)
+        self.errors = errors
+        # Called with stats.as_dict() after each render
+        self.observer = observer
+        self.stats = RenderStats()
+
+        self.background_color = self.palette.background
+        self.foreground_color = self.palette.foreground
+        self.lines = []
+        self._document = None
+        self._renderer = None
+
+    @property
+    def document(self) -> 'Ansi2Image.Document':
+        ''' Parsed lines, built on first use and cached until new data is loaded '''
+        doc = self._document
+        if doc is None or doc.palette is not self.palette or \
+                (doc.screen, doc.scrollback, doc.errors) != (self.screen, self.scrollback, self.errors):
+            self._document = Ansi2Image.Document(self.lines, foreground=self.foreground_color,
+                                                 background=self.background_color, palette=self.palette,
+                                                 screen=self.screen, scrollback=self.scrollback, errors=self.errors)
+        return self._document
+
+    @document.setter
+    def document(self, document: 'Ansi2Image.Document'):
+        self.lines = document.source
+        self._document = document
 
     @classmethod
-    def get_default_font_name(cls):
-        return cls.font_name
+    def escape_ansi(cls, line):
+        return _ANSI_SEQUENCES.sub('', line)
 
     @classmethod
-    def textlength(cls, font: FreeTypeFont):
-        char = chr(0x2588)  # ▓ — solid shade block that fills the monospace cell
+    def _handle_ansi_code(cls, ansi: str, last_state: TextColor = None,
+                          styles: StyleTable = None) -> Iterator[Tuple[str, int]]:
+        '''
+        Yields the (text, style_id) runs of one line, style ids are interned in styles.
+        last_state is updated in place so it can be carried to the next line.
+        '''
+        last_end = 0  # the index of the last end of a code we've seen
+        state_color = last_state if last_state is not None else Ansi2Image.TextColor()
+        if styles is None:
+            styles = Ansi2Image.StyleTable()
+        style_id = None
+        for match in _ANSI_SEQUENCES.finditer(ansi):
+            start = match.start()
+            if start > last_end:
+                if style_id is None:
+                    style_id = styles.intern(state_color)
+                yield ansi[last_end:start], style_id
+            last_end = match.end()
 
-        def _rendered_width(text: str):
-            try:
-                (_, _, bb_w, bb_h) = font.getbbox(text)
-                pad = 4
-                cw = max(200, int(bb_w) + pad * 2)
-                ch = max(200, int(bb_h) + pad * 2)
-                im = Image.new("RGB", (cw, ch), (0, 0, 0))
-                d = ImageDraw.Draw(im)
-                d.fontmode = "RGB"
-                try:
-                    d.text((pad, pad), text=text, font=font, fill=(255, 255, 255),
-                       features=['-liga', '-clig', '-calt'])
-                except (KeyError, AttributeError):
-                    # libraqm not available, fall back to basic rendering
-                    d.text((pad, pad), text=text, font=font, fill=(255, 255, 255))
-
-                pixels = im.load()
-                lo, hi = cw, -1
-                for yy in range(ch):
-                    for xx in range(cw):
-                        r, g, b = pixels[xx, yy]
-                        if r or g or b:
-                            if xx < lo: lo = xx
-                            if xx > hi: hi = xx
-                del d, im
-                if hi < 0:
-                    return None
-                return hi - lo + 1
-            except Exception:
-                return None
+            params, command = match.groups()
+
+            # ESC [          = Control Sequence Introducer
+            # ESC [ n m      = Select Graphic Rendition (Sets colors and style of the characters following this code)
+            if command != "m" or params[:1] in ('<', '=', '>', '?'):
+                continue
+
+            state_color.apply_sgr(params)
+            style_id = None
+
+        if last_end < len(ansi):
+            if style_id is None:
+                style_id = styles.intern(state_color)
+            yield ansi[last_end:], style_id
+
+    @classmethod
+    def _handle_ansi_bytes(cls, ansi: bytes, last_state: TextColor, styles: StyleTable,
+                           errors: str = DEFAULT_ERRORS) -> Iterator[Tuple[str, int]]:
+        '''
+        _handle_ansi_code of an undecoded line: sequences are matched on the bytes and
+        only the text runs are decoded, errors is a codec error handler name.
+        '''
+        last_end = 0
+        style_id = None
+        for match in _ANSI_SEQUENCES_BYTES.finditer(ansi):
+            start = match.start()
+            if start > last_end:
+                if style_id is None:
+                    style_id = styles.intern(last_state)
+                yield ansi[last_end:start].decode('utf-8', errors), style_id
+            last_end = match.end()
+
+            params, command = match.groups()
+            if command != b'm' or params[:1] in (b'<', b'=', b'>', b'?'):
+                continue
+
+            last_state.apply_sgr(params.decode('ascii'))
+            style_id = None
+
+        if last_end < len(ansi):
+            if style_id is None:
+                style_id = styles.intern(last_state)
+            yield ansi[last_end:].decode('utf-8', errors), style_id
+
+    @classmethod
+    def _handle_terminal(cls, ansi: str, state: TextColor, styles: StyleTable, screen: Screen) -> None:
+        '''
+        Feeds one chunk of text to a virtual terminal screen, applying SGR to state
+        and every other CSI sequence or control character to the screen.
+        '''
+        last_end = 0
+        style_id = None
+        for match in _TERMINAL_SEQUENCES.finditer(ansi):
+            start = match.start()
+            if start > last_end:
+                if style_id is None:
+                    style_id = styles.intern(state)
+                screen.write(ansi[last_end:start], style_id)
+            last_end = match.end()
+
+            params, command, control = match.groups()
+            if control is not None:
+                screen.control(control)
+            elif command == 'm':
+                if params[:1] not in ('<', '=', '>', '?'):
+                    state.apply_sgr(params)
+                    style_id = None
+            elif command is not None:
+                if style_id is None:
+                    style_id = styles.intern(state)
+                # Erased cells keep the current background, when it is not the default one
+                erase_style = style_id if styles[style_id].background_color != state._background else None
+                screen.csi(params, command, erase_style)
+
+        if last_end < len(ansi):
+            if style_id is None:
+                style_id = styles.intern(state)
+            screen.write(ansi[last_end:], style_id)
 
-        # Advance per cell = pixel distance between the first and last glyphs,
-        # divided by the number of gaps. Using a large N averages out per-glyph
-        # pixel-rounding so the result converges to the font's true advance.
-        n = 32
-        w_one = _rendered_width(char)
-        w_many = _rendered_width(char * n)
-        if w_one is not None and w_many is not None and w_many > w_one:
-            advance = float(w_many - w_one) / float(n - 1)
+    @classmethod
+    def _sgr_prescan(cls, lines: List[str], indexes: Iterable[int], state: TextColor) -> dict:
+        '''
+        Returns {line index: state key} at the start of each requested line.
+        Only SGR sequences are looked at, text is not split into runs.
+        '''
+        wanted = sorted(set(indexes))
+        result = {}
+        pos = 0
+        for n, line in enumerate(lines):
+            while pos < len(wanted) and wanted[pos] <= n:
+                result[wanted[pos]] = state.key()
+                pos += 1
+            if pos >= len(wanted):
+                break
+            if isinstance(line, bytes):
+                matches = (m.group(1).decode('ascii') for m in _SGR_SEQUENCES_BYTES.finditer(line.replace(b'\r', b'')))
+            else:
+                matches = (m.group(1) for m in _SGR_SEQUENCES.finditer(line.replace('\r', '')))
+            for params in matches:
+                if params[:1] not in ('<', '=', '>', '?'):
+                    state.apply_sgr(params)
+
+        for n in wanted[pos:]:
+            result[n] = state.key()
+        return result
+
+    def load_from_file(self, filename: str, mapped: bool = False):
+        '''
+        Lines are kept as bytes, the parser only decodes their text runs (with the errors policy).
+        With mapped the file is not read: lines are indexed and read when used (see MappedLines),
+        so select() of a range of a huge file only reads that range. The file stays open until
+        close() or the next load.
+        '''
+        self.close()
+        self.stats = RenderStats()
+        with self.stats.stage('load'):
+            if mapped:
+                self.lines = MappedLines(filename, encoding=None)
+            else:
+                with open(filename, 'rb') as f:
+                    lines = f.readlines()
+                # Same line ends as text mode, where a CR not followed by LF also ends a line
+                if any(line.count(b'\r') > line.endswith(b'\r\n') for line in lines):
+                    lines = [part for line in lines for part in line.splitlines(True)]
+                self.lines = lines
+        self._document = None
+
+    def select(self, start: Optional[int] = None, stop: Optional[int] = None):
+        ''' Keeps the loaded lines start to stop (slice semantics), rendered from the default colors '''
+        if isinstance(self.lines, MappedLines):
+            self.lines = self.lines.view(start, stop)
         else:
-            # Fallback to the font's reported advance width
-            advance = float(font.getlength(char))
+            self.lines = self.lines[start:stop]
+        self._document = None
 
-        ascent, descent = font.getmetrics()
+    def load(self, stream: io.TextIOWrapper):
+        self.close()
+        self.stats = RenderStats()
+        with self.stats.stage('load'):
+            self.lines = stream.readlines()
+        self._document = None
 
-        w = float(advance)
-        h = float(ascent + descent)
-        return w, h
+    def loads(self, text: str):
+        self.close()
+        self.stats = RenderStats()
+        with self.stats.stage('load'):
+            self.lines = text.split('\n')
+        self._document = None
 
-    def calc_size(self, width: bool = True, height: bool = True, margin: float = 0.02) -> None:
-        if len(self.lines) == 0:
-            raise Exception('Data is empty')
+    def close(self):
+        ''' Closes the file of lines loaded with mapped=True, they can not be rendered after it '''
+        if isinstance(self.lines, MappedLines):
+            self.lines.close()
 
-        max_width = max(len(self.escape_ansi(l).strip('\n')) for l in self.lines)
+    def __enter__(self):
+        return self
 
-        fnt = TrueTypeFont(name=self.font_name, size=self.font_size)
-        (w, h) = self.textlength(fnt.truetype)
+    def __exit__(self, *exc):
+        self.close()
 
-        if margin > 0:
-            self.margin = float((max_width * w) * margin)
+    @classmethod
+    def get_default_font_name(cls):
+        return cls.font_name
+
+    @classmethod
+    def textlength(cls, font: 'FreeTypeFont'):
+        # Cell advance and height are cached per font path, face index and size
+        return metrics_cache.get(font)
+
+    @property
+    def renderer(self) -> 'Renderer':
+        ''' Renderer of the current settings, rebuilt only when they change '''
+        r = self._renderer
+        if r is None or r.settings != (self.font_name, self.font_size, float(self.line_height), self.palette,
+                                       self.foreground_color, self.background_color,
+                                       self.min_margin, self.max_margin, bool(self.indexed)):
+            r = self._renderer = Renderer(
+                font_name=self.font_name, font_size=self.font_size, line_height=self.line_height,
+                palette=self.palette, foreground=self.foreground_color, background=self.background_color,
+                min_margin=self.min_margin, max_margin=self.max_margin, indexed=self.indexed)
+        return r
+
+    def _font(self) -> Tuple['FreeTypeFont', Tuple[float, float]]:
+        r = self.renderer
+        return r.font, r.cell
+
+    def _layout(self, document: 'Ansi2Image.Document', margin: float = 0.02) -> Tuple[float, float, float]:
+        ''' Returns (margin, width, height) of the canvas needed by a document '''
+        return self.renderer.layout(document, margin, default_margin=self.margin)
+
+    def _parse(self, document: 'Ansi2Image.Document') -> 'Ansi2Image.Document':
+        ''' Parses a document once, counting its lines, runs and styles '''
+        if document._runs is None:
+            with self.stats.stage('parse'):
+                document.parse()
+            self.stats.count('lines', len(document.runs))
+            self.stats.count('runs', sum(len(runs) for runs in document.runs))
+        self.stats.counters['styles'] = len(document.styles)
+        return document
 
-        if self.margin < self.min_margin:
-            self.margin = float(self.min_margin)
+    def calc_size(self, width: bool = True, height: bool = True, margin: float = 0.02) -> None:
+        if len(self.lines) == 0:
+            raise Exception('Data is empty')
 
-        if self.margin > self.max_margin:
-            self.margin = float(self.max_margin)
+        with self.stats.stage('metrics'):
+            # The font and its cell metrics are loaded when the renderer is built
+            self._font()
+        document = self._parse(self.document)
+        with self.stats.stage('layout'):
+            (self.margin, w, h) = self._layout(document, margin)
 
         if width:
-            self.width = float((max_width * w) + self.margin * 2.0) + 1.0
+            self.width = w
         if height:
-            self.height = float((len(self.lines) * h) + self.margin * 2.0)
-
-    def generate_image(self, format: str = 'png') -> bytes:
+            self.height = h
+
+    def _draw_runs(self, img: 'Image.Image', lines: Iterable[List[Tuple[str, int]]], styles: 'Ansi2Image.StyleTable',
+                   x: float, y: float, y_offset: int = 0, index: Optional[ColorIndex] = None) -> float:
+        return self.renderer.draw(img, lines, styles, x, y, y_offset=y_offset, index=index)
+
+    def _render(self, document: 'Ansi2Image.Document', size: Tuple[float, float], margin: float) -> 'Image.Image':
+        return self.renderer.draw_image(self._parse(document), size, margin, stats=self.stats)
+
+    def _notify(self) -> None:
+        if self.observer is not None:
+            self.observer(self.stats.as_dict())
+
+    @staticmethod
+    def _encode(img: 'Image.Image', format: str = 'png', profile: str = DEFAULT_PROFILE) -> bytes:
+        return Encoder.encode(img, format=format, profile=profile)
+
+    def generate_image(self, format: str = 'png', workers: int = 1, executor: Optional['Executor'] = None,
+                       profile: str = DEFAULT_PROFILE) -> bytes:
+        '''
+        Renders the loaded text. With workers > 1 (or an executor) horizontal bands are
+        rendered on a process pool, the screen-buffer mode is always rendered serially.
+        profile is one of Encoder.profiles(): fast, balanced or smallest.
+        With a RenderCache, an image of the same text and options is read back instead of rendered.
+        '''
         if len(self.lines) == 0:
             raise Exception('Data is empty')
 
-        #print(Ansi2Image.escape_ansi(''.join(self.lines)))
-        #Color.p(''.join(lines), out=sys.stdout)
-
-        img = Image.new("RGB", (int(self.width), int(self.height)), self.background_color)
-        img1 = ImageDraw.Draw(img)
-        img1.fontmode = "RGB"
-
-        fnt = TrueTypeFont(name=self.font_name, size=self.font_size)
-        (width, height) = self.textlength(fnt.truetype)
-
-        y = float(self.margin)
-        last_line_color = None
-        for line in self.lines:
-            #print([m for m in Ansi2Image._handle_ansi_code(line.replace('\n', ''))])
-            x = float(self.margin)
-            for c in Ansi2Image._handle_ansi_code(line.replace('\n', ''), last_line_color):
-                if c.text and c.background_color is not None:
-                    segment_width = width * len(c.text)
-                    img1.rectangle(
-                        [(x, y), (x + segment_width, y + height - 1)],
-                        fill=c.background_color
-                    )
-                try:
-                    img1.text((x, y), text=c.text, font=fnt.truetype, fill=c.foreground_color,
-                          features=['-liga', '-clig', '-calt'])
-                except (KeyError, AttributeError):
-                    # libraqm not available, fall back to basic rendering
-                    img1.text((x, y), text=c.text, font=fnt.truetype, fill=c.foreground_color)
+        stats = self.stats
+        key = None
+        if self.cache is not None:
+            with stats.stage('cache'):
+                key = self.cache.key(self.lines, self._cache_options(format, profile))
+                data = self.cache.get(key)
+            if data is not None:
+                stats.count('cache_hits')
+                stats.count('encoded_bytes', len(data))
+                self._notify()
+                return data
+            stats.count('cache_misses')
+
+        if (workers > 1 or executor is not None) and self.screen is None:
+            from .libs.parallel import render_bands
+            # Draw calls happen in the workers and are not counted
+            with stats.stage('draw'):
+                img = render_bands(self, workers=max(1, workers), executor=executor)
+            stats.count('pixels', img.width * img.height)
+        else:
+            with stats.stage('draw'):
+                img = self._render(self.document, (self.width, self.height), self.margin)
+        with stats.stage('encode'):
+            data = self._encode(img, format=format, profile=profile)
+        stats.count('encoded_bytes', len(data))
+        if key is not None:
+            with stats.stage('cache'):
+                self.cache.put(key, data)
+        self._notify()
+        return data
+
+    def _cache_options(self, format: str, profile: str) -> dict:
+        ''' Everything but the text that changes the output of generate_image '''
+        r = self.renderer
+        p = self.palette
+        return dict(face=r.face, line_height=r.line_height, size=(self.width, self.height), margin=self.margin,
+                    min_margin=self.min_margin, max_margin=self.max_margin, foreground=r.foreground,
+                    background=r.background, palette=(p.foreground, p.background, p.bold_is_bright, p.ansi, p.colors),
+                    screen=self.screen, scrollback=self.scrollback, indexed=bool(self.indexed),
+                    errors=self.errors, format=format, profile=profile)
+
+    def iter_pages(self, max_lines: Optional[int] = None, max_height: Optional[int] = None,
+                   stream: Optional[Iterable[str]] = None, margin: float = 0.02) -> Iterator['Image.Image']:
+        '''
+        Renders the text one page at a time, limited by lines or by height in pixels.
+        Lines are read from stream (or the loaded lines) only when their page is drawn and
+        the SGR state is carried across pages, so memory is bounded by one page.
+        '''
+        max_lines = self.renderer.page_lines(max_lines, max_height)
+
+        styles = Ansi2Image.StyleTable()
+        if self.screen is not None:
+            # The whole screen must be emulated before the final state is known
+            all_runs = self._parse(self.document).runs
+            styles = self.document.styles
+            documents = (
+                Ansi2Image.Document.from_runs(all_runs[i:i + max_lines], styles, palette=self.palette)
+                for i in range(0, len(all_runs), max_lines)
+            )
+        else:
+            state = Ansi2Image.TextColor(foreground=self.foreground_color, background=self.background_color,
+                                         palette=self.palette)
+            source = iter(stream if stream is not None else self.lines)
+            documents = (
+                Ansi2Image.Document(chunk, palette=self.palette, state=state, styles=styles, errors=self.errors)
+                for chunk in iter(lambda: list(itertools.islice(source, max_lines)), [])
+            )
+
+        for document in documents:
+            self._parse(document)
+            with self.stats.stage('layout'):
+                m, width, height = self._layout(document, margin)
+            with self.stats.stage('draw'):
+                img = self.renderer.draw_image(document, (width, height), m, stats=self.stats)
+            yield img
+
+    @staticmethod
+    def page_filename(filename: str, page: int) -> str:
+        ''' out.png -> out-0001.png '''
+        root, ext = os.path.splitext(filename)
+        return f'{root}-{page:04d}{ext}'
+
+    def save_pages(self, filename: str, format: str = 'png', max_lines: Optional[int] = None,
+                   max_height: Optional[int] = None, stream: Optional[Iterable[str]] = None,
+                   profile: str = DEFAULT_PROFILE) -> List[str]:
+        files = []
+        self.stats = RenderStats()
+        for n, img in enumerate(self.iter_pages(max_lines=max_lines, max_height=max_height, stream=stream), 1):
+            name = self.page_filename(filename, n)
+            with self.stats.stage('encode'):
+                data = self._encode(img, format=format, profile=profile)
+            self.stats.count('encoded_bytes', len(data))
+            with open(name, 'wb') as f:
+                f.write(data)
+            files.append(name)
+            del img
+        self.stats.count('pages', len(files))
+        self._notify()
+        return files
+
+    @staticmethod
+    def _draw_text(draw: 'ImageDraw.ImageDraw', font: 'FreeTypeFont', text: str, x: float, y: float,
+                   foreground: Tuple[int]):
+        # Fallback for runs that need shaping (wide, combining or control characters)
+        features = _text_features()
+        if features is not None:
+            try:
+                draw.text((x, y), text=text, font=font, fill=foreground, features=features)
+                return
+            except (KeyError, AttributeError):
+                pass
+        # libraqm not available, basic rendering has no ligatures
+        draw.text((x, y), text=text, font=font, fill=foreground)
+
+    def save_image(self, filename: str, format: str = 'png', workers: int = 1, profile: str = DEFAULT_PROFILE):
+        with(open(filename, 'wb')) as f:
+            f.write(self.generate_image(format=format, workers=workers, profile=profile))
 
-                x += float(width) * len(c.text)
-                last_line_color = c
-            y += float(height) * float(self.line_height)
+class Renderer(object):
+    '''
+    Rendering session of one font, size, line height and palette.
 
-        # Converte para bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format=format, subsampling=0, quality=100)
+    The font handle, cell metrics and palette are resolved once at construction and
+    never change, and each call parses and draws into its own document and image, so
+    one instance can render many documents concurrently from a thread pool. Glyph
+    tiles, font handles and metrics are shared through the (locked) process caches.
 
-        return img_byte_arr.getvalue()
+    With indexed=True documents are drawn on an 8-bit palette (P mode) canvas, see
+    ColorIndex, and fall back to RGB when their colors do not fit in 256 entries.
+    '''
+
+    def __init__(self, font_name: str = Ansi2Image.font_name, font_size: int = 13, line_height: float = 1.0,
+                 palette: Palette = None, screen: Optional[Tuple[int, int]] = None, scrollback: int = 1000,
+                 foreground: Tuple[int] = None, background: Tuple[int] = None,
+                 min_margin: float = Ansi2Image.min_margin, max_margin: float = Ansi2Image.max_margin,
+                 indexed: bool = False):
+        self.font_name = font_name
+        self.font_size = font_size
+        self.line_height = float(line_height)
+        self.palette = palette if palette is not None else Palette.default()
+        self.screen = screen
+        self.scrollback = scrollback
+        self.foreground = tuple(foreground) if foreground is not None else self.palette.foreground
+        self.background = tuple(background) if background is not None else self.palette.background
+        self.min_margin = min_margin
+        self.max_margin = max_margin
+        self.indexed = bool(indexed)
+
+        self.font = TrueTypeFont(name=font_name, size=font_size).truetype
+        self.cell = metrics_cache.get(self.font)
+        self.face = metrics_cache._key(self.font)
+
+    def __reduce__(self):
+        # Font handles can not be pickled, other processes resolve them again from the settings
+        return (Renderer, (self.font_name, self.font_size, self.line_height, self.palette, self.screen,
+                           self.scrollback, self.foreground, self.background, self.min_margin, self.max_margin,
+                           self.indexed))
+
+    @property
+    def settings(self) -> tuple:
+        return (self.font_name, self.font_size, self.line_height, self.palette,
+                self.foreground, self.background, self.min_margin, self.max_margin, self.indexed)
+
+    def document(self, source: Union[str, Iterable[str], 'Ansi2Image.Document']) -> 'Ansi2Image.Document':
+        ''' Parsed document of a text, a list of lines or an already built document '''
+        if isinstance(source, Ansi2Image.Document):
+            return source.parse()
+        lines = io.StringIO(source).readlines() if isinstance(source, str) else list(source)
+        return Ansi2Image.Document(lines, foreground=self.foreground, background=self.background,
+                                   palette=self.palette, screen=self.screen, scrollback=self.scrollback).parse()
+
+    def layout(self, document: 'Ansi2Image.Document', margin: float = 0.02,
+               default_margin: float = 0.0) -> Tuple[float, float, float]:
+        '''
+        Returns (margin, width, height) of the canvas needed by a document.
+        margin is a fraction of the text width, default_margin (pixels) is used when it is 0.
+        '''
+        (w, h) = self.cell
+        max_width = document.max_width
+
+        m = default_margin
+        if margin > 0:
+            m = float((max_width * w) * margin)
+
+        if m < self.min_margin:
+            m = float(self.min_margin)
+
+        if m > self.max_margin:
+            m = float(self.max_margin)
+
+        lines = len(document.runs)
+        width = float((max_width * w) + m * 2.0) + 1.0
+        height = float((max(0, lines - 1) * h * self.line_height) + (h if lines else 0) + m * 2.0)
+        return m, width, height
+
+    def page_lines(self, max_lines: Optional[int] = None, max_height: Optional[int] = None) -> int:
+        ''' Lines per page, from a line count or from the page height in pixels '''
+        if max_lines is None and max_height is None:
+            raise ValueError('Define max_lines or max_height')
+
+        if max_lines is None:
+            line_step = self.cell[1] * self.line_height
+            max_lines = int((max_height - self.cell[1] - self.max_margin * 2.0) // line_step) + 1
+        return max(1, int(max_lines))
+
+    def draw(self, img: 'Image.Image', lines: Iterable[List[Tuple[str, int]]], styles: 'Ansi2Image.StyleTable',
+             x: float, y: float, y_offset: int = 0, index: Optional[ColorIndex] = None,
+             stats: Optional[RenderStats] = None, line_end: bool = True) -> float:
+        '''
+        Draws lines of runs starting at (x, y), returns the y of the next line.
+        y_offset (in pixels) is subtracted when drawing into a canvas that starts below the top of the image.
+        Backgrounds are painted first, in bulk, then the glyphs are drawn over them.
+        index is the ColorIndex of a P mode canvas. Draw calls are counted in stats.
+        line_end is False when the runs are only the start of their lines, see draw_backgrounds.
+        '''
+        from PIL import ImageDraw
+
+        lines = lines if isinstance(lines, list) else list(lines)
+        self.draw_backgrounds(img, lines, styles, x, y, y_offset, index=index, stats=stats, line_end=line_end)
+
+        font = self.font
+        draw = ImageDraw.Draw(img)
+        # Blending palette indexes makes no sense, shaped text on a P canvas is not antialiased
+        draw.fontmode = "RGB" if index is None else "1"
+        (width, height) = self.cell
+        line_step = float(height) * self.line_height
+        calls = shaped = 0
+        for runs in lines:
+            cx = x
+            cy = y - y_offset
+            for text, style_id in runs:
+                style = styles[style_id]
+                text = style.display(text)
+                if text.strip() != '':
+                    calls += 1
+                    if not glyph_atlas.draw(img, font, text, cx, cy, self.cell, style.foreground_color, self.face,
+                                            index=index, background=style.background_color or self.background):
+                        shaped += 1
+                        Ansi2Image._draw_text(draw, font, text, cx, cy, style.foreground_color if index is None else
+                                              index.color(style.foreground_color))
+
+                cx += float(width) * len(text)
+            y += line_step
+
+        if stats is not None:
+            stats.count('draw_calls', calls)
+            # Runs drawn by Pillow's text layout instead of the glyph atlas
+            stats.count('shaped_calls', shaped)
+        return y
+
+    def draw_backgrounds(self, img: 'Image.Image', lines: List[List[Tuple[str, int]]],
+                         styles: 'Ansi2Image.StyleTable', x: float, y: float, y_offset: int = 0,
+                         index: Optional[ColorIndex] = None, stats: Optional[RenderStats] = None,
+                         line_end: bool = True) -> None:
+        '''
+        Paints the cell backgrounds that differ from the canvas.
+
+        The lines that have them become the rows of a cols x rows grid (RGB, or palette indexes
+        on a P canvas), expanded to pixel
+        columns by one NEAREST affine transform and pasted as bands of adjacent rows, so there
+        is no drawing call per run. Cell i covers the pixels int(x + i * w) to int(x + (i + 1) * w)
+        and a line the rows int(y) to int(y + h). Like a rectangle drawn to x + w * len(run), a run
+        also paints the first pixel column after it when no background follows; with line_end
+        False the column after the last run is left alone, for callers drawing part of a line.
+        '''
+        from PIL import Image
+
+        (width, height) = self.cell
+        line_step = float(height) * self.line_height
+        pixel = bytes if index is None else (lambda color: bytes([index.color(color)]))
+        fill = self.background if index is None else index.color(self.background)
+        depth = 3 if index is None else 1
+        canvas = pixel(self.background)
+        colors = {}
+        # Styles with a background, even one of the canvas color, cover the column a run before them paints
+        covers = set()
+        rows = []
+        tops = []
+        heights = []
+        overhangs = []
+        for runs in lines:
+            for _, style_id in runs:
+                if style_id not in colors:
+                    bg = styles[style_id].background_color
+                    colors[style_id] = pixel(bg) if bg is not None else canvas
+                    if bg is not None:
+                        covers.add(style_id)
+            if any(colors[style_id] != canvas for _, style_id in runs):
+                rows.append(b''.join(colors[style_id] * len(text) for text, style_id in runs))
+                tops.append(int(y - y_offset))
+                heights.append(int(y + height) - int(y))
+                # Cells where a run with a background is followed by one without it
+                ends = []
+                cols = 0
+                last = canvas
+                for text, style_id in runs:
+                    if text and style_id not in covers and last != canvas:
+                        ends.append((cols, last))
+                    cols += len(text)
+                    last = colors[style_id] if text else last
+                if line_end and last != canvas:
+                    ends.append((cols, last))
+                overhangs.append(ends)
+            y += line_step
+
+        if not rows:
+            return
+
+        cols = max(len(row) for row in rows) // depth
+        grid = Image.frombytes(img.mode, (cols, len(rows)),
+                               b''.join(row + canvas * (cols - len(row) // depth) for row in rows))
+        # Only the columns of the runs are pasted, the rest of a line is left as it is
+        left = max(0, int(x))
+        right = min(img.width, int(x + cols * width) + (1 if line_end else 0))
+        if right <= left:
+            return
+        # Output pixel px samples the grid at (px + 0.5) * a + c = (left + px + 1 - x) / w (minus a rounding guard)
+        pixels = grid.transform((right - left, len(rows)), Image.AFFINE,
+                                (1.0 / width, 0.0, (left + 0.5 - 1e-7 - x) / width, 0.0, 1.0, 0.0),
+                                resample=Image.NEAREST, fillcolor=fill)
+
+        for n, ends in enumerate(overhangs):
+            for col, color in ends:
+                px = int(x + col * width)
+                if left <= px < right:
+                    pixels.putpixel((px - left, n), tuple(color) if index is None else color[0])
+
+        start = 0
+        for n in range(1, len(rows) + 1):
+            # Rows of the same height that touch each other are pasted at once
+            if n < len(rows) and tops[n] - tops[n - 1] == heights[n - 1] and heights[n] == heights[start]:
+                continue
+            band = pixels.crop((0, start, pixels.width, n)).resize((pixels.width, (n - start) * heights[start]),
+                                                                   Image.NEAREST)
+            img.paste(band, (left, tops[start]))
+            if stats is not None:
+                stats.count('rectangles')
+            start = n
+
+    def color_index(self, document: 'Ansi2Image.Document') -> Optional[ColorIndex]:
+        ''' Palette of a document on an indexed renderer, None when it must be drawn in RGB '''
+        return ColorIndex.for_document(document, self.background) if self.indexed else None
+
+    def canvas(self, size: Tuple[int, int], index: Optional[ColorIndex] = None) -> 'Image.Image':
+        from PIL import Image
+
+        if index is None:
+            return Image.new("RGB", size, self.background)
+        img = Image.new("P", size, index.color(self.background))
+        index.putpalette(img)
+        return img
+
+    def draw_image(self, document: 'Ansi2Image.Document', size: Tuple[float, float], margin: float,
+                   stats: Optional[RenderStats] = None) -> 'Image.Image':
+        index = self.color_index(document)
+        img = self.canvas((int(size[0]), int(size[1])), index)
+        self.draw(img, document.runs, document.styles, float(margin), float(margin), index=index, stats=stats)
+        if stats is not None:
+            stats.count('pixels', img.width * img.height)
+        return img
+
+    def render_image(self, source: Union[str, Iterable[str], 'Ansi2Image.Document'],
+                     margin: float = 0.02) -> 'Image.Image':
+        document = self.document(source)
+        if len(document.runs) == 0:
+            raise Exception('Data is empty')
+        m, width, height = self.layout(document, margin)
+        return self.draw_image(document, (width, height), m)
+
+    def render(self, source: Union[str, Iterable[str], 'Ansi2Image.Document'], format: str = 'png',
+               margin: float = 0.02, profile: str = DEFAULT_PROFILE) -> bytes:
+        ''' Renders a text, a list of lines or a document and returns the encoded image '''
+        return Ansi2Image._encode(self.render_image(source, margin=margin), format=format, profile=profile)
+
+
+def _save_stats(stats: RenderStats) -> None:
+    ''' Prints (--stats) and/or saves (--stats-file) the stats of the render '''
+    if not Configuration.stats and Configuration.stats_file is None:
+        return
+    data = json.dumps(stats.as_dict(), indent=2)
+    if Configuration.stats:
+        print(data)
+    if Configuration.stats_file is not None:
+        with open(Configuration.stats_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+        Logger.pl('{+} {C}Stats saved at {O}%s{W}' % Configuration.stats_file)
 
-    def save_image(self, filename: str, format: str = 'png'):
-        with(open(filename, 'wb')) as f:
-            f.write(self.generate_image(format=format))
 
 def run():
 
+    # Only the command line tool wraps stdout, embedding applications keep their streams
+    Color.init()
+    if Arguments.stats_to_stdout():
+        # The JSON of --stats is printed alone on stdout, so it can be piped
+        Color.out = sys.stderr
     Color.pl(Configuration.get_banner())
     Configuration.initialize()
 
-    o = Ansi2Image(Configuration.size[0], Configuration.size[1], font_name=Configuration.font.name, font_size=13)
+    o = Ansi2Image(Configuration.size[0], Configuration.size[1], font_name=Configuration.font.name, font_size=13,
+                   palette=Configuration.palette, screen=Configuration.screen, scrollback=Configuration.scrollback,
+                   indexed=Configuration.indexed, errors=Configuration.errors)
+    errors = codec_errors(Configuration.errors)
 
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     Logger.pl('{+} {C}Start time {O}%s{W}' % timestamp)
 
     try:
 
-        if Configuration.filename == '-':
-            o.load(io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8'))
-        else:
-            o.load_from_file(Configuration.filename)
+        cache = None
+        if Configuration.cache is not None:
+            cache = RenderCache(Configuration.cache or None, max_bytes=Configuration.cache_size * 1024 * 1024)
+            o.cache = cache
+
+        if Configuration.serve is not None:
+            from .server import RenderServer
+            server = RenderServer(workers=Configuration.workers, queue_size=Configuration.queue,
+                                  timeout=Configuration.timeout, font_name=Configuration.font.name, font_size=13,
+                                  palette=Configuration.palette, profile=Configuration.profile,
+                                  indexed=Configuration.indexed)
+            server.bind(Configuration.serve)
+            Logger.pl('{+} {C}Render server listening at {O}%s{C} with {O}%d{C} workers{W}' % (
+                Configuration.serve, server.workers))
+            server.serve_forever(Configuration.serve)
+
+        elif Configuration.batch:
+            from .batch import BatchConverter
+            converter = BatchConverter(
+                Configuration.out_file, format=Configuration.format, workers=Configuration.workers,
+                font_name=Configuration.font.name, font_size=13, palette=Configuration.palette,
+                screen=Configuration.screen, scrollback=Configuration.scrollback,
+                page_lines=Configuration.page_lines, page_height=Configuration.page_height,
+                profile=Configuration.profile, indexed=Configuration.indexed, cache=cache,
+                errors=Configuration.errors, embed_font=Configuration.embed_font)
+
+            manifest = None
+            if Configuration.manifest == '-':
+                manifest = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+            elif Configuration.manifest is not None:
+                manifest = open(Configuration.manifest, 'r', encoding='utf-8')
+            try:
+                inputs = BatchConverter.collect(Configuration.filenames, manifest)
+            finally:
+                if manifest is not None:
+                    manifest.close()
+
+            summary = converter.run(inputs)
+            converter.write_summary(summary, Configuration.summary)
+
+            for r in summary['files']:
+                if r['error'] is not None:
+                    Logger.pl('{!} {R}Error converting {O}%s{R}: %s{W}' % (r['input'], r['error']))
+            Logger.pl('{+} {C}Converted {O}%d{C} of {O}%d{C} files in {O}%.2f{C}s, summary saved at {O}%s{W}' % (
+                summary['succeeded'], summary['total'], summary['seconds'], Configuration.summary))
+            if cache is not None:
+                Logger.pl('{+} {C}Render cache: {O}%d{C} hits, {O}%d{C} misses, {O}%d{C} bytes saved{W}' % (
+                    summary['cache']['hits'], summary['cache']['misses'], summary['cache']['bytes_saved']))
+
+        elif Configuration.recording:
+            # Timed recordings become animations, frames only redraw the cells that changed
+            from .recording import Animator, Recording
+            recording = Recording.open(Configuration.filename, timing=Configuration.timing,
+                                       size=Configuration.screen)
+            renderer = Renderer(font_name=Configuration.font.name, font_size=13, palette=Configuration.palette,
+                                indexed=Configuration.indexed)
+            animator = Animator(renderer, fps=Configuration.fps, idle_limit=Configuration.idle_limit)
+            info = animator.save(recording, Configuration.out_file, format=Configuration.format)
+            Logger.pl('{+} {C}Frames saved: {O}%d{C}, duration {O}%.2f{C}s{W}' % (info['frames'], info['duration']))
+
+        elif Configuration.follow is not None:
+            # Only the lines appended since the last update are read and drawn
+            from .incremental import IncrementalRenderer
+            renderer = Renderer(font_name=Configuration.font.name, font_size=13, palette=Configuration.palette,
+                                indexed=Configuration.indexed)
+            follower = IncrementalRenderer(renderer, Configuration.filename, max_lines=Configuration.page_lines,
+                                           max_height=Configuration.page_height, errors=Configuration.errors)
+            Logger.pl('{+} {C}Following {O}%s{C}, press Ctrl+C to stop{W}' % Configuration.filename)
+            while True:
+                added = follower.update()
+                if added > 0:
+                    files = follower.save(Configuration.out_file, format=Configuration.format,
+                                          profile=Configuration.profile)
+                    Logger.pl('{+} {C}Lines added: {O}%d{C} (total {O}%d{C}), saved {O}%s{W}' % (
+                        added, follower.stats['lines'], ', '.join(files)))
+                time.sleep(Configuration.follow)
+
+        elif Configuration.format in VECTOR_FORMATS:
+            # Vector output is streamed line by line, nothing is rasterized
+            from .vector import VectorWriter
+            renderer = Renderer(font_name=Configuration.font.name, font_size=13, palette=Configuration.palette,
+                                screen=Configuration.screen, scrollback=Configuration.scrollback)
+            if Configuration.mapped:
+                stream = MappedLines(Configuration.filename, errors=errors)
+                if Configuration.line_range is not None:
+                    stream = stream.view(*Configuration.line_range)
+            elif Configuration.filename == '-':
+                stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors=errors)
+            else:
+                stream = io.TextIOWrapper(open(Configuration.filename, 'rb'), encoding='utf-8', errors=errors)
+            with stream:
+                info = VectorWriter.save(renderer, stream, Configuration.out_file, format=Configuration.format,
+                                        embed_font=Configuration.embed_font)
+            Logger.pl('{+} {C}Lines written: {O}%d{W}' % info['lines'])
+
+        elif Configuration.page_lines is not None or Configuration.page_height is not None:
+            # Pages are read from the input as they are drawn
+            if Configuration.mapped:
+                o.load_from_file(Configuration.filename, mapped=True)
+                if Configuration.line_range is not None:
+                    o.select(*Configuration.line_range)
+                stream = o.lines
+            elif Configuration.filename == '-':
+                stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors=errors)
+            else:
+                stream = io.TextIOWrapper(open(Configuration.filename, 'rb'), encoding='utf-8', errors=errors)
+            with stream:
+                files = o.save_pages(Configuration.out_file, format=Configuration.format,
+                                     max_lines=Configuration.page_lines, max_height=Configuration.page_height,
+                                     stream=stream, profile=Configuration.profile)
+            Logger.pl('{+} {C}Pages saved: {O}%d{W}' % len(files))
+            _save_stats(o.stats)
 
-        o.calc_size()
-        o.save_image(Configuration.out_file, format=Configuration.format)
+        else:
+            if Configuration.filename == '-':
+                o.load(io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors=errors))
+            else:
+                o.load_from_file(Configuration.filename, mapped=Configuration.mapped)
+            if Configuration.line_range is not None:
+                o.select(*Configuration.line_range)
+
+            with o:
+                o.calc_size()
+                o.save_image(Configuration.out_file, format=Configuration.format, workers=Configuration.workers,
+                             profile=Configuration.profile)
+            if cache is not None:
+                stats = cache.stats()
+                Logger.pl('{+} {C}Render cache: {O}%s{C}, {O}%d{C} bytes saved{W}' % (
+                    'hit' if stats['hits'] else 'miss', stats['bytes_saved']))
+            _save_stats(o.stats)
 
     except Exception as e:
         Color.pl('\n{!} {R}Error:{O} %s{W}' % str(e))
@@ -564,6 +1329,6 @@ def run():
 
     timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     Logger.pl('{+} {C}End time {O}%s{W}' % timestamp)
-    print(' ')
+    Color.pl(' ')
 
     sys.exit(0)
@@ -2,6 +2,7 @@
 # -*- coding: UTF-8 -*-
 from argparse import _ArgumentGroup, Namespace
 from .libs.color import Color
+from .libs.encoder import DEFAULT_PROFILE
 
 import argparse, sys, os
 
@@ -16,6 +17,14 @@ class Arguments(object):
         self.verbose = any(['-v' in word for word in sys.argv])
         self.args = self.get_arguments()
 
+    @staticmethod
+    def stats_to_stdout() -> bool:
+        ''' True when --stats is given, known before the banner is printed '''
+        parser = argparse.ArgumentParser(add_help=False)
+        parser.add_argument('--stats', action='store_true', default=False, dest=f'stats')
+        args, _ = parser.parse_known_args()
+        return args.stats
+
     def _verbose(self, msg):
         if self.verbose:
             Color.pl(msg)
@@ -32,8 +41,10 @@ class Arguments(object):
         parser.add_argument('filename',
                             action='store',
                             metavar='[filename]',
+                            nargs='*',
                             type=str,
-                            help=Color.s('File path or {G}-{W} to stdin'))
+                            help=Color.s('File path or {G}-{W} to stdin. '
+                                         'With {G}--batch{W}: files, globs or directories'))
 
         flags = parser.add_argument_group('Options')
         self._add_flags_args(flags)
@@ -46,7 +57,8 @@ class Arguments(object):
                            metavar='[filename]',
                            type=str,
                            dest=f'out_file',
-                           help=Color.s('image output file.'))
+                           help=Color.s('image output file ({G}.png{W}, {G}.jpg{W}, {G}.webp{W}, {G}.avif{W}, '
+                                        '{G}.svg{W} or {G}.html{W}). Animations: {G}.gif{W}, {G}.png{W} or {G}.webp{W}.'))
 
         flags.add_argument('--font',
                            action='store',
@@ -56,6 +68,238 @@ class Arguments(object):
                            dest=f'font',
                            help=Color.s('font type. (default: {G}JetBrains Mono Regular{W}).'))
 
+        flags.add_argument('--font-dir',
+                           action='append',
+                           metavar='[dir]',
+                           type=str,
+                           default=[],
+                           dest=f'font_dirs',
+                           help=Color.s('extra directory searched for fonts, can be used more than once.'))
+
+        flags.add_argument('--system-fonts',
+                           action='store_true',
+                           default=False,
+                           dest=f'system_fonts',
+                           help=Color.s('also search the fonts installed on the system.'))
+
+        flags.add_argument('--theme',
+                           action='store',
+                           metavar='[file]',
+                           type=str,
+                           dest=f'theme',
+                           help=Color.s('JSON color theme (foreground, background and the 16 ANSI colors).'))
+
+        flags.add_argument('--screen',
+                           action='store',
+                           metavar='[COLSxROWS]',
+                           type=str,
+                           dest=f'screen',
+                           help=Color.s('emulate a terminal of this size (cursor movement, CR and erase), '
+                                        'rendering only its final state. Example: {G}--screen 120x40{W}'))
+
+        flags.add_argument('--scrollback',
+                           action='store',
+                           metavar='[lines]',
+                           type=int,
+                           default=1000,
+                           dest=f'scrollback',
+                           help=Color.s('lines kept above the screen with {G}--screen{W} (default: {G}1000{W}).'))
+
+        flags.add_argument('--timing',
+                           action='store',
+                           metavar='[file]',
+                           type=str,
+                           dest=f'timing',
+                           help=Color.s('timing file of a {G}script -t{W} typescript, renders it as an animation. '
+                                        '{G}.cast{W} (asciinema) inputs need no timing file.'))
+
+        flags.add_argument('--fps',
+                           action='store',
+                           metavar='[frames]',
+                           type=float,
+                           default=10.0,
+                           dest=f'fps',
+                           help=Color.s('maximum frames per second of animations (default: {G}10{W}).'))
+
+        flags.add_argument('--idle-limit',
+                           action='store',
+                           metavar='[seconds]',
+                           type=float,
+                           dest=f'idle_limit',
+                           help=Color.s('longest pause of animations (default: from the recording, or none).'))
+
+        flags.add_argument('--page-lines',
+                           action='store',
+                           metavar='[lines]',
+                           type=int,
+                           dest=f'page_lines',
+                           help=Color.s('split the output in pages with up to this many lines '
+                                        '({G}out.png{W} is saved as {G}out-0001.png{W}, {G}out-0002.png{W}...).'))
+
+        flags.add_argument('--page-height',
+                           action='store',
+                           metavar='[pixels]',
+                           type=int,
+                           dest=f'page_height',
+                           help=Color.s('split the output in pages with up to this height in pixels.'))
+
+        flags.add_argument('--follow',
+                           action='store',
+                           metavar='[seconds]',
+                           nargs='?',
+                           const=2.0,
+                           type=float,
+                           dest=f'follow',
+                           help=Color.s('keep reading the input as it grows and update the image with the new lines '
+                                        'every few seconds (default: {G}2{W}), until interrupted.'))
+
+        flags.add_argument('--mmap',
+                           action='store_true',
+                           default=False,
+                           dest=f'mmap',
+                           help=Color.s('map the input file instead of reading it, lines are only decoded when '
+                                        'drawn (for huge logs).'))
+
+        flags.add_argument('--lines',
+                           action='store',
+                           metavar='[first:last]',
+                           type=str,
+                           dest=f'lines',
+                           help=Color.s('render only these lines of the input file, 1-based and inclusive, either '
+                                        'end may be omitted (e.g. {G}1000:2000{W}), implies {G}--mmap{W}.'))
+
+        flags.add_argument('--tail',
+                           action='store',
+                           metavar='[lines]',
+                           type=int,
+                           dest=f'tail',
+                           help=Color.s('render only the last lines of the input file, implies {G}--mmap{W}.'))
+
+        flags.add_argument('--errors',
+                           action='store',
+                           metavar='[policy]',
+                           type=str,
+                           default='replace',
+                           dest=f'errors',
+                           help=Color.s('what to do with input that is not valid UTF-8: {G}replace{W} the bytes '
+                                        '(default), read them as {G}cp437{W} or stop ({G}strict{W}).'))
+
+        flags.add_argument('--workers',
+                           action='store',
+                           metavar='[count]',
+                           type=int,
+                           default=1,
+                           dest=f'workers',
+                           help=Color.s('worker processes used to render (default: {G}1{W}).'))
+
+        flags.add_argument('--indexed',
+                           action='store_true',
+                           default=False,
+                           dest=f'indexed',
+                           help=Color.s('render on a 256 color palette and save indexed PNG, '
+                                        'falls back to RGB when the text has more colors.'))
+
+        flags.add_argument('--embed-font',
+                           action='store_true',
+                           default=False,
+                           dest=f'embed_font',
+                           help=Color.s('embed the font file in {G}.svg{W} and {G}.html{W} outputs, '
+                                        'by default they reference its family name.'))
+
+        flags.add_argument('--cache',
+                           action='store',
+                           metavar='[dir]',
+                           nargs='?',
+                           const='',
+                           type=str,
+                           dest=f'cache',
+                           help=Color.s('reuse the images of inputs already rendered with the same options, kept '
+                                        'in this directory (default: {G}~/.cache/ansi2image/renders{W}).'))
+
+        flags.add_argument('--cache-size',
+                           action='store',
+                           metavar='[MB]',
+                           type=int,
+                           default=512,
+                           dest=f'cache_size',
+                           help=Color.s('size limit of {G}--cache{W}, least recently used images are removed '
+                                        '(default: {G}512{W}).'))
+
+        flags.add_argument('--stats',
+                           action='store_true',
+                           default=False,
+                           dest=f'stats',
+                           help=Color.s('print the JSON time of each stage (load, parse, metrics, draw, encode) and '
+                                        'counters of the render. It is the only output on stdout, messages go '
+                                        'to stderr.'))
+
+        flags.add_argument('--stats-file',
+                           action='store',
+                           metavar='[file]',
+                           type=str,
+                           dest=f'stats_file',
+                           help=Color.s('save the JSON of {G}--stats{W} to this file.'))
+
+        flags.add_argument('--batch',
+                           action='store_true',
+                           default=False,
+                           dest=f'batch',
+                           help=Color.s('convert many inputs in one process, {G}-o{W} is the output directory.'))
+
+        flags.add_argument('--manifest',
+                           action='store',
+                           metavar='[file]',
+                           type=str,
+                           dest=f'manifest',
+                           help=Color.s('file (or {G}-{W} to stdin) with one input path per line, implies {G}--batch{W}.'))
+
+        flags.add_argument('--format',
+                           action='store',
+                           metavar='[format]',
+                           type=str,
+                           dest=f'format',
+                           help=Color.s('image format of the batch outputs: {G}png{W}, {G}jpg{W}, {G}webp{W} '
+                                        'or {G}avif{W} (default: {G}png{W}).'))
+
+        flags.add_argument('--profile',
+                           action='store',
+                           metavar='[name]',
+                           type=str,
+                           default=DEFAULT_PROFILE,
+                           dest=f'profile',
+                           help=Color.s('encode profile: {G}fast{W}, {G}balanced{W} or {G}smallest{W} '
+                                        '(default: {G}balanced{W}).'))
+
+        flags.add_argument('--summary',
+                           action='store',
+                           metavar='[file]',
+                           type=str,
+                           dest=f'summary',
+                           help=Color.s('JSON summary of the batch (default: {G}summary.json{W} at output directory).'))
+
+        flags.add_argument('--serve',
+                           action='store',
+                           metavar='[address]',
+                           type=str,
+                           dest=f'serve',
+                           help=Color.s('run the render server at {G}[host:]port{W} or at a Unix socket path.'))
+
+        flags.add_argument('--queue',
+                           action='store',
+                           metavar='[size]',
+                           type=int,
+                           default=32,
+                           dest=f'queue',
+                           help=Color.s('server jobs waiting for a worker before rejecting (default: {G}32{W}).'))
+
+        flags.add_argument('--timeout',
+                           action='store',
+                           metavar='[seconds]',
+                           type=float,
+                           default=30.0,
+                           dest=f'timeout',
+                           help=Color.s('server timeout of each render job (default: {G}30{W}).'))
+
         flags.add_argument('--font-list',
                            action='store_true',
                            default=False,
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import glob
+import io
+import json
+import multiprocessing
+import os
+import time
+from typing import Iterable, List, Optional, TextIO, Tuple
+
+from .__meta__ import __version__
+from .fonts.catalog import font_catalog
+from .libs.cache import RenderCache
+from .libs.decoding import DEFAULT_ERRORS, codec_errors
+from .libs.encoder import DEFAULT_PROFILE
+from .libs.palette import Palette
+from .vector import FORMATS as VECTOR_FORMATS
+
+# Options and render cache of the current worker process, set once by _warm
+_worker_options = None
+_worker_cache = None
+
+
+def _warm(options: dict) -> None:
+    '''
+    Pool initializer: loads fonts, cell metrics and the palette once per worker,
+    so every file converted by this process reuses them.
+    '''
+    global _worker_options, _worker_cache
+    from .ansi2image import Ansi2Image
+    from .fonts.truetypefont import TrueTypeFont
+
+    _worker_options = options
+    _worker_cache = None
+    if options.get('cache_dir') is not None:
+        _worker_cache = RenderCache(options['cache_dir'], max_bytes=options['cache_max_bytes'])
+    for path in options.get('font_dirs', []):
+        TrueTypeFont.add_font_dir(path)
+    font = TrueTypeFont(name=options['font_name'], size=options['font_size'])
+    Ansi2Image.textlength(font.truetype)
+    if options.get('palette') is None:
+        Palette.default()
+
+
+def _convert(job: Tuple[str, str]) -> dict:
+    from .ansi2image import Ansi2Image
+
+    options = _worker_options
+    input_file, output_file = job
+    start = time.perf_counter()
+    cpu = time.process_time()
+    result = dict(input=input_file, outputs=[], bytes=0, error=None)
+    errors = codec_errors(options.get('errors', DEFAULT_ERRORS))
+    try:
+        if options['format'] in VECTOR_FORMATS:
+            from .ansi2image import Renderer
+            from .vector import VectorWriter
+
+            renderer = Renderer(font_name=options['font_name'], font_size=options['font_size'],
+                                palette=options.get('palette'), screen=options.get('screen'),
+                                scrollback=options.get('scrollback', 1000))
+            with io.TextIOWrapper(open(input_file, 'rb'), encoding='utf-8', errors=errors) as stream:
+                VectorWriter.save(renderer, stream, output_file, format=options['format'],
+                                  embed_font=options.get('embed_font', False))
+            outputs = [output_file]
+        else:
+            o = Ansi2Image(0, 0, font_name=options['font_name'], font_size=options['font_size'],
+                           palette=options.get('palette'), screen=options.get('screen'),
+                           scrollback=options.get('scrollback', 1000), indexed=options.get('indexed', False),
+                           cache=_worker_cache, errors=options.get('errors', DEFAULT_ERRORS))
+
+            if options.get('page_lines') is not None or options.get('page_height') is not None:
+                with io.TextIOWrapper(open(input_file, 'rb'), encoding='utf-8', errors=errors) as stream:
+                    outputs = o.save_pages(output_file, format=options['format'],
+                                           max_lines=options.get('page_lines'), max_height=options.get('page_height'),
+                                           stream=stream, profile=options.get('profile', DEFAULT_PROFILE))
+            else:
+                hits = _worker_cache.hits if _worker_cache is not None else 0
+                o.load_from_file(input_file)
+                o.calc_size()
+                o.save_image(output_file, format=options['format'], profile=options.get('profile', DEFAULT_PROFILE))
+                outputs = [output_file]
+                if _worker_cache is not None:
+                    result['cached'] = _worker_cache.hits > hits
+
+        result['outputs'] = outputs
+        result['bytes'] = sum(os.path.getsize(f) for f in outputs)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+
+    result['seconds'] = round(time.perf_counter() - start, 6)
+    result['cpu_seconds'] = round(time.process_time() - cpu, 6)
+    return result
+
+
+class BatchConverter(object):
+    ''' Converts many inputs in one run, distributing them over a pool of warm workers '''
+
+    def __init__(self, out_dir: str, format: str = 'png', workers: int = 1,
+                 font_name: str = 'JetBrains Mono Regular', font_size: int = 13, palette: Palette = None,
+                 screen: Optional[Tuple[int, int]] = None, scrollback: int = 1000,
+                 page_lines: Optional[int] = None, page_height: Optional[int] = None,
+                 profile: str = DEFAULT_PROFILE, indexed: bool = False, cache: Optional[RenderCache] = None,
+                 errors: str = DEFAULT_ERRORS, embed_font: bool = False):
+        self.out_dir = out_dir
+        self.workers = max(1, workers)
+        self.options = dict(
+            format=format,
+            font_name=font_name,
+            font_size=font_size,
+            palette=palette,
+            screen=screen,
+            scrollback=scrollback,
+            page_lines=page_lines,
+            page_height=page_height,
+            profile=profile,
+            indexed=indexed,
+            errors=errors,
+            embed_font=embed_font,
+            font_dirs=font_catalog.extra_directories,
+            # Each worker opens the same cache directory
+            cache_dir=cache.directory if cache is not None else None,
+            cache_max_bytes=cache.max_bytes if cache is not None else None,
+        )
+
+    @staticmethod
+    def collect(items: Iterable[str], manifest: Optional[TextIO] = None) -> List[str]:
+        '''
+        Expands files, globs and directories (recursively) into a list of input files.
+        A manifest has one entry per line, blank lines and lines starting with # are ignored.
+        '''
+        entries = list(items)
+        if manifest is not None:
+            entries += [
+                line.strip() for line in manifest
+                if line.strip() != '' and not line.strip().startswith('#')
+            ]
+
+        files = []
+        for entry in entries:
+            if os.path.isdir(entry):
+                files += sorted(
+                    os.path.join(dp, f)
+                    for dp, _, filenames in os.walk(entry) for f in filenames
+                )
+            elif glob.has_magic(entry):
+                files += sorted(f for f in glob.glob(entry, recursive=True) if os.path.isfile(f))
+            else:
+                files.append(entry)
+
+        # Keep the first occurrence of each file
+        seen = set()
+        return [f for f in files if not (os.path.abspath(f) in seen or seen.add(os.path.abspath(f)))]
+
+    def output_name(self, input_file: str, used: set) -> str:
+        ext = 'jpg' if self.options['format'] == 'jpeg' else self.options['format']
+        stem = os.path.splitext(os.path.basename(input_file))[0] or 'output'
+        name = os.path.join(self.out_dir, f'{stem}.{ext}')
+        n = 1
+        while name in used:
+            n += 1
+            name = os.path.join(self.out_dir, f'{stem}-{n}.{ext}')
+        used.add(name)
+        return name
+
+    def run(self, inputs: List[str]) -> dict:
+        used = set()
+        jobs = [(f, self.output_name(f, used)) for f in inputs]
+
+        start = time.perf_counter()
+        if self.workers == 1 or len(jobs) <= 1:
+            _warm(self.options)
+            results = [_convert(job) for job in jobs]
+        else:
+            with multiprocessing.Pool(processes=min(self.workers, len(jobs)),
+                                      initializer=_warm, initargs=(self.options,)) as pool:
+                chunksize = max(1, min(64, len(jobs) // (self.workers * 4)))
+                results = list(pool.imap(_convert, jobs, chunksize=chunksize))
+
+        failed = sum(1 for r in results if r['error'] is not None)
+        summary = dict(
+            version=__version__,
+            workers=self.workers,
+            format=self.options['format'],
+            profile=self.options['profile'],
+            total=len(results),
+            succeeded=len(results) - failed,
+            failed=failed,
+            seconds=round(time.perf_counter() - start, 6),
+            bytes=sum(r['bytes'] for r in results),
+            files=results,
+        )
+        if self.options['cache_dir'] is not None:
+            cached = [r for r in results if 'cached' in r]
+            summary['cache'] = dict(hits=sum(1 for r in cached if r['cached']),
+                                    misses=sum(1 for r in cached if not r['cached']),
+                                    bytes_saved=sum(r['bytes'] for r in cached if r['cached']))
+        return summary
+
+    @staticmethod
+    def write_summary(summary: dict, filename: str) -> None:
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
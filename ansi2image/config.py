@@ -4,18 +4,20 @@ import errno
 import os, sys
 import re
 from pathlib import Path
-from typing import Optional
-
-from PIL import ImageFont
-from PIL.ImageFont import FreeTypeFont
+from argparse import Namespace
+from typing import Optional, Tuple
 
+from .fonts.catalog import FontCatalog
 from .fonts.truetypefont import TrueTypeFont
 from .libs.color import Color
+from .libs.decoding import DEFAULT_ERRORS, ERRORS
+from .libs.encoder import DEFAULT_PROFILE, Encoder
 from .libs.logger import Logger
+from .libs.palette import Palette
+from .recording import FORMATS as ANIMATION_FORMATS
+from .vector import FORMATS as VECTOR_FORMATS
 from .__meta__ import __version__, __description__
 
-_FORMATS = ['jpg', 'jpeg', 'png']
-
 
 class Configuration(object):
     ''' Stores configuration variables and functions for Tfileindexer. '''
@@ -27,8 +29,36 @@ class Configuration(object):
     filename = None
     cmd_line = ''
     format = None
+    profile = DEFAULT_PROFILE
+    indexed = False
+    embed_font = False
+    recording = False
+    timing = None
+    fps = 10.0
+    idle_limit = None
     fonts = []
     font = None
+    palette = None
+    screen = None
+    scrollback = 1000
+    page_lines = None
+    page_height = None
+    follow = None
+    mapped = False
+    line_range = None
+    cache = None
+    cache_size = 512
+    stats = False
+    stats_file = None
+    errors = DEFAULT_ERRORS
+    workers = 1
+    batch = False
+    filenames = []
+    manifest = None
+    summary = None
+    serve = None
+    queue = 32
+    timeout = 30.0
     size = (700, 300)
     out_file = None
 
@@ -68,6 +98,28 @@ class Configuration(object):
             count = sum(buffer.count(b'\n') for buffer in c_generator)
             return count + 1
 
+    @staticmethod
+    def _line_range(lines: Optional[str], tail: Optional[int]) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        ''' --lines first:last (1-based, inclusive) or --tail count as slice start and stop '''
+        if lines is not None and tail is not None:
+            Logger.pl('{!} {R}error: use either {O}--lines{R} or {O}--tail{W}\r\n')
+            exit(1)
+        if tail is not None:
+            if tail < 1:
+                Logger.pl('{!} {R}error: invalid {O}--tail{R} value {O}%s{W}\r\n' % tail)
+                exit(1)
+            return -tail, None
+        if lines is None:
+            return None
+        try:
+            first, last = [int(v) if v.strip() != '' else None for v in lines.split(':')]
+            if (first is not None and first < 1) or (last is not None and last < (first or 1)):
+                raise ValueError()
+            return (first - 1 if first is not None else None), last
+        except ValueError:
+            Logger.pl('{!} {R}error: invalid line range {O}%s{R}. Expected {G}FIRST:LAST{W}\r\n' % lines)
+            exit(1)
+
     @staticmethod
     def list_fonts():
         for f in Configuration.fonts:
@@ -81,29 +133,144 @@ class Configuration(object):
         ''' Sets configuration values based on Argument.args object '''
         from .args import Arguments
 
-        Configuration.fonts = TrueTypeFont.load_fonts()
-
+        # Fonts are only loaded after --version and --help have been handled
         if any(['--version' in word for word in sys.argv]):
             Logger.pl(f' {Configuration.name} v{Configuration.version}\n')
             sys.exit(0)
 
-        if any(['--font-list' in word for word in sys.argv]):
+        args = Arguments()
+
+        for path in args.args.font_dirs:
+            if not os.path.isdir(path):
+                Logger.pl('{!} {R}error: font directory does not exists {O}%s{R} {W}\r\n' % path)
+                exit(1)
+            TrueTypeFont.add_font_dir(path)
+        if args.args.system_fonts:
+            for path in FontCatalog.system_directories():
+                TrueTypeFont.add_font_dir(path)
+
+        if args.args.font_list:
+            Configuration.fonts = TrueTypeFont.load_fonts()
             Configuration.list_fonts()
             sys.exit(0)
 
-        args = Arguments()
-
         a1 = sys.argv
         a1[0] = 'ansi2image'
         for a in a1:
             Configuration.cmd_line += "%s " % a
 
         Configuration.verbose = args.args.v
-        Configuration.filename = args.args.filename
+        Configuration.fonts = TrueTypeFont.load_fonts()
+        Configuration.batch = args.args.batch or args.args.manifest is not None
+
+        if args.args.serve is not None:
+            Configuration._load_server_arguments(args.args)
+        elif Configuration.batch:
+            Configuration._load_batch_arguments(args.args)
+        else:
+            Configuration._load_file_arguments(args.args)
+
+        try:
+            Configuration.font = TrueTypeFont(args.args.font)
+        except:
+            Logger.pl(
+                '{!} {R}Error selecting font {O}%s{R}{W}\n     {W}{D}Check available fonts with {G}--font-list{W}' %
+                args.args.font, out=sys.stderr)
+            sys.exit(1)
+
+        if args.args.theme is not None:
+            try:
+                Configuration.palette = Palette.load(args.args.theme)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                Logger.pl('{!} {R}Error loading theme {O}%s{R}: %s{W}\r\n' % (args.args.theme, str(e)))
+                sys.exit(1)
+
+        if args.args.screen is not None:
+            try:
+                cols, rows = [int(v) for v in args.args.screen.lower().split('x')]
+                if cols < 1 or rows < 1:
+                    raise ValueError()
+                Configuration.screen = (cols, rows)
+            except ValueError:
+                Logger.pl('{!} {R}error: invalid screen size {O}%s{R}. Expected {G}COLSxROWS{W}\r\n' % (
+                    args.args.screen))
+                exit(1)
+        Configuration.scrollback = max(0, args.args.scrollback)
+
+        for name in ('page_lines', 'page_height'):
+            value = getattr(args.args, name)
+            if value is not None and value < 1:
+                Logger.pl('{!} {R}error: invalid {O}--%s{R} value {O}%s{W}\r\n' % (name.replace('_', '-'), value))
+                exit(1)
+        Configuration.page_lines = args.args.page_lines
+        Configuration.page_height = args.args.page_height
+        if (Configuration.format in VECTOR_FORMATS or Configuration.recording) and \
+                (Configuration.page_lines is not None or Configuration.page_height is not None):
+            Logger.pl('{!} {R}error: {O}--page-lines{R} and {O}--page-height{R} need an image format, '
+                      'not {O}%s{R}%s{W}\r\n' % (Configuration.format,
+                                                   ' animation' if Configuration.recording else ''))
+            exit(1)
+        if args.args.follow is not None:
+            if Configuration.filename in (None, '-') or Configuration.recording or \
+                    Configuration.format in VECTOR_FORMATS or Configuration.screen is not None:
+                Logger.pl('{!} {R}error: {O}--follow{R} needs an input file and an image output, '
+                          'without {O}--screen{W}\r\n')
+                exit(1)
+            if args.args.follow <= 0:
+                Logger.pl('{!} {R}error: invalid {O}--follow{R} value {O}%s{W}\r\n' % args.args.follow)
+                exit(1)
+        Configuration.follow = args.args.follow
+        if args.args.mmap or args.args.lines is not None or args.args.tail is not None:
+            if Configuration.filename in (None, '-') or Configuration.recording or \
+                    Configuration.follow is not None:
+                Logger.pl('{!} {R}error: {O}--mmap{R}, {O}--lines{R} and {O}--tail{R} need an input file, '
+                          'not a recording or {O}--follow{W}\r\n')
+                exit(1)
+            Configuration.mapped = True
+            Configuration.line_range = Configuration._line_range(args.args.lines, args.args.tail)
+        Configuration.workers = max(1, args.args.workers)
+
+        if args.args.profile not in Encoder.profiles():
+            Logger.pl('{!} {R}error: invalid encode profile {O}%s{R}. Supported profiles: {G}%s{W}\r\n' % (
+                args.args.profile, ', '.join(Encoder.profiles())))
+            exit(1)
+        Configuration.profile = args.args.profile
+        if args.args.errors not in ERRORS:
+            Logger.pl('{!} {R}error: invalid decode policy {O}%s{R}. Supported policies: {G}%s{W}\r\n' % (
+                args.args.errors, ', '.join(ERRORS)))
+            exit(1)
+        Configuration.errors = args.args.errors
+        Configuration.indexed = args.args.indexed
+        Configuration.embed_font = args.args.embed_font
+        Configuration.stats = args.args.stats
+        Configuration.stats_file = args.args.stats_file
+
+        if args.args.cache is not None:
+            if args.args.cache_size < 1:
+                Logger.pl('{!} {R}error: invalid {O}--cache-size{R} value {O}%s{W}\r\n' % args.args.cache_size)
+                exit(1)
+            if args.args.cache != '' and os.path.exists(args.args.cache) and not os.path.isdir(args.args.cache):
+                Logger.pl('{!} {R}error: invalid cache directory {O}%s{R} {W}\r\n' % args.args.cache)
+                exit(1)
+            Configuration.cache = args.args.cache
+            Configuration.cache_size = args.args.cache_size
+
+        Color.pl('{+} {W}Startup parameters')
+        Logger.pl('     {C}command line:{O} %s{W}' % Configuration.cmd_line)
+        Logger.pl('     {C}font:{O} %s{W}' % Configuration.name)
+
+    @staticmethod
+    def _load_file_arguments(args: Namespace):
+        ''' Input and output of a single file conversion '''
+        if len(args.filename) > 1:
+            Logger.pl('{!} {R}error: use {O}--batch{R} to convert more than one file{W}\r\n')
+            exit(1)
+
+        Configuration.filename = args.filename[0] if args.filename else None
 
         if Configuration.filename is None or Configuration.filename.strip() == '':
             Logger.pl('{!} {R}error: filename is invalid {O}%s{R} {W}\r\n' % (
-                args.args.config_file))
+                Configuration.filename))
             exit(1)
 
         if Configuration.filename != '-' and not os.path.isfile(Configuration.filename):
@@ -111,12 +278,12 @@ class Configuration(object):
                 Configuration.filename))
             exit(1)
 
-        if args.args.out_file is None or args.args.out_file.strip() == '' or os.path.isdir(args.args.out_file):
+        if args.out_file is None or args.out_file.strip() == '' or os.path.isdir(args.out_file):
             Logger.pl('{!} {R}error: invalid output filename {O}%s{R} {W}\r\n' % (
-                args.args.out_file))
+                args.out_file))
             exit(1)
 
-        Configuration.out_file = args.args.out_file
+        Configuration.out_file = args.out_file
 
         try:
             if Configuration.filename != '-':
@@ -134,28 +301,93 @@ class Configuration(object):
                 Logger.pl('{!} {R}Error: could not openfile {W}\r\n')
                 sys.exit(1)
 
-        fmt = Path(Configuration.out_file).suffix.strip('. ').lower()
+        Configuration.timing = args.timing
+        Configuration.recording = args.timing is not None or Configuration.filename.lower().endswith('.cast')
+        if not Configuration.recording:
+            Configuration.format = Configuration._image_format(Path(Configuration.out_file).suffix)
+            return
 
-        if fmt is None or fmt not in _FORMATS:
-            Logger.pl('{!} {R}error: invalid image format {O}%s{R}. Supported formats: {G}%s{W}\r\n' % (
-                fmt, ', '.join(_FORMATS)))
+        if Configuration.filename == '-':
+            Logger.pl('{!} {R}error: recordings must be read from a file, not stdin{W}\r\n')
             exit(1)
 
-        Configuration.format = fmt.lower()
-        if Configuration.format == 'jpg':
-            Configuration.format = 'jpeg'
+        if Configuration.timing is not None and not os.path.isfile(Configuration.timing):
+            Logger.pl('{!} {R}error: timing file does not exists {O}%s{R} {W}\r\n' % Configuration.timing)
+            exit(1)
+
+        if args.fps <= 0 or (args.idle_limit is not None and args.idle_limit <= 0):
+            Logger.pl('{!} {R}error: invalid {O}--fps{R} or {O}--idle-limit{R} value{W}\r\n')
+            exit(1)
+        Configuration.fps = args.fps
+        Configuration.idle_limit = args.idle_limit
+
+        Configuration.format = Path(Configuration.out_file).suffix.strip('. ').lower()
+        if Configuration.format not in ANIMATION_FORMATS:
+            Logger.pl('{!} {R}error: invalid animation format {O}%s{R}. Supported formats: {G}%s{W}\r\n' % (
+                Configuration.format, ', '.join(ANIMATION_FORMATS)))
+            exit(1)
 
+    @staticmethod
+    def _image_format(ext: str) -> str:
+        ''' Pillow format of an extension supported by the installed Pillow, or a vector format '''
+        fmt = ext.strip('. ').lower()
+        if fmt in VECTOR_FORMATS or fmt == 'htm':
+            return 'html' if fmt == 'htm' else fmt
         try:
-            Configuration.font = TrueTypeFont(args.args.font)
-        except:
-            Logger.pl(
-                '{!} {R}Error selecting font {O}%s{R}{W}\n     {W}{D}Check available fonts with {G}--font-list{W}' %
-                args.args.font, out=sys.stderr)
-            sys.exit(1)
+            return Encoder.normalize(fmt)
+        except ValueError:
+            Logger.pl('{!} {R}error: invalid image format {O}%s{R}. Supported formats: {G}%s{W}\r\n' % (
+                fmt, ', '.join(Encoder.formats() + list(VECTOR_FORMATS))))
+            exit(1)
 
-        Color.pl('{+} {W}Startup parameters')
-        Logger.pl('     {C}command line:{O} %s{W}' % Configuration.cmd_line)
-        Logger.pl('     {C}font:{O} %s{W}' % Configuration.name)
+    @staticmethod
+    def _load_server_arguments(args: Namespace):
+        ''' Listening address and limits of the render server '''
+        Configuration.serve = args.serve.strip()
+
+        if Configuration.serve.startswith('unix:') or '/' in Configuration.serve:
+            path = Configuration.serve[5:] if Configuration.serve.startswith('unix:') else Configuration.serve
+            if path == '' or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+                Logger.pl('{!} {R}error: invalid socket path {O}%s{R} {W}\r\n' % path)
+                exit(1)
+        elif not Configuration.serve.rpartition(':')[2].isdigit():
+            Logger.pl('{!} {R}error: invalid address {O}%s{R}. Expected {G}[host:]port{R} or a socket path{W}\r\n' % (
+                Configuration.serve))
+            exit(1)
+
+        if args.queue < 0 or args.timeout <= 0:
+            Logger.pl('{!} {R}error: invalid {O}--queue{R} or {O}--timeout{R} value{W}\r\n')
+            exit(1)
+
+        Configuration.queue = args.queue
+        Configuration.timeout = args.timeout
+
+    @staticmethod
+    def _load_batch_arguments(args: Namespace):
+        ''' Inputs, output directory and summary of a batch conversion '''
+        Configuration.filenames = list(args.filename)
+        Configuration.manifest = args.manifest
+
+        if len(Configuration.filenames) == 0 and Configuration.manifest is None:
+            Logger.pl('{!} {R}error: no input files, globs, directories or {O}--manifest{R} defined{W}\r\n')
+            exit(1)
+
+        if Configuration.manifest is not None and Configuration.manifest != '-' and \
+                not os.path.isfile(Configuration.manifest):
+            Logger.pl('{!} {R}error: manifest does not exists {O}%s{R} {W}\r\n' % Configuration.manifest)
+            exit(1)
+
+        if args.out_file is None or args.out_file.strip() == '' or \
+                (os.path.exists(args.out_file) and not os.path.isdir(args.out_file)):
+            Logger.pl('{!} {R}error: invalid output directory {O}%s{R} {W}\r\n' % args.out_file)
+            exit(1)
+
+        Configuration.out_file = args.out_file
+        os.makedirs(Configuration.out_file, exist_ok=True)
+
+        Configuration.format = Configuration._image_format(args.format or 'png')
+        Configuration.summary = args.summary if args.summary is not None else \
+            os.path.join(Configuration.out_file, 'summary.json')
 
     @staticmethod
     def get_banner():
@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import math
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from .metrics import MetricsCache
+
+if TYPE_CHECKING:
+    from PIL import Image
+    from PIL.ImageFont import FreeTypeFont
+
+    from ..libs.indexed import ColorIndex
+
+
+@lru_cache(maxsize=4096)
+def is_simple_char(char: str) -> bool:
+    '''
+    True when the character occupies exactly one cell and renders without shaping,
+    so a pre-rasterized tile is equivalent to drawing it as text.
+    '''
+    if len(char) != 1 or not char.isprintable():
+        return False
+    if unicodedata.combining(char) or unicodedata.east_asian_width(char) in ('W', 'F'):
+        return False
+    return unicodedata.category(char) not in ('Mn', 'Me', 'Cf', 'Co', 'Cs')
+
+
+class GlyphAtlas(object):
+    '''
+    Bounded LRU atlas of glyph masks keyed by (codepoint, font face, subpixel offset).
+
+    Masks are cropped to their ink and pasted with the foreground color over a canvas
+    whose cell backgrounds are already painted, instead of calling ImageDraw.text.
+    Like ImageDraw.text a glyph at x is pasted at int(x) and rasterized at the fraction
+    of x, which FreeType rounds to 1/64 pixel, so tiles give the same pixels as the text.
+    '''
+
+    def __init__(self, max_glyphs: int = 4096):
+        self.max_glyphs = max_glyphs
+        self.hits = 0
+        self.misses = 0
+        self._masks = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def stats(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            glyphs=len(self._masks),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._masks.clear()
+            self.hits = self.misses = 0
+
+    @staticmethod
+    def supports(text: str) -> bool:
+        return all(is_simple_char(c) for c in text)
+
+    def mask(self, char: str, font: 'FreeTypeFont', cell: Tuple[int, int], face: Optional[tuple] = None,
+             offset: Tuple[int, int] = (0, 0)) -> Optional[Tuple['Image.Image', int, int]]:
+        '''
+        (mask, left, top) of the ink of a glyph drawn at a subpixel offset, in 1/64 pixels,
+        relative to the pixel it is drawn at. None when it has no ink.
+        '''
+        key = (char, face if face is not None else MetricsCache._key(font), cell, offset)
+        with self._lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                self.hits += 1
+                return self._masks[key]
+            self.misses += 1
+
+        from PIL import Image, ImageDraw
+
+        # Ink may go past the cell, a cell of margin on each side keeps it from being clipped
+        pad_x, pad_y = cell
+        m = Image.new('L', (cell[0] + 2 * pad_x, cell[1] + 2 * pad_y), 0)
+        d = ImageDraw.Draw(m)
+        d.text((pad_x + offset[0] / 64.0, pad_y + offset[1] / 64.0), text=char, font=font, fill=255)
+        del d
+        bbox = m.getbbox()
+        entry = (m.crop(bbox), bbox[0] - pad_x, bbox[1] - pad_y) if bbox is not None else None
+
+        with self._lock:
+            self._masks[key] = entry
+            if len(self._masks) > self.max_glyphs:
+                self._masks.popitem(last=False)
+        return entry
+
+    def draw(self, img: 'Image.Image', font: 'FreeTypeFont', text: str, x: float, y: float,
+             cell_size: Tuple[float, float], foreground: Tuple[int], face: Optional[tuple] = None,
+             index: Optional['ColorIndex'] = None, background: Optional[Tuple[int]] = None) -> bool:
+        '''
+        Draws the ink of text one cell at a time, backgrounds must already be painted.
+        Returns False without drawing anything when some character needs shaping and
+        must use the text drawing path.
+        face is the MetricsCache key of the font, callers drawing many runs pass it once.
+        On a P mode canvas index is its ColorIndex and background the color under the text.
+        '''
+        if not self.supports(text):
+            return False
+
+        if face is None:
+            face = MetricsCache._key(font)
+        cell_w, cell_h = cell_size
+        cell = (int(math.ceil(cell_w)), int(math.ceil(cell_h)))
+        # ImageDraw.text draws at int(x), rasterizing at the fraction rounded to 1/64 pixel
+        top = int(y)
+        fy = int(round((y - top) * 64))
+        # Pasting on the core image skips the per call checks of Image.paste
+        img.load()
+        core = img.im
+        for i, char in enumerate(text):
+            if char == ' ':
+                continue
+            cx = x + i * cell_w
+            left = int(cx)
+            entry = self.mask(char, font, cell, face, (int(round((cx - left) * 64)), fy))
+            if entry is None:
+                continue
+            m, dx, dy = entry
+            left += dx
+            box = (left, top + dy, left + m.width, top + dy + m.height)
+            if index is None:
+                core.paste(foreground, box, m.im)
+            else:
+                tile, ink = index.tile(m, foreground, background)
+                core.paste(tile.im, box, ink.im)
+        return True
+
+
+glyph_atlas = GlyphAtlas()
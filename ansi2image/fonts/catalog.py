@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+
+from ..libs.paths import get_cache_dir
+
+if TYPE_CHECKING:
+    from PIL.ImageFont import FreeTypeFont
+
+_FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc')
+_MAX_FACES = 20
+_CACHE_VERSION = 1
+
+
+class FontCatalog(object):
+    '''
+    Index of the font faces found in the package font directory and in extra directories.
+
+    The faces of each file are probed once and stored in a JSON cache keyed by path,
+    mtime and size, so later starts only stat the files. Lookups by normalized name are
+    dict hits and FreeTypeFont handles are kept in an LRU keyed by (path, index, size).
+    '''
+
+    def __init__(self, directories: Iterable[str], cache_path: Optional[str] = None, max_handles: int = 64):
+        self.directories = []
+        self.cache_path = cache_path
+        self.max_handles = max_handles
+        self._fonts = None
+        self._index = {}
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+        for d in directories:
+            self.add_directory(d)
+
+    @staticmethod
+    def from_environment() -> 'FontCatalog':
+        '''
+        Package fonts, followed by the directories in ANSI2IMAGE_FONT_PATH (os.pathsep separated).
+        The catalog is saved at the cache directory when it is writable.
+        '''
+        directories = [os.path.dirname(os.path.abspath(__file__))]
+        directories += [d for d in os.environ.get('ANSI2IMAGE_FONT_PATH', '').split(os.pathsep) if d.strip() != '']
+
+        cache_dir = get_cache_dir(create=False)
+        cache_path = os.path.join(cache_dir, 'fonts.json') if cache_dir is not None else None
+        return FontCatalog(directories, cache_path=cache_path)
+
+    @staticmethod
+    def system_directories() -> List[str]:
+        ''' Usual font directories of the running platform that exist '''
+        home = os.path.expanduser('~')
+        if sys.platform == 'win32':
+            dirs = [
+                os.path.join(os.environ.get('WINDIR', 'C:\\Windows'), 'Fonts'),
+                os.path.join(os.environ.get('LOCALAPPDATA', ''), 'Microsoft', 'Windows', 'Fonts'),
+            ]
+        elif sys.platform == 'darwin':
+            dirs = ['/System/Library/Fonts', '/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+        else:
+            data_home = os.environ.get('XDG_DATA_HOME', '').strip() or os.path.join(home, '.local', 'share')
+            dirs = ['/usr/share/fonts', '/usr/local/share/fonts', os.path.join(data_home, 'fonts'),
+                    os.path.join(home, '.fonts')]
+        return [d for d in dirs if os.path.isdir(d)]
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        ''' "JetBrains-Mono  regular" -> "jetbrains mono regular" '''
+        return ' '.join(name.lower().replace('-', ' ').replace('_', ' ').split())
+
+    @property
+    def extra_directories(self) -> List[str]:
+        return self.directories[1:]
+
+    def add_directory(self, path: str) -> None:
+        path = os.path.abspath(os.path.expanduser(path))
+        with self._lock:
+            if path not in self.directories:
+                self.directories.append(path)
+                self._fonts = None
+
+    @property
+    def fonts(self) -> List[dict]:
+        ''' Font files with faces, as [{path, name, variation: [{index, name}]}] '''
+        return self._load()
+
+    def _load(self) -> List[dict]:
+        with self._lock:
+            if self._fonts is None:
+                self._scan()
+            return self._fonts
+
+    def find(self, name: str) -> Optional[Tuple[str, int]]:
+        ''' (path, face index) of a face name, "Family" alone matches "Family Regular" '''
+        self._load()
+        key = self.normalize(name)
+        return self._index.get(key) or self._index.get(f'{key} regular')
+
+    def truetype(self, name: str, size: int = 12) -> Optional['FreeTypeFont']:
+        face = self.find(name)
+        if face is None:
+            return None
+
+        key = (face[0], face[1], size)
+        with self._lock:
+            font = self._handles.get(key)
+            if font is not None:
+                self._handles.move_to_end(key)
+                return font
+
+        from PIL import ImageFont
+
+        font = ImageFont.truetype(face[0], size, index=face[1])
+        with self._lock:
+            self._handles[key] = font
+            if len(self._handles) > self.max_handles:
+                self._handles.popitem(last=False)
+        return font
+
+    def clear(self) -> None:
+        with self._lock:
+            self._fonts = None
+            self._index = {}
+            self._handles.clear()
+
+    @staticmethod
+    def probe(path: str) -> dict:
+        ''' Opens every face of a font file to read its names '''
+        from PIL import ImageFont
+
+        variation = []
+        name = ''
+        for i in range(_MAX_FACES):
+            try:
+                ttf = ImageFont.truetype(path, 10, index=i)
+                name = ttf.getname()[0]
+                variation.append(dict(index=i, name=' '.join(ttf.getname())))
+            except Exception:
+                break
+
+        return dict(
+            path=path,
+            name=name,
+            variation=variation
+        )
+
+    def _files(self) -> Iterable[str]:
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for dp, dn, filenames in os.walk(directory):
+                dn.sort()
+                for f in sorted(filenames):
+                    if f.lower().endswith(_FONT_EXTENSIONS):
+                        yield os.path.join(dp, f)
+
+    def _scan(self) -> None:
+        cached = self._load_cache()
+        files = {}
+        changed = False
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature = f'{st.st_mtime_ns}:{st.st_size}'
+            entry = cached.get(path)
+            if not isinstance(entry, dict) or entry.get('signature') != signature:
+                entry = dict(signature=signature, **self.probe(path))
+                changed = True
+            files[path] = entry
+
+        # Entries of files outside these directories belong to other processes and are kept
+        removed = [
+            p for p in cached
+            if p not in files and any(p.startswith(os.path.join(d, '')) for d in self.directories)
+        ]
+        if changed or removed:
+            merged = {p: e for p, e in cached.items() if p not in removed}
+            merged.update(files)
+            self._save_cache(merged)
+
+        self._fonts = []
+        self._index = {}
+        for path, entry in files.items():
+            if not entry.get('variation'):
+                continue
+            self._fonts.append(dict(path=path, name=entry['name'], variation=entry['variation']))
+            for v in entry['variation']:
+                # The first directory that defines a face name wins
+                self._index.setdefault(self.normalize(v['name']), (path, int(v['index'])))
+
+    def _load_cache(self) -> dict:
+        if self.cache_path is None:
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get('version') == _CACHE_VERSION and isinstance(data.get('files'), dict):
+                return data['files']
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _save_cache(self, files: dict) -> None:
+        if self.cache_path is None:
+            return
+        import tempfile
+        try:
+            folder = os.path.dirname(os.path.abspath(self.cache_path))
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix='.fonts-', dir=folder)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dict(version=_CACHE_VERSION, files=files), f)
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            pass
+
+
+font_catalog = FontCatalog.from_environment()
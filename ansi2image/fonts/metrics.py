@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from ..libs.paths import get_cache_dir
+
+if TYPE_CHECKING:
+    from PIL.ImageFont import FreeTypeFont
+
+# Solid block that fills the whole monospace cell
+_CELL_CHAR = chr(0x2588)
+_SAMPLE_COUNT = 32
+
+
+class MetricsCache(object):
+    '''
+    Cache of monospace cell metrics (advance, height) keyed by font path, face index and size.
+
+    Entries live in an in-process LRU and, optionally, in a JSON file on disk that is
+    invalidated when the font file changes (mtime and size, or content hash).
+    '''
+
+    def __init__(self, max_entries: int = 128, disk_path: Optional[str] = None, validate: str = 'mtime'):
+        if validate not in ('mtime', 'hash'):
+            raise ValueError(f'Invalid validation mode "{validate}", use mtime or hash')
+
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.rasterized = 0
+        self._lru = OrderedDict()
+        self._disk = None
+        self._signatures = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def from_environment() -> 'MetricsCache':
+        ''' Enables the disk store when ANSI2IMAGE_CACHE_DIR is defined '''
+        disk_path = None
+        if os.environ.get('ANSI2IMAGE_CACHE_DIR', '').strip() != '':
+            cache_dir = get_cache_dir()
+            if cache_dir is not None:
+                disk_path = os.path.join(cache_dir, 'metrics.json')
+        return MetricsCache(disk_path=disk_path)
+
+    @staticmethod
+    def _key(font: 'FreeTypeFont') -> Tuple[str, int, float]:
+        path = getattr(font, 'path', None)
+        if isinstance(path, bytes):
+            path = path.decode('utf-8', 'replace')
+        if path is not None and not hasattr(path, 'read'):
+            path = os.path.abspath(str(path))
+        else:
+            path = repr(path)
+        return path, int(getattr(font, 'index', 0)), float(font.size)
+
+    def get(self, font: 'FreeTypeFont') -> Tuple[float, float]:
+        ''' Returns the (width, height) of one cell, computing it only once per face and size '''
+        key = self._key(font)
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            value = self._disk_get(key)
+            if value is None:
+                advance = self.trusted_advance(font)
+                if advance is None:
+                    self.rasterized += 1
+                    advance = self.rasterized_advance(font)
+                ascent, descent = font.getmetrics()
+                value = (float(advance), float(ascent + descent))
+                self._disk_put(key, value)
+
+            self._lru[key] = value
+            if len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            self._signatures.clear()
+            self.hits = self.misses = self.rasterized = 0
+
+    @staticmethod
+    def trusted_advance(font: 'FreeTypeFont') -> Optional[float]:
+        '''
+        Reads the advance from the font tables (hmtx through FreeType).
+        Returns None when the tables disagree with a monospace grid and must be rasterized.
+        '''
+        try:
+            one = float(font.getlength(_CELL_CHAR))
+            many = float(font.getlength(_CELL_CHAR * _SAMPLE_COUNT))
+            others = {float(font.getlength(c)) for c in ('M', '0', 'i')}
+        except Exception:
+            return None
+
+        if one <= 0 or abs(many - one * _SAMPLE_COUNT) > 0.01 * _SAMPLE_COUNT:
+            return None
+        if len(others) != 1 or abs(others.pop() - one) > 0.01:
+            return None
+        return one
+
+    @staticmethod
+    def rasterized_advance(font: 'FreeTypeFont') -> float:
+        '''
+        Advance per cell = pixel distance between the first and last glyphs,
+        divided by the number of gaps. Using a large N averages out per-glyph
+        pixel-rounding so the result converges to the font's true advance.
+        '''
+        from PIL import Image, ImageDraw
+
+        def _rendered_width(text: str):
+            try:
+                (_, _, bb_w, bb_h) = font.getbbox(text)
+                pad = 4
+                cw = max(200, int(bb_w) + pad * 2)
+                ch = max(200, int(bb_h) + pad * 2)
+                im = Image.new("RGB", (cw, ch), (0, 0, 0))
+                d = ImageDraw.Draw(im)
+                d.fontmode = "RGB"
+                try:
+                    d.text((pad, pad), text=text, font=font, fill=(255, 255, 255),
+                           features=['-liga', '-clig', '-calt'])
+                except (KeyError, AttributeError):
+                    # libraqm not available, fall back to basic rendering
+                    d.text((pad, pad), text=text, font=font, fill=(255, 255, 255))
+
+                bbox = im.getbbox()
+                del d, im
+                if bbox is None:
+                    return None
+                return bbox[2] - bbox[0]
+            except Exception:
+                return None
+
+        w_one = _rendered_width(_CELL_CHAR)
+        w_many = _rendered_width(_CELL_CHAR * _SAMPLE_COUNT)
+        if w_one is not None and w_many is not None and w_many > w_one:
+            return float(w_many - w_one) / float(_SAMPLE_COUNT - 1)
+
+        # Fallback to the font's reported advance width
+        return float(font.getlength(_CELL_CHAR))
+
+    def _signature(self, path: str) -> Optional[str]:
+        sig = self._signatures.get(path)
+        if sig is not None:
+            return sig
+        try:
+            st = os.stat(path)
+            if self.validate == 'hash':
+                import hashlib
+                h = hashlib.sha1()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(chunk)
+                sig = h.hexdigest()
+            else:
+                sig = f'{st.st_mtime_ns}:{st.st_size}'
+        except OSError:
+            return None
+        self._signatures[path] = sig
+        return sig
+
+    def _load_disk(self) -> dict:
+        if self._disk is None:
+            self._disk = {}
+            try:
+                with open(self.disk_path, 'r') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    self._disk = data
+            except (OSError, ValueError):
+                pass
+        return self._disk
+
+    def _disk_get(self, key: tuple) -> Optional[Tuple[float, float]]:
+        if self.disk_path is None:
+            return None
+        sig = self._signature(key[0])
+        entry = self._load_disk().get('%s|%d|%s' % key)
+        if sig is None or not isinstance(entry, dict) or entry.get('signature') != sig:
+            return None
+        try:
+            return float(entry['width']), float(entry['height'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _disk_put(self, key: tuple, value: Tuple[float, float]) -> None:
+        if self.disk_path is None:
+            return
+        sig = self._signature(key[0])
+        if sig is None:
+            return
+        data = self._load_disk()
+        data['%s|%d|%s' % key] = dict(signature=sig, width=value[0], height=value[1])
+        import tempfile
+        try:
+            folder = os.path.dirname(os.path.abspath(self.disk_path))
+            fd, tmp = tempfile.mkstemp(prefix='.metrics-', dir=folder)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.disk_path)
+        except OSError:
+            pass
+
+
+metrics_cache = MetricsCache.from_environment()
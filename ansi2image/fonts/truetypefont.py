@@ -1,13 +1,12 @@
-import os
-from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-from PIL import ImageFont
-from PIL.ImageFont import FreeTypeFont
+from .catalog import font_catalog
+
+if TYPE_CHECKING:
+    from PIL.ImageFont import FreeTypeFont
 
 
 class TrueTypeFont(object):
-    _fonts = []
     _ttf = None
     _name = ''
 
@@ -27,41 +26,14 @@ class TrueTypeFont(object):
     def truetype(self):
         return self.ttf
 
-    @staticmethod
-    def _font_data(path: str):
-        variation = []
-        name = ''
-        for i in range(20):
-            try:
-                ttf = ImageFont.truetype(path, 10, index=i)
-                name = ttf.getname()[0]
-                variation.append(dict(index=i, name=' '.join(ttf.getname())))
-            except:
-                break
-
-        return dict(
-            path=path,
-            name=name,
-            variation=variation
-        )
-
     @staticmethod
     def load_fonts() -> list:
-        if TrueTypeFont._fonts is not None and len(TrueTypeFont._fonts) > 0:
-            return TrueTypeFont._fonts
+        return font_catalog.fonts
 
-        font_path = os.path.join(Path(os.path.dirname(__file__)).resolve().parent, 'fonts')
-        TrueTypeFont._fonts = [
-            font for name in os.listdir(font_path)
-            if os.path.isfile(os.path.join(font_path, name)) and \
-               (font := TrueTypeFont._font_data(os.path.join(font_path, name)))
-        ]
-        return TrueTypeFont._fonts
+    @staticmethod
+    def add_font_dir(path: str) -> None:
+        font_catalog.add_directory(path)
 
     @staticmethod
-    def get_font_by_name(name: str, size: int = 12) -> Optional[FreeTypeFont]:
-        return next((
-            ImageFont.truetype(str(fnt['path']), size, index=v['index'])
-            for fnt in TrueTypeFont._fonts for v in fnt['variation']
-            if v['name'].lower() == name.lower() or f'{name.lower()} regular' == v['name'].lower()
-        ), None)
+    def get_font_by_name(name: str, size: int = 12) -> Optional['FreeTypeFont']:
+        return font_catalog.truetype(name, size)
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import codecs
+import os
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from .libs.decoding import DEFAULT_ERRORS, codec_errors
+from .libs.encoder import DEFAULT_PROFILE, Encoder
+from .vector import _Extent
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+    from .ansi2image import Renderer
+
+# Lines allocated below the text when the canvas grows, doubled each time
+_MIN_CAPACITY = 64
+
+
+class IncrementalRenderer(object):
+    '''
+    Renders a growing file (a CI log, tail -f style) without starting over on each update.
+
+    The byte offset, the SGR state and the style table are kept between calls to update(),
+    so only the bytes appended since the last call are read and parsed, and their lines are
+    drawn into the rows below the previous ones. The canvas is allocated with free rows that
+    double when they run out. Everything is drawn again only when the margin changes (the
+    longest line grew while the margin is below max_margin) or, on an indexed renderer, when
+    a new color pair needs a new palette.
+
+    With max_lines or max_height the output is split in pages like Ansi2Image.save_pages,
+    finished pages are encoded once and only the last page is written again.
+    A last line without a newline is drawn once it is complete. A file that shrinks
+    (truncated or rotated) is rendered again from its start.
+    '''
+
+    def __init__(self, renderer: 'Renderer', filename: str, margin: float = 0.02,
+                 max_lines: Optional[int] = None, max_height: Optional[int] = None, encoding: str = 'utf-8',
+                 errors: str = DEFAULT_ERRORS):
+        if renderer.screen is not None:
+            raise ValueError('Follow mode does not support the screen emulation')
+        self.renderer = renderer
+        self.filename = filename
+        self.margin = margin
+        self.encoding = encoding
+        self.errors = errors
+        self.page_lines = None
+        if max_lines is not None or max_height is not None:
+            self.page_lines = renderer.page_lines(max_lines, max_height)
+        self.reset()
+
+    def reset(self) -> None:
+        ''' Forgets everything read, the next update reads the file from its start '''
+        from .ansi2image import Ansi2Image
+
+        r = self.renderer
+        self.offset = 0
+        self.state = Ansi2Image.TextColor(foreground=r.foreground, background=r.background, palette=r.palette)
+        self.styles = Ansi2Image.StyleTable()
+        self.page = 1
+        self.runs = []  # type: List[List[Tuple[str, int]]]
+        self.stats = dict(lines=0, redraws=0, grows=0)
+        self._decoder = codecs.getincrementaldecoder(self.encoding)(codec_errors(self.errors))
+        self._partial = ''
+        self._finished = []  # type: List[Tuple[int, 'Image.Image']]
+        self._new_page()
+
+    def _new_page(self) -> None:
+        self.runs = []
+        self._img = None
+        self._index = None
+        self._pairs = set()
+        self._columns = 0
+        self._m = None
+        self._size = (0, 0)
+        self._changed = False
+
+    def update(self) -> int:
+        ''' Reads and draws the lines appended since the last call, returns how many '''
+        from .ansi2image import Ansi2Image
+
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return 0
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+
+        # Universal newlines, like the text mode reads of a full render; a CR may start a CR LF
+        text = self._partial + self._decoder.decode(data)
+        hold = '\r' if text.endswith('\r') else ''
+        lines = text[:len(text) - len(hold)].replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        self._partial = lines.pop() + hold
+        if not lines:
+            return 0
+
+        runs = [list(Ansi2Image._handle_ansi_code(line, self.state, self.styles)) for line in lines]
+        while runs:
+            if self.page_lines is not None and len(self.runs) >= self.page_lines:
+                self._finished.append((self.page, self.image()))
+                self.page += 1
+                self._new_page()
+            room = len(runs) if self.page_lines is None else self.page_lines - len(self.runs)
+            self._draw(runs[:room])
+            runs = runs[room:]
+
+        self.stats['lines'] += len(lines)
+        return len(lines)
+
+    def _draw(self, new_runs: List[List[Tuple[str, int]]]) -> None:
+        from .ansi2image import Ansi2Image
+        from .libs.indexed import ColorIndex
+
+        r = self.renderer
+        first = len(self.runs)
+        self.runs.extend(new_runs)
+        self._columns = max([self._columns] + [sum(len(text) for text, _ in runs) for runs in new_runs])
+        m, width, height = r.layout(_Extent(self._columns, len(self.runs)), self.margin)
+
+        redraw = self._img is None or m != self._m
+        if r.indexed and (self._img is None or self._index is not None):
+            pairs = ColorIndex.used_pairs(Ansi2Image.Document.from_runs(new_runs, self.styles), r.background)
+            if self._img is None or not self._pairs.issuperset(pairs):
+                # A new palette, or RGB from now on when the colors do not fit
+                self._index = ColorIndex.for_document(Ansi2Image.Document.from_runs(self.runs, self.styles),
+                                                      r.background)
+                self._pairs = set(self._index.pairs) if self._index is not None else set()
+                redraw = True
+
+        if redraw:
+            self._img = r.canvas(self._capacity(width, height), self._index)
+            r.draw(self._img, self.runs, self.styles, m, m, index=self._index)
+            self.stats['redraws'] += 1
+        else:
+            if int(width) > self._img.width or int(height) > self._img.height:
+                img = r.canvas(self._capacity(width, height), self._index)
+                img.paste(self._img, (0, 0))
+                self._img = img
+                self.stats['grows'] += 1
+            line_step = float(r.cell[1]) * r.line_height
+            r.draw(self._img, new_runs, self.styles, m, m + first * line_step, index=self._index)
+
+        self._m = m
+        self._size = (int(width), int(height))
+        self._changed = True
+
+    def _capacity(self, width: float, height: float) -> Tuple[int, int]:
+        ''' Canvas size with free rows for the next updates '''
+        lines = max(_MIN_CAPACITY, len(self.runs) * 2)
+        if self.page_lines is not None:
+            lines = min(lines, self.page_lines)
+        free = self.renderer.layout(_Extent(self._columns, lines), self.margin)[2]
+        return max(int(width), self._img.width if self._img is not None else 0), max(int(height), int(free))
+
+    def image(self) -> Optional['Image.Image']:
+        ''' The current (last) page, None before the first line '''
+        if self._img is None:
+            return None
+        if self._img.size == self._size:
+            return self._img.copy()
+        return self._img.crop((0, 0) + self._size)
+
+    def save(self, filename: str, format: str = 'png', profile: str = DEFAULT_PROFILE) -> List[str]:
+        '''
+        Writes what changed since the last save: the pages finished in between and the current one.
+        Pages are named like Ansi2Image.save_pages. Files are replaced atomically, so readers never
+        see a partial image. Returns the files written.
+        '''
+        from .ansi2image import Ansi2Image
+
+        pages = list(self._finished)
+        if self._changed:
+            pages.append((self.page, self.image()))
+        files = []
+        for page, img in pages:
+            name = filename if self.page_lines is None else Ansi2Image.page_filename(filename, page)
+            with open(name + '.tmp', 'wb') as f:
+                f.write(Encoder.encode(img, format=format, profile=profile))
+            os.replace(name + '.tmp', name)
+            files.append(name)
+        self._finished = []
+        self._changed = False
+        return files
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Iterable, List, Optional, Tuple, Union
+
+from ..__meta__ import __version__
+from .paths import get_cache_dir
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Eviction removes entries until the cache is this fraction of max_bytes, not on every write
+_LOW_WATERMARK = 0.9
+_TEMP_PREFIX = '.tmp-'
+
+
+class RenderCache(object):
+    '''
+    Content-addressed cache of encoded images on disk.
+
+    Entries are keyed by a SHA-256 of the input text, every option that changes the output
+    and the library version, so a byte-identical log rendered with the same settings is
+    read back instead of rendered. Files are written to a temporary name and renamed, so
+    processes sharing the directory never read a partial entry. Reads touch the file mtime,
+    which is the LRU clock used to evict the oldest entries when the total size goes over
+    max_bytes.
+    '''
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        if directory is None:
+            base = get_cache_dir()
+            if base is None:
+                raise ValueError('No cache directory available, define one')
+            directory = os.path.join(base, 'renders')
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+        self._size = None  # type: Optional[int]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(lines: Iterable[Union[str, bytes]], options: dict) -> str:
+        ''' Hash of the input and the options, the version is always part of it '''
+        digest = hashlib.sha256()
+        digest.update(json.dumps(dict(options, version=__version__), sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\0')
+        for line in lines:
+            data = line if isinstance(line, bytes) else line.encode('utf-8', 'surrogatepass')
+            # Length prefixed, so the same text split in other lines gets another key
+            digest.update(b'%d:' % len(data))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            # Recently used, evicted last
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+        except OSError:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            size = self._size
+        if size is None or size > self.max_bytes:
+            # The first write, or over the limit: the real size also counts other processes' entries
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        ''' (mtime, size, path) of every entry '''
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name.startswith(_TEMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        ''' Removes the least recently used entries when the cache is over max_bytes, returns how many '''
+        entries = self._entries()
+        size = sum(e[1] for e in entries)
+        removed = 0
+        if size > self.max_bytes:
+            target = self.max_bytes * _LOW_WATERMARK
+            for _, entry_size, path in sorted(entries):
+                if size <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except OSError:
+                    # Already removed by another process
+                    pass
+                size -= entry_size
+
+        with self._lock:
+            self._size = size
+            self.evicted += removed
+        return removed
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, bytes_saved=self.bytes_saved, evicted=self.evicted)
@@ -2,9 +2,6 @@
 # -*- coding: UTF-8 -*-
 
 import sys
-import colorama
-from colorama import Fore, Back, Style
-colorama.init()
 
 class Color(object):
     ''' Helper object for easily printing colored text to the terminal. '''
@@ -33,14 +30,27 @@ class Color(object):
 
 
     last_sameline_length = 0
+    _initialized = False
+    # Stream of the messages when none is given, None is sys.stdout
+    out = None
 
     @staticmethod
-    def p(text, out=sys.stdout):
+    def init():
+        ''' Wraps stdout and stderr with colorama, once '''
+        if not Color._initialized:
+            import colorama
+            colorama.init(strip=False)
+            Color._initialized = True
+
+    @staticmethod
+    def p(text, out=None):
         '''
         Prints text using colored format on same line.
         Example:
             Color.p("{R}This text is red. {W} This text is white")
         '''
+        if out is None:
+            out = Color.out if Color.out is not None else sys.stdout
         out.write(Color.s(text))
         out.flush()
         if '\r' in text:
@@ -50,7 +60,7 @@ class Color(object):
             Color.last_sameline_length += len(text)
 
     @staticmethod
-    def pl(text, out=sys.stdout):
+    def pl(text, out=None):
         '''Prints text using colored format with trailing new line.'''
         Color.p('%s\n' % text, out)
         Color.last_sameline_length = 0
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import codecs
+
+# Policies for input that is not valid UTF-8:
+#   replace  invalid bytes become U+FFFD
+#   cp437    invalid bytes are read as CP437 (DOS box drawing and ANSI art)
+#   strict   invalid bytes raise UnicodeDecodeError
+ERRORS = ('replace', 'cp437', 'strict')
+DEFAULT_ERRORS = 'replace'
+
+
+def _cp437_fallback(error: UnicodeDecodeError):
+    return error.object[error.start:error.end].decode('cp437'), error.end
+
+
+codecs.register_error('ansi2image.cp437', _cp437_fallback)
+
+
+def codec_errors(policy: str) -> str:
+    ''' Error handler name of a policy, for bytes.decode, open() or io.TextIOWrapper '''
+    if policy not in ERRORS:
+        raise ValueError('Unknown decode policy %s, available: %s' % (policy, ', '.join(ERRORS)))
+    return 'ansi2image.cp437' if policy == 'cp437' else policy
+
+
+def decode(data: bytes, policy: str = DEFAULT_ERRORS) -> str:
+    return data.decode('utf-8', codec_errors(policy))
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import io
+import zlib
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# File extension -> Pillow format
+_EXTENSIONS = {
+    'png': 'png',
+    'jpg': 'jpeg',
+    'jpeg': 'jpeg',
+    'webp': 'webp',
+    'avif': 'avif',
+}
+
+_CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+}
+
+# Encoder settings of each profile. Terminal text needs full chroma, so JPEG and AVIF
+# never subsample, and WebP is always lossless.
+# PNG: Pillow picks the row filters itself (adaptive on RGB, none on palette images), the
+# profiles set the zlib level and strategy. Pillow's default strategy is Z_FILTERED, kept by
+# balanced; on the benchmark corpora Z_DEFAULT_STRATEGY is 5% smaller at level 9 for the
+# same time, and Z_RLE doubles the size for 2% less time at level 1.
+_PROFILES = {
+    'fast': dict(
+        png=dict(compress_level=1, compress_type=zlib.Z_DEFAULT_STRATEGY),
+        jpeg=dict(quality=90, subsampling=0),
+        webp=dict(lossless=True, method=0, quality=0),
+        avif=dict(quality=90, speed=9, subsampling='4:4:4'),
+    ),
+    'balanced': dict(
+        png=dict(compress_level=6, compress_type=zlib.Z_FILTERED),
+        jpeg=dict(quality=100, subsampling=0),
+        webp=dict(lossless=True, method=4, quality=50),
+        avif=dict(quality=90, speed=8, subsampling='4:4:4'),
+    ),
+    'smallest': dict(
+        png=dict(compress_level=9, compress_type=zlib.Z_DEFAULT_STRATEGY, optimize=True),
+        jpeg=dict(quality=85, subsampling=0, optimize=True),
+        webp=dict(lossless=True, method=6, quality=100),
+        avif=dict(quality=80, speed=6, subsampling='4:4:4'),
+    ),
+}
+
+DEFAULT_PROFILE = 'balanced'
+
+
+class Encoder(object):
+    '''
+    Image encoders and their profiles:
+        fast      lowest CPU time, bigger files
+        balanced  the default, PNG and JPEG output is the same as before profiles existed
+                  (Pillow's default PNG, JPEG at quality 100)
+        smallest  smallest files, slow
+    '''
+
+    @staticmethod
+    def profiles() -> List[str]:
+        return list(_PROFILES)
+
+    @staticmethod
+    def formats() -> List[str]:
+        ''' File extensions that the installed Pillow can write '''
+        from PIL import Image
+
+        Image.init()
+        if 'AVIF' not in Image.SAVE:
+            try:
+                # Older Pillow releases need the pillow-avif-plugin package
+                import pillow_avif  # noqa: F401
+            except ImportError:
+                pass
+        return [ext for ext, fmt in _EXTENSIONS.items() if fmt.upper() in Image.SAVE]
+
+    @staticmethod
+    def normalize(format: str) -> str:
+        ''' "JPG" -> "jpeg", raises ValueError for unknown or unsupported formats '''
+        ext = str(format).strip('. ').lower()
+        if ext not in _EXTENSIONS or ext not in Encoder.formats():
+            raise ValueError('Unsupported image format %s, supported formats: %s' % (
+                format, ', '.join(Encoder.formats())))
+        return _EXTENSIONS[ext]
+
+    @staticmethod
+    def content_type(format: str) -> str:
+        return _CONTENT_TYPES[Encoder.normalize(format)]
+
+    @staticmethod
+    def options(format: str, profile: str = DEFAULT_PROFILE) -> dict:
+        ''' Pillow save options of a format in a profile '''
+        if profile not in _PROFILES:
+            raise ValueError('Invalid encode profile %s, supported profiles: %s' % (
+                profile, ', '.join(_PROFILES)))
+        return dict(_PROFILES[profile][Encoder.normalize(format)])
+
+    @staticmethod
+    def encode(img: 'Image.Image', format: str = 'png', profile: str = DEFAULT_PROFILE) -> bytes:
+        fmt = Encoder.normalize(format)
+        options = Encoder.options(fmt, profile)
+        if img.mode == 'P' and fmt != 'png':
+            # Only PNG keeps the palette, the other encoders work on RGB
+            img = img.convert('RGB')
+        data = io.BytesIO()
+        img.save(data, format=fmt, **options)
+        return data.getvalue()
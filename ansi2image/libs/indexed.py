@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Antialias levels tried for each (foreground, background) pair, best first
+_RAMP_LEVELS = (16, 8)
+_MAX_COLORS = 256
+# Binary mask: any ink replaces the pixel, the blend is already in the ramp
+_INK = [0] + [255] * 255
+
+
+class ColorIndex(object):
+    '''
+    Palette of an indexed (P mode) canvas.
+
+    Holds the background and foreground colors of the styles used by a document and,
+    for each (foreground, background) pair, an antialias ramp of a few blended colors.
+    Glyph coverage is quantized to the ramp, so 256 entries are enough for most terminal
+    output. Instances are built per document and are not shared between threads.
+    '''
+
+    def __init__(self, pairs: Iterable[Tuple[tuple, tuple]], background: tuple, levels: int = 16):
+        self.pairs = list(pairs)
+        self.background = tuple(background)
+        self.levels = levels
+        self.colors = []  # type: List[tuple]
+        self._index = {}  # color -> palette index
+        self._ramps = {}  # (foreground, background) -> palette indexes of the antialias ramp
+        self._tiles = {}
+
+        self.color(background)
+        for fg, bg in self.pairs:
+            self.color(bg)
+            self.color(fg)
+        for fg, bg in self.pairs:
+            ramp = [self.color(self.blend(fg, bg, k / (levels - 1))) for k in range(levels)]
+            # Coverage 0..255 -> palette index of the nearest ramp level
+            self._ramps[(fg, bg)] = [ramp[(a * (levels - 1) + 127) // 255] for a in range(256)]
+
+    def __reduce__(self):
+        # Other processes rebuild the same palette, glyph tiles are not sent
+        return (ColorIndex, (self.pairs, self.background, self.levels))
+
+    @staticmethod
+    def blend(fg: tuple, bg: tuple, alpha: float) -> tuple:
+        return tuple(int(round(b + (f - b) * alpha)) for f, b in zip(fg, bg))
+
+    @staticmethod
+    def used_pairs(document, background: tuple) -> List[Tuple[tuple, tuple]]:
+        ''' (foreground, background) of the styles used by the runs of a document '''
+        used = set()
+        for runs in document.runs:
+            for _, style_id in runs:
+                used.add(style_id)
+
+        pairs = {}
+        for style_id in sorted(used):
+            style = document.styles[style_id]
+            bg = tuple(style.background_color) if style.background_color is not None else tuple(background)
+            pairs[(tuple(style.foreground_color), bg)] = None
+        return list(pairs)
+
+    @staticmethod
+    def for_document(document, background: tuple, max_colors: int = _MAX_COLORS) -> Optional['ColorIndex']:
+        ''' Index of a document, None when its colors do not fit in max_colors '''
+        pairs = ColorIndex.used_pairs(document, background)
+        for levels in _RAMP_LEVELS:
+            index = ColorIndex(pairs, tuple(background), levels)
+            if len(index) <= max_colors:
+                return index
+        return None
+
+    def __len__(self):
+        return len(self.colors)
+
+    def color(self, rgb: tuple) -> int:
+        ''' Palette index of a color, added when it is new '''
+        rgb = tuple(rgb)
+        n = self._index.get(rgb)
+        if n is None:
+            n = self._index[rgb] = len(self.colors)
+            self.colors.append(rgb)
+        return n
+
+    def putpalette(self, img: 'Image.Image') -> None:
+        img.putpalette(b''.join(bytes(c) for c in self.colors), rawmode='RGB')
+
+    def tile(self, mask: 'Image.Image', foreground: tuple, background: tuple) -> Tuple['Image.Image', 'Image.Image']:
+        ''' (palette indexes, binary mask) of a glyph mask drawn over background '''
+        key = (id(mask), foreground, background)
+        entry = self._tiles.get(key)
+        if entry is None:
+            lut = self._ramps[(foreground, background)]
+            # The mask is kept alive by the entry, so its id is not reused while cached
+            entry = self._tiles[key] = (mask.point(lut), mask.point(_INK), mask)
+        return entry[0], entry[1]
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import itertools
+import mmap
+import os
+import re
+from array import array
+from typing import Iterator, List, Optional, Union
+
+# Bytes scanned at a time while indexing
+_CHUNK = 4 * 1024 * 1024
+
+_LINE_END = re.compile(rb'\r\n?|\n')
+
+
+class MappedLines(object):
+    '''
+    Lines of a file read through mmap, a lazy replacement for readlines().
+
+    Opening the file builds an index of line offsets (an array of 8 bytes per line), and
+    lines are only decoded when they are read. view() selects a range of lines without
+    reading the others, so rendering a page range or the tail of a multi-GB log touches
+    only those bytes. Indexing and slicing follow list semantics: an index returns a line
+    and a slice a list of lines, keeping the line end like readlines(). Lines are str
+    decoded with encoding, or bytes when encoding is None, left for the parser to decode.
+    LF, CR LF and a CR alone end a line, like bytes.splitlines() and the other loaders,
+    so progress bars redrawn with CR are lines.
+    The map and the file stay open until close(), or the end of a with block.
+    '''
+
+    def __init__(self, filename: str, encoding: Optional[str] = 'utf-8', errors: str = 'replace'):
+        self.filename = filename
+        self.encoding = encoding
+        self.errors = errors
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # Empty files can not be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        self._offsets = self._index(self._map)
+        self._start = 0
+        self._stop = len(self._offsets) - 1
+
+    @staticmethod
+    def _index(data: Union[mmap.mmap, bytes]) -> array:
+        ''' Start offset of each line, followed by the end of the data '''
+        offsets = array('Q', [0])
+        size = len(data)
+        pos = 0
+        while pos < size:
+            chunk = data[pos:pos + _CHUNK]
+            if chunk.endswith(b'\r') and pos + len(chunk) < size:
+                # A CR LF split between two chunks is one line end, the CR is scanned with the next chunk
+                chunk = chunk[:-1]
+            if b'\r' in chunk:
+                offsets.extend(pos + m.end() for m in _LINE_END.finditer(chunk))
+            else:
+                parts = chunk.split(b'\n')
+                # The end of every part but the last one is a line end, the next line starts after it
+                ends = itertools.accumulate((len(part) + 1 for part in parts[:-1]), initial=pos)
+                offsets.extend(itertools.islice(ends, 1, None))
+            pos += len(chunk)
+        if offsets[-1] != size:
+            # Last line without a newline
+            offsets.append(size)
+        return offsets
+
+    def view(self, start: Optional[int] = None, stop: Optional[int] = None) -> 'MappedLines':
+        ''' Lines start to stop (slice semantics, negative counts from the end), sharing the map and index '''
+        start, stop, _ = slice(start, stop).indices(len(self))
+        view = object.__new__(MappedLines)
+        view.__dict__.update(self.__dict__)
+        view._start = self._start + start
+        view._stop = self._start + max(start, stop)
+        return view
+
+    def tail(self, count: int) -> 'MappedLines':
+        return self.view(max(0, len(self) - count), None)
+
+    def _line(self, n: int) -> Union[str, bytes]:
+        line = self._map[self._offsets[n]:self._offsets[n + 1]]
+        return line if self.encoding is None else line.decode(self.encoding, self.errors)
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, bytes, List[Union[str, bytes]]]:
+        if isinstance(item, slice):
+            return [self._line(self._start + n) for n in range(len(self))[item]]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('line index out of range')
+        return self._line(self._start + item)
+
+    def __iter__(self) -> Iterator[Union[str, bytes]]:
+        for n in range(self._start, self._stop):
+            yield self._line(n)
+
+    @property
+    def nbytes(self) -> int:
+        ''' Size in bytes of the selected lines '''
+        return self._offsets[self._stop] - self._offsets[self._start]
+
+    def close(self) -> None:
+        # Views share the file, closing any of them closes all
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> 'MappedLines':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import json
+import os
+import threading
+from array import array
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+
+DEFAULT_BACKGROUND = (0, 0, 0)
+DEFAULT_FOREGROUND = (240, 240, 240)
+
+# Alpha used to draw reduced intensity (dim) text over the default foreground
+_DIM_ALPHA = 200
+
+#https://en.wikipedia.org/wiki/_ANSI_escape_code#3-bit_and_4-bit
+_ANSI_16_COLORS = [
+    (0, 0, 0),  # Black
+    (194, 54, 33),  # Red
+    (37, 188, 36),  # Green
+    (173, 173, 39),  # Yellow
+    (0, 0, 187),  # Blue
+    (211, 56, 211),  # Magenta
+    (0, 187, 187),  # Cyan
+    (187, 187, 187),  # White
+    (85, 85, 85),  # Bright Black (Gray)
+    (255, 85, 85),  # Bright Red
+    (85, 255, 85),  # Bright Green
+    (255, 255, 85),  # Bright Yellow
+    (85, 85, 255),  # Bright Blue
+    (255, 85, 255),  # Bright Magenta
+    (85, 255, 255),  # Bright Cyan
+    (255, 255, 255),  # Bright White
+]
+
+
+@lru_cache(maxsize=65536)
+def blend(base: Tuple[int], color: Tuple[int], alpha: int = _DIM_ALPHA) -> Tuple[int]:
+    '''
+    Blends color over base with the given alpha.
+    Uses the same integer rounding as Pillow when drawing RGBA ink over an RGB image.
+    '''
+    out = []
+    for b, c in zip(base, color):
+        tmp = (c - b) * alpha + 128
+        out.append(b + (((tmp >> 8) + tmp) >> 8))
+    return tuple(out)
+
+
+def parse_color(value: Union[str, list, tuple]) -> Tuple[int]:
+    ''' Accepts #rrggbb strings or [r, g, b] lists '''
+    if isinstance(value, str):
+        v = value.strip().lstrip('#')
+        if len(v) != 6:
+            raise ValueError(f'Invalid color "{value}"')
+        return int(v[0:2], 16), int(v[2:4], 16), int(v[4:6], 16)
+    if isinstance(value, dict):
+        return int(value['r']), int(value['g']), int(value['b'])
+    r, g, b = value
+    return int(r), int(g), int(b)
+
+
+class Palette(object):
+    '''
+    Compiled color tables of one theme.
+
+    Holds the 16 ANSI colors (SGR 30-37, 90-97 and backgrounds) and the 256 entries
+    used by 38;5;n / 48;5;n, together with their precomputed dim and bold variants,
+    so resolving a color is a table lookup.
+    '''
+    _default = None
+    _lock = threading.Lock()
+
+    def __init__(self, ansi: List[Tuple[int]], colors: List[Tuple[int]],
+                 foreground: Tuple[int] = DEFAULT_FOREGROUND, background: Tuple[int] = DEFAULT_BACKGROUND,
+                 bold_is_bright: bool = False, name: str = 'default'):
+        if len(ansi) != 16:
+            raise ValueError('A theme must define exactly 16 ANSI colors')
+        if len(colors) != 256:
+            raise ValueError('A palette must have exactly 256 colors')
+
+        self.name = name
+        self.foreground = tuple(foreground)
+        self.background = tuple(background)
+        self.bold_is_bright = bold_is_bright
+
+        self.ansi = tuple(tuple(c) for c in ansi)
+        self.colors = tuple(tuple(c) for c in colors)
+        self.dim_ansi = tuple(blend(self.foreground, c) for c in self.ansi)
+        self.dim_colors = tuple(blend(self.foreground, c) for c in self.colors)
+        self.bold_ansi = tuple(
+            self.ansi[i + 8] if bold_is_bright and i < 8 else c for i, c in enumerate(self.ansi)
+        )
+
+        # Flat RGB tables (r, g, b, r, g, b...) ready for Image.putpalette
+        self.table = array('B', [v for c in self.colors for v in c])
+        self.dim_table = array('B', [v for c in self.dim_colors for v in c])
+
+        self._dim = dict(zip(self.colors + self.ansi, self.dim_colors + self.dim_ansi))
+        self._bold = dict(zip(self.ansi[:8], self.bold_ansi[:8])) if bold_is_bright else {}
+
+    def color(self, index: int) -> Optional[Tuple[int]]:
+        ''' 256-color entry, or None when the index is out of range '''
+        if 0 <= index < 256:
+            return self.colors[index]
+        return None
+
+    def dim(self, color: Tuple[int], base: Optional[Tuple[int]] = None) -> Tuple[int]:
+        if base is None or base == self.foreground:
+            c = self._dim.get(color)
+            if c is not None:
+                return c
+            base = self.foreground
+        return blend(base, color)
+
+    def bold(self, color: Tuple[int]) -> Tuple[int]:
+        return self._bold.get(color, color)
+
+    @staticmethod
+    def default() -> 'Palette':
+        ''' Built-in theme, compiled on first use '''
+        if Palette._default is None:
+            with Palette._lock:
+                if Palette._default is None:
+                    Palette._default = Palette(_ANSI_16_COLORS, Palette._xterm_colors())
+        return Palette._default
+
+    @staticmethod
+    def _xterm_colors() -> List[Tuple[int]]:
+        #https://www.ditig.com/downloads/256-colors.json
+        here = os.path.abspath(os.path.dirname(__file__))
+        with open(f'{here}/256-colors.json', 'r') as f:
+            data = json.load(f)
+        colors = [(0, 0, 0)] * 256
+        for c in data:
+            colors[int(c['colorId'])] = parse_color(c['rgb'])
+        return colors
+
+    @staticmethod
+    def from_theme(theme: dict) -> 'Palette':
+        '''
+        Compiles a theme such as:
+            {
+                "name": "solarized", "foreground": "#839496", "background": "#002b36",
+                "colors": ["#073642", ... 16 entries], "palette": {"16": "#000000"},
+                "bold_is_bright": true
+            }
+        Missing keys keep the built-in values.
+        '''
+        default = Palette.default()
+        ansi = list(default.ansi)
+        if 'colors' in theme:
+            ansi = [parse_color(c) for c in theme['colors']]
+
+        colors = list(default.colors)
+        for idx, c in (theme.get('palette') or {}).items():
+            idx = int(idx)
+            if not 0 <= idx < 256:
+                raise ValueError(f'Invalid palette index {idx}')
+            colors[idx] = parse_color(c)
+
+        return Palette(
+            ansi=ansi,
+            colors=colors,
+            foreground=parse_color(theme.get('foreground', default.foreground)),
+            background=parse_color(theme.get('background', default.background)),
+            bold_is_bright=bool(theme.get('bold_is_bright', False)),
+            name=str(theme.get('name', 'custom')),
+        )
+
+    @staticmethod
+    def load(filename: str) -> 'Palette':
+        with open(filename, 'r', encoding='utf-8') as f:
+            return Palette.from_theme(json.load(f))
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import math
+from bisect import bisect_left
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING, Optional
+
+from PIL import Image
+
+from ..fonts.catalog import font_catalog
+
+if TYPE_CHECKING:
+    from ..ansi2image import Ansi2Image
+
+
+def render_bands(renderer: 'Ansi2Image', workers: int, executor: Optional[Executor] = None) -> Image.Image:
+    '''
+    Renders the loaded lines in horizontal bands on a process pool.
+
+    Each band starts from the SGR state found by a pre-scan of the previous lines and
+    writes its pixels straight into a shared memory canvas. Lines that may touch a band
+    are drawn in the same order and at the same coordinates as the serial path, so the
+    result is byte-identical to Ansi2Image._render.
+    '''
+    width, height = int(renderer.width), int(renderer.height)
+    lines = renderer.lines
+    cell = renderer.renderer.cell
+    cell_h = int(math.ceil(cell[1]))
+
+    # Same float accumulation as Ansi2Image._draw_runs
+    line_step = float(cell[1]) * float(renderer.line_height)
+    ys = []
+    y = float(renderer.margin)
+    for _ in lines:
+        ys.append(y)
+        y += line_step
+
+    bands = max(1, min(workers, len(lines), height))
+    rows = int(math.ceil(height / bands))
+    plan = []
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        # Include neighbour lines whose glyphs may overhang into this band
+        first = bisect_left(ys, top - 2 * cell_h - 1)
+        last = bisect_left(ys, bottom + cell_h)
+        base = top if first >= last else min(top, int(math.floor(ys[first])) - cell_h)
+        plan.append((top, bottom, first, last, max(0, base)))
+
+    index = renderer.renderer.color_index(renderer.document)
+    depth = 3 if index is None else 1
+
+    start_state = renderer.TextColor(foreground=renderer.foreground_color, background=renderer.background_color,
+                                     palette=renderer.palette)
+    states = renderer._sgr_prescan(lines, [p[2] for p in plan], start_state)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, width * height * depth))
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        jobs = [
+            dict(
+                shm=shm.name,
+                size=(width, height),
+                top=top,
+                bottom=bottom,
+                base=base,
+                lines=lines[first:last],
+                first_y=ys[first] if first < len(ys) else 0.0,
+                state=states[first],
+                font_name=renderer.font_name,
+                font_size=renderer.font_size,
+                line_height=renderer.line_height,
+                margin=renderer.margin,
+                foreground=renderer.foreground_color,
+                background=renderer.background_color,
+                palette=renderer.palette,
+                errors=renderer.errors,
+                index=index,
+                font_dirs=font_catalog.extra_directories,
+            )
+            for top, bottom, first, last, base in plan
+        ]
+        for future in [executor.submit(_render_band, job) for job in jobs]:
+            future.result()
+
+        mode = 'RGB' if index is None else 'P'
+        canvas = Image.frombuffer(mode, (width, height), shm.buf, 'raw', mode, 0, 1)
+        img = canvas.copy()
+        del canvas
+        if index is not None:
+            index.putpalette(img)
+        return img
+    finally:
+        if own_executor:
+            executor.shutdown()
+        shm.close()
+        shm.unlink()
+
+
+def _render_band(job: dict) -> int:
+    from ..ansi2image import Ansi2Image
+
+    for path in job['font_dirs']:
+        font_catalog.add_directory(path)
+
+    width, height = job['size']
+    top, bottom, base = job['top'], job['bottom'], job['base']
+
+    o = Ansi2Image(width, height, font_name=job['font_name'], font_size=job['font_size'],
+                   line_height=job['line_height'], palette=job['palette'])
+    o.margin = job['margin']
+    o.foreground_color = job['foreground']
+    o.background_color = job['background']
+
+    state = Ansi2Image.TextColor(foreground=o.foreground_color, background=o.background_color, palette=o.palette)
+    state.restore(job['state'])
+    document = Ansi2Image.Document(job['lines'], palette=o.palette, state=state, errors=job['errors'])
+
+    index = job['index']
+    img = o.renderer.canvas((width, bottom - base), index)
+    o._draw_runs(img, document.runs, document.styles, float(o.margin), job['first_y'], y_offset=base, index=index)
+    band = img.crop((0, top - base, width, bottom - base)).tobytes()
+    depth = 3 if index is None else 1
+
+    shm = shared_memory.SharedMemory(name=job['shm'])
+    try:
+        shm.buf[top * width * depth:bottom * width * depth] = band
+    finally:
+        shm.close()
+    return bottom - top
+
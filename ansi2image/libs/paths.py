@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os
+from pathlib import Path
+from typing import Optional
+
+
+def get_cache_dir(create: bool = True) -> Optional[str]:
+    '''
+    Returns the directory used for on-disk caches.
+    Honors ANSI2IMAGE_CACHE_DIR, then XDG_CACHE_HOME, then ~/.cache
+    '''
+    path = os.environ.get('ANSI2IMAGE_CACHE_DIR', '').strip()
+    if path == '':
+        base = os.environ.get('XDG_CACHE_HOME', '').strip()
+        if base == '':
+            base = os.path.join(str(Path.home()), '.cache')
+        path = os.path.join(base, 'ansi2image')
+
+    if create:
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            return None
+    return path
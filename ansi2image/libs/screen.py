@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+from collections import deque
+from typing import List, Optional, Tuple
+
+
+class Screen(object):
+    '''
+    Virtual terminal grid with scrollback.
+
+    Text is written at the cursor position and control functions (CR, LF, BS, TAB,
+    cursor movement and erase sequences) are applied, so output that rewrites itself
+    (progress bars, spinners) ends up as the final state instead of one line per update.
+    Cells hold (char, style_id); style_id None marks a cell that was never written.
+    '''
+
+    def __init__(self, columns: int = 80, rows: int = 24, scrollback: int = 1000):
+        if columns < 1 or rows < 1:
+            raise ValueError('Screen size must be at least 1x1')
+
+        self.columns = columns
+        self.rows = rows
+        self.scrollback = deque(maxlen=max(0, scrollback))
+        self.grid = [self._blank_row() for _ in range(rows)]
+        self.row = 0
+        self.column = 0
+        self._saved = (0, 0)
+
+    def _blank_row(self) -> Tuple[list, list]:
+        return [' '] * self.columns, [None] * self.columns
+
+    def write(self, text: str, style_id: int) -> None:
+        cols = self.columns
+        while text:
+            if self.column >= cols:
+                # Pending wrap, the previous write reached the last column
+                self.column = 0
+                self.linefeed()
+            chars, styles = self.grid[self.row]
+            part = text[:cols - self.column]
+            end = self.column + len(part)
+            chars[self.column:end] = part
+            styles[self.column:end] = [style_id] * len(part)
+            self.column = end
+            text = text[len(part):]
+
+    def control(self, char: str) -> None:
+        if char == '\n':
+            # Captured output has no tty translating LF into CR LF
+            self.column = 0
+            self.linefeed()
+        elif char == '\r':
+            self.column = 0
+        elif char == '\b':
+            self.column = max(0, min(self.column, self.columns - 1) - 1)
+        elif char == '\t':
+            self.column = min(self.columns - 1, (self.column // 8 + 1) * 8)
+        elif char in ('\x0b', '\x0c'):
+            self.linefeed()
+
+    def linefeed(self) -> None:
+        if self.row < self.rows - 1:
+            self.row += 1
+            return
+        self.scrollback.append(self.grid.pop(0))
+        self.grid.append(self._blank_row())
+
+    def csi(self, params: str, command: str, style_id: Optional[int] = None) -> None:
+        '''
+        Applies a CSI sequence. style_id is used to paint erased cells (background color erase).
+        SGR (m) must be handled by the caller.
+        '''
+        if params[:1] in ('<', '=', '>', '?'):
+            return
+        try:
+            args = [int(p) if p != '' else 0 for p in params.split(';')] if params else []
+        except ValueError:
+            return
+
+        def arg(i: int = 0, default: int = 1) -> int:
+            v = args[i] if len(args) > i else 0
+            return v if v > 0 else default
+
+        col = min(self.column, self.columns - 1)
+        if command == 'A':
+            self.row = max(0, self.row - arg())
+        elif command in ('B', 'e'):
+            self.row = min(self.rows - 1, self.row + arg())
+        elif command in ('C', 'a'):
+            self.column = min(self.columns - 1, col + arg())
+        elif command == 'D':
+            self.column = max(0, col - arg())
+        elif command == 'E':
+            self.row = min(self.rows - 1, self.row + arg())
+            self.column = 0
+        elif command == 'F':
+            self.row = max(0, self.row - arg())
+            self.column = 0
+        elif command in ('G', '`'):
+            self.column = min(self.columns - 1, arg() - 1)
+        elif command == 'd':
+            self.row = min(self.rows - 1, arg() - 1)
+        elif command in ('H', 'f'):
+            self.row = min(self.rows - 1, arg(0) - 1)
+            self.column = min(self.columns - 1, arg(1) - 1)
+        elif command == 'K':
+            mode = arg(0, 0)
+            start, end = {0: (col, self.columns), 1: (0, col + 1)}.get(mode, (0, self.columns))
+            self._erase(self.row, start, end, style_id)
+        elif command == 'J':
+            mode = arg(0, 0)
+            if mode == 0:
+                self._erase(self.row, col, self.columns, style_id)
+                for r in range(self.row + 1, self.rows):
+                    self._erase(r, 0, self.columns, style_id)
+            elif mode == 1:
+                for r in range(0, self.row):
+                    self._erase(r, 0, self.columns, style_id)
+                self._erase(self.row, 0, col + 1, style_id)
+            else:
+                for r in range(self.rows):
+                    self._erase(r, 0, self.columns, style_id)
+                if mode == 3:
+                    self.scrollback.clear()
+        elif command == 'X':
+            self._erase(self.row, col, min(self.columns, col + arg()), style_id)
+        elif command == 'P':
+            chars, styles = self.grid[self.row]
+            n = min(arg(), self.columns - col)
+            del chars[col:col + n], styles[col:col + n]
+            chars.extend([' '] * n)
+            styles.extend([style_id] * n)
+        elif command == '@':
+            chars, styles = self.grid[self.row]
+            n = min(arg(), self.columns - col)
+            chars[col:col] = [' '] * n
+            styles[col:col] = [style_id] * n
+            del chars[self.columns:], styles[self.columns:]
+        elif command == 'S':
+            for _ in range(min(arg(), self.rows)):
+                self.scrollback.append(self.grid.pop(0))
+                self.grid.append(self._blank_row())
+        elif command == 'T':
+            for _ in range(min(arg(), self.rows)):
+                self.grid.pop()
+                self.grid.insert(0, self._blank_row())
+        elif command == 's':
+            self._saved = (self.row, self.column)
+        elif command == 'u':
+            self.row, self.column = self._saved
+
+    def _erase(self, row: int, start: int, end: int, style_id: Optional[int]) -> None:
+        chars, styles = self.grid[row]
+        n = end - start
+        if n > 0:
+            chars[start:end] = [' '] * n
+            styles[start:end] = [style_id] * n
+
+    def lines(self, default_style: int) -> List[List[Tuple[str, int]]]:
+        '''
+        Scrollback followed by the screen as (text, style_id) runs.
+        Trailing cells and rows that were never written are dropped.
+        '''
+        rows = list(self.scrollback) + self.grid
+        last = len(rows)
+        while last > 0 and all(s is None for s in rows[last - 1][1]):
+            last -= 1
+
+        result = []
+        for chars, styles in rows[:last]:
+            end = len(styles)
+            while end > 0 and styles[end - 1] is None:
+                end -= 1
+
+            runs = []
+            start = 0
+            while start < end:
+                sid = styles[start]
+                stop = start + 1
+                while stop < end and styles[stop] == sid:
+                    stop += 1
+                runs.append((''.join(chars[start:stop]), default_style if sid is None else sid))
+                start = stop
+            result.append(runs)
+        return result
@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class RenderStats(object):
+    '''
+    Wall and CPU time of each stage of a render (load, parse, metrics, layout, draw,
+    encode...) and its counters (lines, runs, styles, draw calls, rectangles, pixels,
+    encoded bytes, cache hits).
+
+    A stage costs two clock reads on entry and two on exit, and counters are plain
+    integer additions done once per line or per image, so stats are always collected.
+    An instance is not thread-safe, use one per render.
+    '''
+
+    def __init__(self):
+        self.stages = {}  # name -> [wall, cpu, calls]
+        self.counters = {}  # name -> value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = [0.0, 0.0, 0]
+            entry[0] += time.perf_counter() - wall
+            entry[1] += time.process_time() - cpu
+            entry[2] += 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        stages = {
+            name: dict(wall=round(wall, 6), cpu=round(cpu, 6), calls=calls)
+            for name, (wall, cpu, calls) in self.stages.items()
+        }
+        return dict(
+            stages=stages,
+            wall=round(sum(s['wall'] for s in stages.values()), 6),
+            cpu=round(sum(s['cpu'] for s in stages.values()), 6),
+            counters=dict(self.counters),
+        )
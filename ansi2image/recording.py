@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import codecs
+import json
+import os
+import re
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+from .libs.screen import Screen
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+    from .ansi2image import Ansi2Image, Renderer
+    from .libs.indexed import ColorIndex
+
+# Animated output formats: extension -> Pillow format
+FORMATS = {'gif': 'gif', 'png': 'png', 'webp': 'webp'}
+
+# OSC, DCS, PM and APC strings (window titles, hyperlinks...) are not drawn
+_STRINGS = re.compile(r'\x1b[\]P^_][^\x07\x1b]*(?:\x07|\x1b\\)')
+# Sequence cut at the end of a chunk, kept until the next chunk arrives
+_PARTIAL = re.compile(r'\x1b(?:\[[0-?]*[ -/]*|[\]P^_][^\x07\x1b]*|[ -/]*)?\Z')
+
+
+class Recording(object):
+    '''
+    Timed output of a terminal session: asciinema .cast files (v1 and v2) or the
+    typescript and timing files written by script -t (classic and --log-timing formats).
+    events() reads the files again on each call, so a recording can be replayed
+    without holding it in memory.
+    '''
+
+    def __init__(self, path: str, timing: Optional[str] = None, columns: int = 80, rows: int = 24,
+                 idle_time_limit: Optional[float] = None):
+        self.path = path
+        self.timing = timing
+        self.columns = columns
+        self.rows = rows
+        self.idle_time_limit = idle_time_limit
+
+    @staticmethod
+    def open(path: str, timing: Optional[str] = None, size: Optional[Tuple[int, int]] = None) -> 'Recording':
+        ''' A .cast file, or a typescript when timing is given. size overrides the recorded terminal size '''
+        if timing is not None:
+            columns, rows = size if size is not None else (80, 24)
+            return Recording(path, timing=timing, columns=columns, rows=rows)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            header = Recording._header(f)
+        if not isinstance(header, dict) or header.get('version') not in (1, 2):
+            raise ValueError('Unsupported recording %s, expected an asciinema v1 or v2 file' % path)
+
+        columns, rows = size if size is not None else (int(header.get('width', 80)), int(header.get('height', 24)))
+        limit = header.get('idle_time_limit')
+        return Recording(path, columns=columns, rows=rows, idle_time_limit=float(limit) if limit else None)
+
+    @staticmethod
+    def _header(f) -> dict:
+        ''' The v2 header line, or the whole v1 document '''
+        first = f.readline()
+        try:
+            return json.loads(first)
+        except ValueError:
+            # v1 files are one JSON document, often indented
+            return json.loads(first + f.read())
+
+    def events(self) -> Iterator[Tuple[float, str]]:
+        ''' (seconds since the start, output text) '''
+        if self.timing is not None:
+            return self._script_events()
+        return self._cast_events()
+
+    def _cast_events(self) -> Iterator[Tuple[float, str]]:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            header = self._header(f)
+            if header.get('version') == 1:
+                # v1 holds all the output, with delays relative to the previous event
+                t = 0.0
+                for delay, data in header.get('stdout', []):
+                    t += float(delay)
+                    yield t, data
+                return
+
+            for line in f:
+                line = line.strip()
+                if line == '':
+                    continue
+                event = json.loads(line)
+                if len(event) >= 3 and event[1] == 'o':
+                    yield float(event[0]), event[2]
+
+    def _script_events(self) -> Iterator[Tuple[float, str]]:
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        with open(self.path, 'rb') as data, open(self.timing, 'r', encoding='utf-8') as timing:
+            first = data.readline()
+            if not first.startswith(b'Script started'):
+                # No header line, timing starts at the first byte
+                data.seek(0)
+
+            t = 0.0
+            for line in timing:
+                fields = line.split()
+                if len(fields) == 3:
+                    # --log-timing format: type delay bytes, only output (O) is replayed
+                    kind, delay, size = fields
+                    if kind != 'O':
+                        t += float(delay)
+                        continue
+                elif len(fields) == 2:
+                    delay, size = fields
+                else:
+                    continue
+                t += float(delay)
+                text = decoder.decode(data.read(int(size)))
+                if text:
+                    yield t, text
+
+
+class Animator(object):
+    '''
+    Renders a Recording as an animation (GIF, APNG or WebP).
+
+    Output is replayed through the virtual terminal Screen and sampled at most fps times
+    per second. Each frame only redraws the cells that differ from the previous frame, and
+    a screen that scrolled is moved with one paste when the row pitch is a whole number of
+    pixels. Frames that do not change are merged into the previous frame's duration.
+
+    The recording is parsed once up front to collect its styles, so an indexed Renderer
+    draws every frame on one shared palette. Frames with no changes are not stored, but
+    Pillow's writers keep every stored frame until the file is written.
+    '''
+
+    def __init__(self, renderer: 'Renderer', fps: float = 10.0, idle_limit: Optional[float] = None,
+                 last_frame: float = 1.0, loop: int = 0, margin: float = 0.02):
+        self.renderer = renderer
+        self.fps = max(0.1, float(fps))
+        self.idle_limit = idle_limit
+        self.last_frame = last_frame
+        self.loop = loop
+        self.margin = margin
+        self.stats = dict(events=0, frames=0, dirty_cells=0, scrolls=0)
+
+    @staticmethod
+    def _chunks(events: Iterator[Tuple[float, str]], idle_limit: Optional[float]) -> Iterator[Tuple[float, str]]:
+        ''' Events with idle time capped and escape sequences never split between chunks '''
+        pending = ''
+        last = offset = 0.0
+        for t, text in events:
+            if idle_limit is not None and t - last > idle_limit:
+                offset += t - last - idle_limit
+            last = t
+            text = pending + text
+            partial = _PARTIAL.search(text)
+            pending = partial.group(0) if partial is not None else ''
+            text = _STRINGS.sub('', text[:len(text) - len(pending)])
+            if text:
+                yield t - offset, text
+
+    def frames(self, recording: Recording) -> Iterator[Tuple['Image.Image', int]]:
+        ''' (frame, duration in ms), each frame is a new image '''
+        from .ansi2image import Ansi2Image
+        from .libs.indexed import ColorIndex
+
+        r = self.renderer
+        columns, rows = recording.columns, recording.rows
+        limit = self.idle_limit if self.idle_limit is not None else recording.idle_time_limit
+
+        def new_state() -> 'Ansi2Image.TextColor':
+            return Ansi2Image.TextColor(foreground=r.foreground, background=r.background, palette=r.palette)
+
+        styles = Ansi2Image.StyleTable()
+        default_style = styles.intern(new_state())
+
+        index = None
+        if r.indexed:
+            # Every style of the recording, so one palette serves all frames
+            state, screen = new_state(), Screen(columns, rows, 0)
+            for _, text in self._chunks(recording.events(), limit):
+                Ansi2Image._handle_terminal(text, state, styles, screen)
+            everything = Ansi2Image.Document.from_runs([[(' ', n) for n in range(len(styles))]], styles)
+            index = ColorIndex.for_document(everything, r.background)
+
+        extent = Ansi2Image.Document.from_runs([[(' ' * columns, default_style)]] * rows, styles)
+        m, width, height = r.layout(extent, self.margin)
+        img = r.canvas((int(width), int(height)), index)
+        painter = RowPainter(r, img, styles, default_style, m, index)
+
+        state, screen = new_state(), Screen(columns, rows, 0)
+        shown = [(list(chars), list(cell_styles)) for chars, cell_styles in screen.grid]
+        painter.paint_all(shown)
+
+        step = 1.0 / self.fps
+        pending = img.copy()
+        shown_at = due = last = 0.0
+        dirty = False
+        for t, text in self._chunks(recording.events(), limit):
+            if dirty and t >= due:
+                # The state after the previous chunk becomes a frame, at most fps times per second
+                start = max(last, due)
+                if painter.update(shown, screen.grid):
+                    if start > shown_at:
+                        yield pending, self._ms(shown_at, start)
+                    pending = img.copy()
+                    shown_at, due = start, start + step
+                dirty = False
+            Ansi2Image._handle_terminal(text, state, styles, screen)
+            self.stats['events'] += 1
+            last, dirty = t, True
+
+        if dirty and painter.update(shown, screen.grid):
+            start = max(last, due)
+            if start > shown_at:
+                yield pending, self._ms(shown_at, start)
+            pending = img
+        yield pending, int(round(self.last_frame * 1000))
+        self.stats['dirty_cells'] = painter.dirty_cells
+        self.stats['scrolls'] = painter.scrolls
+
+    @staticmethod
+    def _ms(start: float, end: float) -> int:
+        # Rounded on the timeline, so rounding errors do not add up over many frames
+        return int(round(end * 1000)) - int(round(start * 1000))
+
+    def save(self, recording: Recording, filename: str, format: Optional[str] = None) -> dict:
+        ''' Writes the animation, the format comes from the extension when not given '''
+        fmt = (format or os.path.splitext(filename)[1]).strip('. ').lower()
+        if fmt not in FORMATS:
+            raise ValueError('Unsupported animation format %s, supported formats: %s' % (fmt, ', '.join(FORMATS)))
+
+        frames = []
+        durations = []
+        for frame, duration in self.frames(recording):
+            frames.append(frame)
+            durations.append(max(10, duration))
+        self.stats['frames'] = len(frames)
+
+        options = dict(save_all=True, append_images=frames[1:], duration=durations, loop=self.loop)
+        if fmt == 'webp':
+            options.update(lossless=True, method=0, quality=0)
+        elif fmt == 'png':
+            options.update(compress_level=6)
+        frames[0].save(filename, format=FORMATS[fmt], **options)
+        return dict(self.stats, duration=round(sum(durations) / 1000.0, 3))
+
+
+class RowPainter(object):
+    '''
+    Keeps a canvas in sync with a screen grid, redrawing only the rows that changed.
+
+    Each row owns a band of the canvas, from its top to the top of the next row (the first
+    and last rows also own the margins). A full redraw erases each band before drawing its
+    row, so a band ends up with the ink of its row and the ink the row below overhangs into
+    it. A changed row rebuilds its band and the one above that way, drawing each row clipped
+    to the band, so frames are the same as redrawing every row.
+    '''
+
+    def __init__(self, renderer: 'Renderer', img: 'Image.Image', styles: 'Ansi2Image.StyleTable',
+                 default_style: int, margin: float, index: Optional['ColorIndex'] = None):
+        self.renderer = renderer
+        self.img = img
+        self.styles = styles
+        self.default_style = default_style
+        self.margin = margin
+        self.index = index
+        self.pitch = float(renderer.cell[1]) * renderer.line_height
+        self.fill = renderer.background if index is None else index.color(renderer.background)
+        self.dirty_cells = 0
+        self.scrolls = 0
+
+    def top(self, row: int) -> float:
+        return self.margin + row * self.pitch
+
+    def band(self, row: int, rows: int) -> Tuple[int, int]:
+        ''' Top and bottom pixel rows of the band of a row '''
+        top = 0 if row == 0 else int(self.top(row))
+        bottom = self.img.height if row == rows - 1 else int(self.top(row + 1))
+        return top, bottom
+
+    def _draw(self, img: 'Image.Image', row: int, line: Tuple[list, list], y_offset: int = 0) -> None:
+        chars, styles = line
+        runs = []
+        col = 0
+        while col < len(chars):
+            sid = styles[col]
+            stop = col + 1
+            while stop < len(chars) and styles[stop] == sid:
+                stop += 1
+            runs.append((''.join(chars[col:stop]), self.default_style if sid is None else sid))
+            col = stop
+        self.renderer.draw(img, [runs], self.styles, self.margin, self.top(row), y_offset=y_offset, index=self.index)
+
+    def paint_all(self, shown: List[Tuple[list, list]]) -> None:
+        for row, line in enumerate(shown):
+            top, bottom = self.band(row, len(shown))
+            self.img.paste(self.fill, (0, top, self.img.width, bottom))
+            self._draw(self.img, row, line)
+            self.dirty_cells += len(line[0])
+
+    def rebuild(self, row: int, grid: List[Tuple[list, list]]) -> None:
+        ''' Redraws the band of a row: erased, then its row and the row below clipped to it '''
+        top, bottom = self.band(row, len(grid))
+        band = self.img.crop((0, top, self.img.width, bottom))
+        band.paste(self.fill, (0, 0, band.width, band.height))
+        for n in range(row, min(row + 2, len(grid))):
+            self._draw(band, n, grid[n], top)
+        self.img.paste(band, (0, top))
+        self.dirty_cells += len(grid[row][0])
+
+    def _scroll(self, shown: List[Tuple[list, list]], grid: List[Tuple[list, list]]) -> None:
+        ''' Moves the canvas up when the screen scrolled, so only the new rows are drawn '''
+        rows = len(grid)
+        if rows < 2 or not self.pitch.is_integer() or grid[0] == shown[0]:
+            return
+        for k in range(1, rows):
+            # Rows still being written may differ, they are diffed after the move like any other
+            if grid[0] == shown[k] and sum(a == b for a, b in zip(grid, shown[k:])) * 2 > rows - k:
+                break
+        else:
+            return
+
+        # The rows move without the margins, which stay with the first and last bands
+        top, shift = int(self.top(0)), int(self.pitch) * k
+        self.img.paste(self.img.crop((0, top + shift, self.img.width, int(self.top(rows)))), (0, top))
+        # The rows that scrolled in match nothing, so they are drawn in full, and so is the first
+        # row, whose top margin still has the ink of the row that was there
+        blank = (['\0'] * len(grid[0][0]), [-1] * len(grid[0][0]))
+        shown[:] = [blank] + shown[k + 1:] + [blank] * k
+        self.scrolls += 1
+
+    def update(self, shown: List[Tuple[list, list]], grid: List[Tuple[list, list]]) -> bool:
+        ''' Draws what changed from shown to grid, then shown is grid. Returns False when nothing did '''
+        self._scroll(shown, grid)
+        changed = [row for row, (chars, styles) in enumerate(grid)
+                   if chars != shown[row][0] or styles != shown[row][1]]
+        # Glyphs of a row may overhang into the band above
+        for row in sorted(set(changed) | {row - 1 for row in changed if row > 0}):
+            self.rebuild(row, grid)
+        for row in changed:
+            shown[row] = (list(grid[row][0]), list(grid[row][1]))
+        return len(changed) > 0
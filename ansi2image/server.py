@@ -0,0 +1,350 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import io
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .__meta__ import __version__
+from .batch import _warm
+from .fonts.catalog import font_catalog
+from .libs.encoder import DEFAULT_PROFILE, Encoder
+from .libs.palette import Palette
+
+
+def _render(job: dict) -> Tuple[bytes, dict]:
+    '''
+    Renders one request in a warm worker, returns the image and the
+    cache counters of this worker process.
+    '''
+    from .ansi2image import Ansi2Image
+    from .fonts.atlas import glyph_atlas
+    from .fonts.metrics import metrics_cache
+
+    o = Ansi2Image(0, 0, font_name=job['font_name'], font_size=job['font_size'],
+                   palette=job.get('palette'), screen=job.get('screen'), indexed=job.get('indexed', False))
+    o.load(io.StringIO(job['text']))
+    o.calc_size()
+    data = o.generate_image(format=job['format'], profile=job.get('profile', DEFAULT_PROFILE))
+
+    return data, dict(
+        pid=os.getpid(),
+        metrics=dict(hits=metrics_cache.hits, misses=metrics_cache.misses),
+        atlas=dict(hits=glyph_atlas.hits, misses=glyph_atlas.misses),
+    )
+
+
+class RequestError(Exception):
+    ''' Invalid request, answered with an HTTP error status '''
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderServer(object):
+    '''
+    Long-running render service with a pool of warm worker processes.
+
+    Accepts ANSI text over localhost HTTP or HTTP on a Unix socket:
+        POST /render?font=<name>&size=<n>&format=png|jpg|webp|avif&profile=fast|balanced|smallest
+                    &screen=<COLSxROWS>   body: ANSI text
+        GET  /stats
+    At most workers + queue_size jobs are accepted at a time, extra requests get 503.
+    Only workers jobs are sent to the pool at once, the others wait for a free worker, so
+    the timeout counts the time a job runs. A job not finished in timeout seconds gets 504
+    and its worker is killed: the pool is replaced by a new one and the other jobs that were
+    running on it are sent again.
+    '''
+
+    def __init__(self, workers: int = 2, queue_size: int = 32, timeout: float = 30.0,
+                 font_name: str = 'JetBrains Mono Regular', font_size: int = 13, palette: Palette = None,
+                 max_input: int = 16 * 1024 * 1024, profile: str = DEFAULT_PROFILE, indexed: bool = False):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.max_input = max_input
+        self.options = dict(
+            format='png',
+            font_name=font_name,
+            font_size=font_size,
+            palette=palette,
+            profile=profile,
+            indexed=indexed,
+            font_dirs=font_catalog.extra_directories,
+        )
+
+        self._executor = None
+        self._server = None
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._running = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1024)
+        self._workers_stats = {}
+        self._in_flight = 0
+        self._counters = dict(requests=0, rendered=0, rejected=0, timeouts=0, errors=0)
+        self._started = time.time()
+
+    def start(self) -> None:
+        if self._executor is None:
+            self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_warm, initargs=(self.options,))
+
+    def _recycle(self, executor: ProcessPoolExecutor) -> None:
+        ''' Replaces a pool with a stuck worker, a running job can not be cancelled so its processes are killed '''
+        with self._lock:
+            if self._executor is not executor:
+                # Already replaced because of another timeout
+                return
+            self._executor = self._new_executor()
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False)
+        for process in processes:
+            process.terminate()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.server_close()
+            if isinstance(self._server.server_address, str) and os.path.exists(self._server.server_address):
+                os.unlink(self._server.server_address)
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def job(self, text: str, query: dict) -> dict:
+        ''' Validates the per-request options '''
+        def value(name: str, default=None):
+            return query.get(name, [default])[-1]
+
+        try:
+            fmt = Encoder.normalize(value('format', self.options['format']))
+        except ValueError:
+            raise RequestError(400, 'Invalid image format, supported formats: %s' % ', '.join(Encoder.formats()))
+
+        profile = value('profile', self.options['profile'])
+        if profile not in Encoder.profiles():
+            raise RequestError(400, 'Invalid encode profile, supported profiles: %s' % ', '.join(Encoder.profiles()))
+
+        try:
+            size = int(value('size', self.options['font_size']))
+            if not 4 <= size <= 200:
+                raise ValueError()
+        except ValueError:
+            raise RequestError(400, 'Invalid font size')
+
+        screen = value('screen')
+        if screen is not None:
+            try:
+                cols, rows = [int(v) for v in screen.lower().split('x')]
+                if not (0 < cols <= 1000 and 0 < rows <= 1000):
+                    raise ValueError()
+                screen = (cols, rows)
+            except ValueError:
+                raise RequestError(400, 'Invalid screen size, expected COLSxROWS')
+
+        font_name = value('font', self.options['font_name'])
+        from .fonts.truetypefont import TrueTypeFont
+        try:
+            TrueTypeFont(name=font_name, size=size)
+        except Exception:
+            raise RequestError(400, f'Font with name "{font_name}" not found')
+
+        if text.strip('\r\n') == '':
+            raise RequestError(400, 'Data is empty')
+
+        return dict(text=text, format=fmt, profile=profile, font_name=font_name, font_size=size, screen=screen,
+                    palette=self.options['palette'], indexed=self.options['indexed'])
+
+    def render(self, job: dict) -> bytes:
+        ''' Runs a validated job on the pool, blocking until done '''
+        with self._lock:
+            self._counters['requests'] += 1
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise RequestError(503, 'Render queue is full')
+
+        start = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # Queued jobs wait here instead of in the pool, where they would use up their timeout
+            with self._running:
+                data, stats = self._run(job)
+        finally:
+            # Workers of timed out jobs are killed, so the slot is free when the request ends
+            self._done()
+
+        with self._lock:
+            self._counters['rendered'] += 1
+            self._latencies.append(time.perf_counter() - start)
+            self._workers_stats[stats['pid']] = stats
+        return data
+
+    def _run(self, job: dict) -> Tuple[bytes, dict]:
+        for attempt in range(2):
+            executor = self._executor
+            future = executor.submit(_render, job)
+            try:
+                # A free worker starts the job at once, a job sent again gets a new timeout
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                self._recycle(executor)
+                with self._lock:
+                    self._counters['timeouts'] += 1
+                raise RequestError(504, 'Render timed out')
+            except BrokenProcessPool:
+                # The pool was killed because of the timeout of another job, run it again once
+                if attempt > 0 or self._executor is executor:
+                    with self._lock:
+                        self._counters['errors'] += 1
+                    raise
+            except Exception:
+                with self._lock:
+                    self._counters['errors'] += 1
+                raise
+
+    def _done(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    @staticmethod
+    def _percentile(values: list, p: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return round(values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))] * 1000.0, 3)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            workers = list(self._workers_stats.values())
+            in_flight = self._in_flight
+            counters = dict(self._counters)
+
+        def rate(name: str) -> dict:
+            hits = sum(w[name]['hits'] for w in workers)
+            misses = sum(w[name]['misses'] for w in workers)
+            return dict(hits=hits, misses=misses,
+                        hit_rate=round(hits / (hits + misses), 4) if hits + misses else None)
+
+        return dict(
+            version=__version__,
+            uptime=round(time.time() - self._started, 3),
+            workers=self.workers,
+            queue_size=self.queue_size,
+            running=min(in_flight, self.workers),
+            queue_depth=max(0, in_flight - self.workers),
+            latency_ms=dict(
+                p50=self._percentile(latencies, 50),
+                p90=self._percentile(latencies, 90),
+                p99=self._percentile(latencies, 99),
+                samples=len(latencies),
+            ),
+            metrics_cache=rate('metrics'),
+            glyph_atlas=rate('atlas'),
+            **counters,
+        )
+
+    def bind(self, address: str) -> socketserver.BaseServer:
+        '''
+        Binds the listening socket. address is [host:]port for HTTP or
+        a path (or unix:<path>) for a Unix socket.
+        '''
+        self.start()
+        handler = type('Handler', (_RequestHandler,), dict(render_server=self))
+
+        if address.startswith('unix:') or '/' in address:
+            path = address[5:] if address.startswith('unix:') else address
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = _UnixHTTPServer(path, handler)
+        else:
+            host, _, port = address.rpartition(':')
+            self._server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+            self._server.daemon_threads = True
+        return self._server
+
+    def serve_forever(self, address: str) -> None:
+        server = self._server if self._server is not None else self.bind(address)
+        try:
+            server.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    render_server = None  # type: RenderServer
+    server_version = f'ansi2image/{__version__}'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, data: dict) -> None:
+        self._send(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            self._send_json(200, self.render_server.stats)
+        else:
+            self._send_json(404, dict(error='Not found'))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/render':
+            self._send_json(404, dict(error='Not found'))
+            return
+
+        try:
+            try:
+                length = int(self.headers.get('Content-Length', '0'))
+            except ValueError:
+                raise RequestError(400, 'Invalid Content-Length')
+            if length < 0:
+                raise RequestError(400, 'Invalid Content-Length')
+            if length > self.render_server.max_input:
+                raise RequestError(413, 'Input too large')
+            try:
+                text = self.rfile.read(length).decode('utf-8')
+            except UnicodeDecodeError:
+                raise RequestError(400, 'Input is not valid UTF-8')
+
+            job = self.render_server.job(text, parse_qs(url.query))
+            data = self.render_server.render(job)
+            self._send(200, data, Encoder.content_type(job['format']))
+        except RequestError as e:
+            self._send_json(e.status, dict(error=str(e)))
+        except Exception as e:
+            self._send_json(500, dict(error=f'{type(e).__name__}: {e}'))
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+import base64
+import os
+import re
+from typing import TYPE_CHECKING, BinaryIO, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .ansi2image import Ansi2Image, Renderer
+
+FORMATS = ('svg', 'html')
+
+# Characters that are not allowed in XML, drawn as spaces to keep the columns
+_INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ud800-\udfff\ufffe\uffff]')
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}
+_FONT_TYPES = {'.ttf': 'font/ttf', '.otf': 'font/otf', '.woff': 'font/woff', '.woff2': 'font/woff2'}
+
+
+def _escape(text: str) -> str:
+    return ''.join(_ESCAPES.get(c, c) for c in _INVALID_XML.sub(' ', text))
+
+
+def _hex(color: Tuple[int]) -> str:
+    return '#%02x%02x%02x' % tuple(color[:3])
+
+
+class _Extent(object):
+    ''' Size of a streamed text, what Renderer.layout reads from a document '''
+
+    def __init__(self, max_width: int, lines: int):
+        self.max_width = max_width
+        self.runs = range(lines)
+
+
+class VectorWriter(object):
+    '''
+    Writes the style runs of a text as SVG or HTML, without rasterizing.
+
+    Lines are parsed and written one at a time, so time is linear in the input and memory
+    only holds the current line and the style classes. Adjacent runs of the same colors
+    are merged and each color becomes one CSS class. The style sheet is written at the end,
+    when every color is known, and the SVG header (whose size depends on the longest line)
+    is written with fixed width numbers and rewritten in place when the text ends.
+    The font is referenced by family name, embed_font embeds the font file in the output.
+    '''
+
+    def __init__(self, out: BinaryIO, renderer: 'Renderer', format: str = 'svg', margin: float = 0.02,
+                 embed_font: bool = False):
+        if format not in FORMATS:
+            raise ValueError('Unsupported vector format %s, supported formats: %s' % (format, ', '.join(FORMATS)))
+        self.out = out
+        self.renderer = renderer
+        self.format = format
+        self.margin = margin
+        self.embed_font = embed_font
+        self._classes = {}  # (kind, color) -> class name
+
+    @staticmethod
+    def save(renderer: 'Renderer', lines: Iterable[str], filename: str, format: Optional[str] = None,
+             margin: float = 0.02, embed_font: bool = False) -> dict:
+        ''' Writes lines to filename, the format comes from its extension when not given '''
+        if format is None:
+            format = os.path.splitext(filename)[1].strip('. ').lower()
+            format = 'html' if format == 'htm' else format
+        with open(filename, 'wb') as f:
+            return VectorWriter(f, renderer, format=format, margin=margin, embed_font=embed_font).write(lines)
+
+    def runs(self, lines: Iterable[str]) -> Iterable[Tuple[List[Tuple[str, int]], 'Ansi2Image.StyleTable']]:
+        ''' Style runs of each line, the screen mode emulates the whole text first '''
+        from .ansi2image import Ansi2Image
+
+        r = self.renderer
+        if r.screen is not None:
+            document = r.document(list(lines))
+            for line_runs in document.runs:
+                yield line_runs, document.styles
+            return
+
+        state = Ansi2Image.TextColor(foreground=r.foreground, background=r.background, palette=r.palette)
+        styles = Ansi2Image.StyleTable()
+        for line in lines:
+            yield list(Ansi2Image._handle_ansi_code(line.rstrip('\n').replace('\r', ''), state, styles)), styles
+
+    def write(self, lines: Iterable[str]) -> dict:
+        ''' Writes the whole output, returns its size in lines and columns '''
+        start = self.out.tell() if self.format == 'svg' else None
+        header = self._header(_Extent(0, 0))
+        self._write(header)
+
+        count = columns = 0
+        for line_runs, styles in self.runs(lines):
+            columns = max(columns, self._line(count, line_runs, styles))
+            count += 1
+
+        self._write(self._footer())
+        if self.format == 'svg':
+            end = self.out.tell()
+            final = self._header(_Extent(columns, count))
+            assert len(final) == len(header)
+            self.out.seek(start)
+            self._write(final)
+            self.out.seek(end)
+        return dict(lines=count, columns=columns)
+
+    def _write(self, text: str) -> None:
+        self.out.write(text.encode('utf-8'))
+
+    def _class(self, kind: str, color: Tuple[int]) -> str:
+        key = (kind, tuple(color))
+        name = self._classes.get(key)
+        if name is None:
+            name = self._classes[key] = '%s%d' % (kind, len(self._classes))
+        return name
+
+    def _merged(self, line_runs: List[Tuple[str, int]],
+                styles: 'Ansi2Image.StyleTable') -> List[Tuple[str, Tuple[int], Optional[Tuple[int]]]]:
+        ''' (text, foreground, background) of a line, adjacent runs of the same colors merged '''
+        merged = []
+        canvas = tuple(self.renderer.background)
+        for text, style_id in line_runs:
+            if text == '':
+                continue
+            style = styles[style_id]
+            fg = tuple(style.foreground_color)
+            bg = tuple(style.background_color) if style.background_color is not None else canvas
+            text = style.display(text)
+            if merged and merged[-1][1] == fg and merged[-1][2] == bg:
+                merged[-1] = (merged[-1][0] + text, fg, bg)
+            else:
+                merged.append((text, fg, bg))
+        return [(text, fg, None if bg == canvas else bg) for text, fg, bg in merged]
+
+    def _font_face(self) -> str:
+        family = self.renderer.font.getname()[0]
+        path = getattr(self.renderer.font, 'path', None)
+        if not self.embed_font or not isinstance(path, str) or not os.path.isfile(path):
+            return ''
+        ext = os.path.splitext(path)[1].lower()
+        with open(path, 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+        return "@font-face{font-family:'%s';src:url(data:%s;base64,%s);}" % (
+            family, _FONT_TYPES.get(ext, 'font/ttf'), data)
+
+    def _base_style(self) -> str:
+        r = self.renderer
+        return "%s.ansi{font-family:'%s',monospace;font-size:%dpx;white-space:pre;}" % (
+            self._font_face(), r.font.getname()[0], r.font_size)
+
+    def _class_styles(self) -> str:
+        if self.format == 'svg':
+            props = dict(f='fill', b='fill')
+        else:
+            props = dict(f='color', b='background-color')
+        return ''.join('.%s{%s:%s}' % (name, props[kind], _hex(color))
+                       for (kind, color), name in self._classes.items())
+
+    def _header(self, extent: _Extent) -> str:
+        r = self.renderer
+        if self.format == 'html':
+            return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>ansi2image</title>'
+                    '<style>body{margin:0;background:%s;}pre.ansi{margin:0;padding:%.0fpx;color:%s;'
+                    'line-height:%.3fpx;}</style></head>\n<body><pre class="ansi">' % (
+                        _hex(r.background), r.cell[0], _hex(r.foreground), r.cell[1] * r.line_height))
+
+        m, width, height = r.layout(extent, self.margin) if extent.runs else (0.0, 0.0, 0.0)
+        # Fixed width numbers, the final header must have the same length as the first one
+        size = ('%015.3f' % width, '%015.3f' % height, '%015.3f' % -m)
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<svg xmlns="http://www.w3.org/2000/svg" xml:space="preserve" class="ansi" '
+                'width="{0}" height="{1}" viewBox="{2} {2} {0} {1}">\n'
+                '<rect x="{2}" y="{2}" width="{0}" height="{1}" fill="{3}"/>\n').format(
+            size[0], size[1], size[2], _hex(r.background))
+
+    def _line(self, n: int, line_runs: List[Tuple[str, int]], styles: 'Ansi2Image.StyleTable') -> int:
+        ''' Writes one line, returns its width in columns '''
+        merged = self._merged(line_runs, styles)
+        if self.format == 'html':
+            parts = []
+            for text, fg, bg in merged:
+                classes = [self._class('f', fg)] + ([self._class('b', bg)] if bg is not None else [])
+                parts.append('<span class="%s">%s</span>' % (' '.join(classes), _escape(text)))
+            self._write(''.join(parts) + '\n')
+            return sum(len(text) for text, _, _ in merged)
+
+        r = self.renderer
+        (w, h) = r.cell
+        top = n * h * r.line_height
+        baseline = top + r.font.getmetrics()[0]
+        rects = []
+        texts = []
+        col = 0
+        for text, fg, bg in merged:
+            x = col * w
+            if bg is not None:
+                rects.append('<rect x="%.2f" y="%.2f" width="%.2f" height="%.2f" class="%s"/>' % (
+                    x, top, len(text) * w, h, self._class('b', bg)))
+            if text.strip() != '':
+                texts.append('<text x="%.2f" y="%.2f" class="%s">%s</text>' % (
+                    x, baseline, self._class('f', fg), _escape(text)))
+            col += len(text)
+        if rects or texts:
+            self._write(''.join(rects) + ''.join(texts) + '\n')
+        return col
+
+    def _footer(self) -> str:
+        if self.format == 'html':
+            # Classes are only known at the end, style sheets apply to the whole document
+            return '</pre>\n<style>%s%s</style>\n</body></html>\n' % (self._base_style(), self._class_styles())
+        return '<style>%s%s</style>\n</svg>\n' % (self._base_style(), self._class_styles())
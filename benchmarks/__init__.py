@@ -0,0 +1,6 @@
+'''
+ansi2image benchmarks. Not installed with the package, run them from a source checkout:
+
+    python -m benchmarks.stages --output result.json
+    python -m benchmarks.stages --baseline result.json
+'''
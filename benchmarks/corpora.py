@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Seeded synthetic corpora, the same text for a given seed and scale.
+
+Each corpus is (text, options), options are extra Ansi2Image arguments (e.g. the screen
+emulation for progress bars that rewrite their line with CR).
+'''
+import random
+from typing import Dict, List, Optional, Tuple
+
+_WORDS = ['INFO', 'WARN', 'ERROR', 'request', 'GET', '/api/v1/items', '200', '404', 'took', 'ms', 'user', 'id',
+          'cache', 'miss', 'retry', 'worker', 'job', 'done']
+
+
+def _words(rnd: random.Random, low: int, high: int) -> str:
+    return ' '.join(rnd.choice(_WORDS) for _ in range(rnd.randint(low, high)))
+
+
+def plain(rnd: random.Random, lines: int) -> str:
+    ''' No escape sequences at all '''
+    return ''.join('%s\n' % _words(rnd, 3, 14) for _ in range(lines))
+
+
+def sgr16(rnd: random.Random, lines: int) -> str:
+    ''' A color change every word or two, bold and dim, like a colored test runner '''
+    out = []
+    for _ in range(lines):
+        parts = []
+        for _ in range(rnd.randint(3, 10)):
+            code = rnd.choice(('31', '32', '33', '34', '35', '36', '90', '1;31', '2;37', '1;92', '41;97', '0'))
+            parts.append('\x1b[%sm%s' % (code, rnd.choice(_WORDS)))
+        out.append(' '.join(parts) + '\x1b[0m\n')
+    return ''.join(out)
+
+
+def sgr256(rnd: random.Random, lines: int) -> str:
+    ''' 256 color foregrounds and backgrounds '''
+    out = []
+    for _ in range(lines):
+        parts = []
+        for _ in range(rnd.randint(3, 10)):
+            parts.append('\x1b[38;5;%dm\x1b[48;5;%dm%s' % (rnd.randint(0, 255), rnd.choice((0, 16, 234, 236, 17)),
+                                                       rnd.choice(_WORDS)))
+        out.append(' '.join(parts) + '\x1b[0m\n')
+    return ''.join(out)
+
+
+def truecolor(rnd: random.Random, lines: int) -> str:
+    ''' 24-bit gradients, one color per cell (every cell is a new style) '''
+    out = []
+    width = 80
+    for y in range(lines):
+        shift = rnd.randint(0, 255)
+        out.append(''.join('\x1b[48;2;%d;%d;%dm ' % ((x * 3 + shift) % 256, (y * 5) % 256, (255 - x * 3) % 256)
+                           for x in range(width)) + '\x1b[0m\n')
+    return ''.join(out)
+
+
+def wide(rnd: random.Random, lines: int) -> str:
+    ''' Few very long lines (minified JSON, stack traces on one line) '''
+    count = max(1, lines // 50)
+    return ''.join('\x1b[36m%s\x1b[0m %s\n' % (_words(rnd, 1, 3), _words(rnd, 600, 800)) for _ in range(count))
+
+
+def long_log(rnd: random.Random, lines: int) -> str:
+    ''' Many short lines, like a long CI build '''
+    out = []
+    for i in range(lines * 10):
+        if rnd.random() < 0.05:
+            out.append('\x1b[1;31merror:\x1b[0m src/module_%d.c:%d: undefined reference\n' % (i, rnd.randint(1, 900)))
+        else:
+            out.append('  CC      src/module_%d.o\n' % i)
+    return ''.join(out)
+
+
+def progress(rnd: random.Random, lines: int) -> str:
+    ''' Progress bars redrawn with CR, hundreds of times per line '''
+    out = []
+    for n in range(max(1, lines // 10)):
+        steps = rnd.randint(100, 300)
+        bars = ['\r\x1b[32m[%-40s]\x1b[0m %3d%% file_%d' % ('#' * (40 * k // steps), 100 * k // steps, n)
+                for k in range(steps + 1)]
+        out.append(''.join(bars) + '\n')
+    return ''.join(out)
+
+
+def pathological(rnd: random.Random, lines: int) -> str:
+    ''' Escape sequences that stress the tokenizer '''
+    out = []
+    for _ in range(lines):
+        kind = rnd.randint(0, 6)
+        if kind == 0:
+            # Long SGR parameter lists
+            out.append('\x1b[%sm%s' % (';'.join(str(rnd.randint(0, 107)) for _ in range(60)), _words(rnd, 1, 3)))
+        elif kind == 1:
+            # Escape after escape, no text in between
+            out.append(''.join('\x1b[%dm' % rnd.randint(30, 37) for _ in range(100)) + 'x')
+        elif kind == 2:
+            # Sequences cut or never finished
+            out.append('text \x1b[12;34 more \x1b \x1b[ \x1b[?25 end')
+        elif kind == 3:
+            # Huge numbers and private modes
+            out.append('\x1b[99999999999m\x1b[?1049h\x1b[38;5;99999m\x1b[38;2;999;999;999mz\x1b[?1049l')
+        elif kind == 4:
+            # OSC titles and hyperlinks
+            out.append('\x1b]0;title %s\x07\x1b]8;;https://example.com\x1b\\link\x1b]8;;\x1b\\' % _words(rnd, 1, 4))
+        elif kind == 5:
+            # Cursor movement and erase sequences
+            out.append(''.join('\x1b[%d%s' % (rnd.randint(1, 40), rnd.choice('ABCDGHJK')) for _ in range(30)) + 'y')
+        else:
+            # C0 controls mixed with text
+            out.append('\t'.join(_words(rnd, 1, 2) + rnd.choice(('\x07', '\b', '\x0b', '\x0c', '')) for _ in range(8)))
+        out.append('\x1b[0m\n')
+    return ''.join(out)
+
+
+# name -> (generator, Ansi2Image options)
+CORPORA = {
+    'plain': (plain, {}),
+    'sgr16': (sgr16, {}),
+    'sgr256': (sgr256, {}),
+    'truecolor': (truecolor, {}),
+    'wide': (wide, {}),
+    'long': (long_log, {}),
+    'progress': (progress, dict(screen=(100, 40))),
+    'pathological': (pathological, {}),
+}
+
+
+def corpora(lines: int = 200, seed: int = 1, names: Optional[List[str]] = None) -> Dict[str, Tuple[str, dict]]:
+    ''' name -> (text, options), lines sets the size of every corpus '''
+    names = names or list(CORPORA)
+    unknown = [n for n in names if n not in CORPORA]
+    if unknown:
+        raise ValueError('Unknown corpus %s, available: %s' % (', '.join(unknown), ', '.join(CORPORA)))
+
+    result = {}
+    for name in names:
+        generator, options = CORPORA[name]
+        # One generator per corpus, so selecting a subset does not change the others
+        rnd = random.Random('%d:%s' % (seed, name))
+        result[name] = (generator(rnd, max(1, lines)), dict(options))
+    return result
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Encode benchmark.
+
+Renders a few seeded, representative terminal logs once and encodes each of them with
+every format and profile, reporting the best encode time and the size of the output.
+
+    python benchmarks/encode.py --lines 200 --formats png,jpg,webp --repeat 3
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ansi2image.ansi2image import Renderer  # noqa: E402
+from ansi2image.libs.encoder import Encoder  # noqa: E402
+
+
+def corpus(lines: int = 200, seed: int = 1) -> dict:
+    ''' Log-like documents, the same for a given seed '''
+    rnd = random.Random(seed)
+    words = ['INFO', 'WARN', 'ERROR', 'request', 'GET', '/api/v1/items', '200', '404', 'took', 'ms', 'user', 'id']
+
+    build = []
+    for i in range(lines):
+        if rnd.random() < 0.1:
+            build.append('\x1b[1;31merror:\x1b[0m src/module_%d.c:%d: undefined reference\n' % (i, rnd.randint(1, 900)))
+        else:
+            build.append('  CC      src/module_%d.o\n' % i)
+
+    app = []
+    for _ in range(lines):
+        color = rnd.choice((31, 32, 33, 34, 36, 90))
+        text = ' '.join(rnd.choice(words) for _ in range(rnd.randint(3, 14)))
+        app.append('\x1b[90m2024-01-01 12:%02d:%02d\x1b[0m \x1b[%dm%s\x1b[0m\n' % (
+            rnd.randint(0, 59), rnd.randint(0, 59), color, text))
+
+    # Full width background bars, like top or a test runner summary
+    tui = []
+    for i in range(lines):
+        bg = 44 if i % 10 == 0 else rnd.choice((40, 40, 40, 42, 41))
+        tui.append('\x1b[%d;97m%-100s\x1b[0m\n' % (bg, ' '.join(rnd.choice(words) for _ in range(8))))
+
+    return dict(build=''.join(build), app=''.join(app), tui=''.join(tui))
+
+
+def run(lines: int = 200, formats: list = None, profiles: list = None, repeat: int = 3, seed: int = 1) -> dict:
+    formats = formats or [f for f in ('png', 'jpg', 'webp') if f in Encoder.formats()]
+    profiles = profiles or Encoder.profiles()
+    renderer = Renderer(font_size=13)
+
+    result = dict(python=sys.version.split()[0], lines=lines, repeat=repeat, seed=seed, documents={})
+    for name, text in corpus(lines, seed).items():
+        img = renderer.render_image(text)
+        raw = img.width * img.height * 3
+        rows = result['documents'][name] = dict(size=list(img.size), raw_bytes=raw, encodes=[])
+        for fmt in formats:
+            for profile in profiles:
+                best = None
+                for _ in range(max(1, repeat)):
+                    start = time.perf_counter()
+                    data = Encoder.encode(img, format=Encoder.normalize(fmt), profile=profile)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                rows['encodes'].append(dict(format=fmt, profile=profile, seconds=round(best, 4), bytes=len(data),
+                                            ratio=round(raw / len(data), 2)))
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='ansi2image encode benchmark')
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--formats', type=str, default=None,
+                        help='comma separated, default: png,jpg,webp (avif is slow and must be asked for)')
+    parser.add_argument('--profiles', type=str, default=None, help='comma separated, default: all profiles')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    formats = args.formats.split(',') if args.formats else None
+    profiles = args.profiles.split(',') if args.profiles else None
+    print(json.dumps(run(max(1, args.lines), formats, profiles, args.repeat, args.seed), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
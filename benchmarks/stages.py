@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Stage benchmark.
+
+Times each stage of a render separately on the seeded corpora of benchmarks.corpora:
+    parse           Document.parse (_handle_ansi_code per line, or the Screen emulation)
+    calc_size       layout of the parsed document
+    draw            generate_image without encoding
+    encode          Encoder.encode of the drawn image
+    generate_image  draw and encode, as called by save_image
+and, once, textlength (cell metrics of a font, with the metrics cache cleared).
+
+Each stage runs --repeat times, the best and median times are reported. The result is
+JSON; with --baseline a previous result is compared stage by stage and the exit code is 1
+when a stage got slower than --threshold times its baseline.
+
+    python -m benchmarks.stages --lines 200 --output baseline.json
+    python -m benchmarks.stages --lines 200 --baseline baseline.json --threshold 1.25
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ansi2image.__meta__ import __version__  # noqa: E402
+from ansi2image.ansi2image import Ansi2Image  # noqa: E402
+from ansi2image.fonts.metrics import metrics_cache  # noqa: E402
+from ansi2image.fonts.truetypefont import TrueTypeFont  # noqa: E402
+from ansi2image.libs.encoder import DEFAULT_PROFILE, Encoder  # noqa: E402
+from benchmarks.corpora import CORPORA, corpora  # noqa: E402
+
+STAGES = ('parse', 'calc_size', 'draw', 'encode', 'generate_image')
+# Stages faster than this in the baseline and the result are too noisy to compare
+_NOISE_SECONDS = 0.002
+
+
+def _time(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], object]] = None) -> dict:
+    times = []
+    for _ in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return dict(best=round(min(times), 6), median=round(statistics.median(times), 6))
+
+
+def _document(lines: List[str], options: dict) -> 'Ansi2Image.Document':
+    return Ansi2Image.Document(lines, screen=options.get('screen'), scrollback=options.get('scrollback', 1000))
+
+
+def run(lines: int = 200, repeat: int = 3, seed: int = 1, names: Optional[List[str]] = None,
+        format: str = 'png', profile: str = DEFAULT_PROFILE, font_size: int = 13) -> dict:
+    from PIL import __version__ as pillow_version
+
+    fmt = Encoder.normalize(format)
+    font = TrueTypeFont(name=Ansi2Image.font_name, size=font_size).truetype
+    result = dict(
+        version=__version__, python=sys.version.split()[0], implementation=platform.python_implementation(),
+        pillow=pillow_version, machine=platform.machine(), lines=lines, repeat=repeat, seed=seed,
+        format=fmt, profile=profile, font_size=font_size,
+        textlength=_time(lambda: Ansi2Image.textlength(font), repeat, setup=metrics_cache.clear),
+        corpora={},
+    )
+
+    for name, (text, options) in corpora(lines, seed, names).items():
+        o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=font_size, **options)
+        o.loads(text)
+        source = o.lines
+        o.document = _document(source, options).parse()
+        o.calc_size()
+        img = o._render(o.document, (o.width, o.height), o.margin)
+
+        stages = dict(
+            parse=_time(lambda: _document(source, options).parse(), repeat),
+            calc_size=_time(o.calc_size, repeat),
+            draw=_time(lambda: o._render(o.document, (o.width, o.height), o.margin), repeat),
+            encode=_time(lambda: Encoder.encode(img, format=fmt, profile=profile), repeat),
+            generate_image=_time(lambda: o.generate_image(format=fmt, profile=profile), repeat),
+        )
+        result['corpora'][name] = dict(lines=len(source), chars=len(text), size=list(img.size), stages=stages)
+    return result
+
+
+def compare(result: dict, baseline: dict, threshold: float = 1.25) -> List[dict]:
+    ''' Stages present in both, with the ratio of the best times; regression when ratio > threshold '''
+    rows = []
+    pairs = [('textlength', result.get('textlength'), baseline.get('textlength'))]
+    for name, corpus in result.get('corpora', {}).items():
+        old = baseline.get('corpora', {}).get(name)
+        if old is None:
+            continue
+        for stage in STAGES:
+            pairs.append(('%s.%s' % (name, stage), corpus['stages'].get(stage), old['stages'].get(stage)))
+
+    for key, new, old in pairs:
+        if new is None or old is None:
+            continue
+        ratio = new['best'] / old['best'] if old['best'] > 0 else 1.0
+        noisy = max(new['best'], old['best']) < _NOISE_SECONDS
+        rows.append(dict(stage=key, baseline=old['best'], current=new['best'], ratio=round(ratio, 3),
+                         regression=not noisy and ratio > threshold))
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='ansi2image stage benchmark')
+    parser.add_argument('--lines', type=int, default=200, help='size of each corpus')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--corpora', type=str, default=None,
+                        help='comma separated, default: all (%s)' % ', '.join(CORPORA))
+    parser.add_argument('--format', type=str, default='png')
+    parser.add_argument('--profile', type=str, default=DEFAULT_PROFILE)
+    parser.add_argument('--output', type=str, default=None, help='write the JSON result to this file')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON result of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression (default: 1.25)')
+    args = parser.parse_args()
+
+    names = args.corpora.split(',') if args.corpora else None
+    result = run(max(1, args.lines), max(1, args.repeat), args.seed, names, args.format, args.profile)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline.get('lines'), baseline.get('seed')) != (result['lines'], result['seed']):
+            print('Baseline was run with other --lines or --seed, times are not comparable', file=sys.stderr)
+            return 2
+        result['comparison'] = compare(result, baseline, args.threshold)
+        regressions = [r for r in result['comparison'] if r['regression']]
+
+    data = json.dumps(result, indent=2)
+    print(data)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+    for r in regressions:
+        print('Regression: %s %.4fs -> %.4fs (x%.2f)' % (r['stage'], r['baseline'], r['current'], r['ratio']),
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
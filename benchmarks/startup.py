@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Startup benchmark.
+
+Measures, in fresh interpreters, the cumulative import time of ansi2image.ansi2image
+(from -X importtime) and the wall time of the --version and --help command lines.
+Heavy modules (PIL, colorama) must not be imported by any of them.
+
+    python benchmarks/startup.py --runs 10 --max-import-ms 60
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+_HEAVY = ('PIL', 'colorama', 'multiprocessing', 'http')
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (_ROOT, env.get('PYTHONPATH')) if p)
+    return env
+
+
+def import_time(module: str = 'ansi2image.ansi2image') -> dict:
+    ''' Cumulative import time (us) of module and the heavy packages it pulled in '''
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, env=_env(), check=True)
+    total = 0
+    heavy = set()
+    for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name.split('.')[0] in _HEAVY:
+            heavy.add(name.split('.')[0])
+        if name == module:
+            total = int(cumulative)
+    return dict(us=total, heavy=sorted(heavy))
+
+
+def command_time(*args: str) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'ansi2image'] + list(args),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=_env())
+    return time.perf_counter() - start
+
+
+def run(runs: int = 10) -> dict:
+    # Warm the bytecode cache and the OS page cache first
+    import_time()
+    imports = [import_time() for _ in range(runs)]
+    version = [command_time('--version') for _ in range(runs)]
+    help_ = [command_time('--help') for _ in range(runs)]
+
+    def summary(values: list, scale: float) -> dict:
+        return dict(
+            median_ms=round(statistics.median(values) * scale, 3),
+            min_ms=round(min(values) * scale, 3),
+            max_ms=round(max(values) * scale, 3),
+        )
+
+    return dict(
+        python=sys.version.split()[0],
+        runs=runs,
+        import_ansi2image=dict(heavy_modules=imports[-1]['heavy'], **summary([i['us'] for i in imports], 0.001)),
+        cli_version=summary(version, 1000.0),
+        cli_help=summary(help_, 1000.0),
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='ansi2image startup benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, default=None,
+                        help='exit with 1 when the median import time is above this value')
+    parser.add_argument('--output', type=str, default=None, help='write the JSON result to this file')
+    args = parser.parse_args()
+
+    result = run(max(1, args.runs))
+    data = json.dumps(result, indent=2)
+    print(data)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+    if result['import_ansi2image']['heavy_modules']:
+        print('Heavy modules imported at startup: %s' % ', '.join(result['import_ansi2image']['heavy_modules']),
+              file=sys.stderr)
+        return 1
+    if args.max_import_ms is not None and result['import_ansi2image']['median_ms'] > args.max_import_ms:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
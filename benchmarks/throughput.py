@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+'''
+Throughput benchmark.
+
+Renders the same seeded corpus of small ANSI documents on a thread pool, once building
+an Ansi2Image per job and once sharing one Renderer, and reports documents per second.
+
+    python benchmarks/throughput.py --jobs 200 --threads 4
+'''
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ansi2image.ansi2image import Ansi2Image, Renderer  # noqa: E402
+
+
+def corpus(jobs: int, lines: int = 24, seed: int = 1) -> list:
+    ''' Colored log-like documents, the same for a given seed '''
+    rnd = random.Random(seed)
+    words = ['INFO', 'WARN', 'ERROR', 'request', 'GET', '/api/v1/items', '200', '404', 'took', 'ms', 'user', 'id']
+    docs = []
+    for _ in range(jobs):
+        out = []
+        for _ in range(lines):
+            color = rnd.choice((31, 32, 33, 34, 36, 90))
+            text = ' '.join(rnd.choice(words) for _ in range(rnd.randint(3, 12)))
+            out.append('\x1b[%dm%s\x1b[0m %s\n' % (color, text[:8], text[8:]))
+        docs.append(''.join(out))
+    return docs
+
+
+def per_job(text: str) -> int:
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13)
+    o.load(io.StringIO(text))
+    o.calc_size()
+    return len(o.generate_image())
+
+
+def run(jobs: int = 200, threads: int = 4, seed: int = 1) -> dict:
+    docs = corpus(jobs, seed=seed)
+    renderer = Renderer(font_size=13)
+    renderer.render(docs[0])  # warm fonts, metrics and glyph tiles for both modes
+
+    result = dict(python=sys.version.split()[0], jobs=jobs, threads=threads, seed=seed)
+    for name, fn in (('ansi2image_per_job', per_job), ('shared_renderer', lambda t: len(renderer.render(t)))):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            total = sum(pool.map(fn, docs))
+        elapsed = time.perf_counter() - start
+        result[name] = dict(seconds=round(elapsed, 4), docs_per_second=round(jobs / elapsed, 2), bytes=total)
+
+    result['speedup'] = round(result['ansi2image_per_job']['seconds'] / result['shared_renderer']['seconds'], 3)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='ansi2image renderer throughput benchmark')
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(json.dumps(run(max(1, args.jobs), max(1, args.threads), args.seed), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
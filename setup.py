@@ -63,7 +63,7 @@ setup(
     author=meta["__author__"],
     author_email=meta["__author_email__"],
     url=meta["__url__"],
-    packages=find_packages(),
+    packages=find_packages(exclude=('benchmarks', 'benchmarks.*', 'tests', 'tests.*')),
     package_data=package_data,
     #include_package_data=True,
     python_requires=">=3.8, <4",
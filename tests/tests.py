@@ -2,7 +2,7 @@
 import codecs
 import datetime
 
-import pytest, sys
+import pytest, sys, os
 import io
 
 from ansi2image.ansi2image import Ansi2Image
@@ -63,3 +63,836 @@ def test_background_color_rendering():
 
     # top-left pixel belongs to first glyph background when margin is zero
     assert img.getpixel((0, 0)) == (194, 54, 33)
+
+
+def test_metrics_cache(tmp_path):
+    from ansi2image.fonts.metrics import MetricsCache
+    from ansi2image.fonts.truetypefont import TrueTypeFont
+
+    font = TrueTypeFont(size=13).truetype
+    cache = MetricsCache(disk_path=str(tmp_path / 'metrics.json'))
+
+    w, h = cache.get(font)
+    assert (w, h) == (MetricsCache.rasterized_advance(font), sum(font.getmetrics()))
+    assert cache.get(font) == (w, h)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A new process reuses the disk store without measuring again
+    other = MetricsCache(disk_path=str(tmp_path / 'metrics.json'))
+    assert other._disk_get(other._key(font)) == (w, h)
+
+
+def test_glyph_atlas():
+    from PIL import Image, ImageDraw, ImageChops
+    from ansi2image.fonts.atlas import GlyphAtlas
+    from ansi2image.fonts.truetypefont import TrueTypeFont
+
+    font = TrueTypeFont(size=13).truetype
+    cell = Ansi2Image.textlength(font)
+    size = (int(cell[0] * 8), int(cell[1]))
+    atlas = GlyphAtlas()
+
+    img = Image.new('RGB', size, (0, 0, 0))
+    assert atlas.draw(img, font, 'abab', 0, 0, cell, (240, 240, 240))
+    assert (atlas.hits, atlas.misses) == (2, 2)
+
+    expected = Image.new('RGB', size, (0, 0, 0))
+    ImageDraw.Draw(expected).text((0, 0), 'abab', font=font, fill=(240, 240, 240))
+    assert ImageChops.difference(img, expected).getbbox() is None
+
+    # Glyphs at fractional positions land where the text path puts them, with the ink past their cell
+    for x, y in ((2.6, 1.3), (0.4, 0.7), (3.99, 0.0)):
+        img = Image.new('RGB', size, (0, 0, 0))
+        atlas.draw(img, font, 'W_j|', x, y, cell, (240, 240, 240))
+        expected = Image.new('RGB', size, (0, 0, 0))
+        draw = ImageDraw.Draw(expected)
+        draw.fontmode = 'RGB'
+        draw.text((x, y), 'W_j|', font=font, fill=(240, 240, 240))
+        assert ImageChops.difference(img, expected).getbbox() is None
+
+    # Wide characters need shaping and are left to the text drawing path
+    assert not atlas.draw(img, font, 'a中', 0, 0, cell, (240, 240, 240))
+
+
+def test_interned_styles():
+    styles = Ansi2Image.StyleTable()
+    state = Ansi2Image.TextColor(foreground=(240, 240, 240), background=(0, 0, 0))
+    runs = list(Ansi2Image._handle_ansi_code("\x1b[31mA\x1b[0mB\x1b[31mC\x1b[7mD", state, styles))
+
+    assert [t for t, _ in runs] == ['A', 'B', 'C', 'D']
+    assert runs[0][1] == runs[2][1]
+    assert len(styles) == 3
+    assert styles[runs[0][1]].foreground_color == (194, 54, 33)
+    assert styles[runs[3][1]].background_color == (194, 54, 33)
+
+    with pytest.raises(AttributeError):
+        styles[runs[0][1]].foreground_color = (0, 0, 0)
+
+
+def test_palette_theme():
+    from ansi2image.libs.palette import Palette
+
+    palette = Palette.from_theme(dict(
+        foreground='#ffffff', background=[16, 16, 16], palette={'196': '#ff0000'}, bold_is_bright=True))
+    assert palette.color(196) == (255, 0, 0)
+    assert palette.color(256) is None
+    assert palette.bold(palette.ansi[1]) == palette.ansi[9]
+    assert palette.dim((0, 0, 0)) == (55, 55, 55)
+
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13, palette=palette)
+    o.loads("\x1b[48;5;196mA\x1b[0m")
+    o.calc_size(margin=2)
+
+    from PIL import Image
+    img = Image.open(io.BytesIO(o.generate_image(format='png')))
+    assert img.getpixel((int(o.margin), int(o.margin))) == (255, 0, 0)
+    assert img.getpixel((img.size[0] - 1, img.size[1] - 1)) == (16, 16, 16)
+
+
+def test_document_parsed_once():
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    o.loads("\x1b[1;32mok\x1b[0m \x1b(Bdone\x1b[?25l\nsecond line")
+    document = o.document
+
+    assert document.widths == [7, 11]
+    o.calc_size()
+    small = o.width
+    runs = document.runs
+
+    o.font_size = 26
+    o.calc_size()
+    o.generate_image()
+    assert o.document is document and document.runs is runs
+    assert o.width > small
+
+    other = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    other.document = document
+    other.calc_size()
+    assert other.width == small
+
+
+def test_screen_mode():
+    progress = ''.join('\rDownloading %3d%% [%-20s]' % (i, '#' * (i // 5)) for i in range(101))
+    text = progress + '\n\x1b[32mdone\x1b[0m\nab\x1b[2Dxy\x1b[K\n\x1b[1;1HX'
+
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13, screen=(80, 24))
+    o.loads(text)
+    rows = [''.join(t for t, _ in runs) for runs in o.document.runs]
+    assert rows == ['Xownloading 100% [####################]', 'done', 'xy']
+
+    o.calc_size()
+    lines_mode = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    lines_mode.loads(text)
+    lines_mode.calc_size()
+    assert o.width < lines_mode.width / 50
+
+    # Rows scrolled off the screen are kept in the scrollback
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13, screen=(10, 2), scrollback=1)
+    o.loads('1\n2\n3\n4')
+    assert [''.join(t for t, _ in runs) for runs in o.document.runs] == ['2', '3', '4']
+
+    # Huge scroll counts are bounded by the screen height
+    o.loads('1\n2\x1b[99999999999S3')
+    assert [''.join(t for t, _ in runs) for runs in o.document.runs] == ['2', '', ' 3']
+
+
+def test_paginated_output(tmp_path):
+    from PIL import Image
+
+    text = '\x1b[41m' + '\n'.join('line %d' % i for i in range(25)) + '\x1b[0m'
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    files = o.save_pages(str(tmp_path / 'out.png'), max_lines=10, stream=io.StringIO(text))
+
+    assert [os.path.basename(f) for f in files] == ['out-0001.png', 'out-0002.png', 'out-0003.png']
+
+    # The background set on the first page is still active on the last one
+    last = Image.open(files[-1])
+    o.loads('x')
+    o.calc_size()
+    assert last.getpixel((int(o.margin) + 1, int(o.margin) + 1)) == (194, 54, 33)
+
+    pages = list(o.iter_pages(max_height=100, stream=io.StringIO(text)))
+    assert all(p.size[1] <= 100 for p in pages)
+
+
+def test_parallel_bands_match_serial():
+    text = '\n'.join(
+        '\x1b[%d;3%dm%s \x1b[4%dm%s\x1b[0m' % (i % 3, i % 8, 'line %d' % i, (i + 2) % 8, 'x' * (i % 17))
+        for i in range(120)
+    )
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13, line_height=1.1)
+    o.loads(text)
+    o.calc_size()
+
+    assert o.generate_image(workers=3) == o.generate_image()
+
+
+def test_batch_conversion(tmp_path):
+    from ansi2image.batch import BatchConverter
+
+    src = tmp_path / 'logs'
+    (src / 'nested').mkdir(parents=True)
+    for name in ('a.log', 'b.log', 'nested/a.log'):
+        (src / name).write_text('\x1b[32m%s\x1b[0m\n' % name)
+
+    inputs = BatchConverter.collect([str(src / '*.log')], io.StringIO('# comment\n%s\n\n' % (src / 'nested')))
+    assert [os.path.relpath(f, str(src)) for f in inputs] == ['a.log', 'b.log', os.path.join('nested', 'a.log')]
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    summary = BatchConverter(str(out), workers=1).run(inputs + [str(src / 'missing.log')])
+    assert (summary['total'], summary['succeeded'], summary['failed']) == (4, 3, 1)
+    assert sorted(os.listdir(str(out))) == ['a-2.png', 'a.png', 'b.png']
+    assert summary['files'][-1]['error'].startswith('FileNotFoundError')
+
+
+def test_render_server():
+    import http.client
+    import json
+    import threading
+    import time
+    from ansi2image.server import RenderServer
+
+    server = RenderServer(workers=1, queue_size=0, timeout=30)
+    port = server.bind('127.0.0.1:0').server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=('',), daemon=True)
+    thread.start()
+    try:
+        text = '\x1b[31mhello\x1b[0m world\n'
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('POST', '/render?format=png', body=text.encode('utf-8'))
+        resp = conn.getresponse()
+        data = resp.read()
+        assert resp.status == 200 and resp.getheader('Content-Type') == 'image/png'
+
+        o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+        o.load(io.StringIO(text))
+        o.calc_size()
+        assert data == o.generate_image()
+
+        conn.request('POST', '/render?font=Missing', body=b'x')
+        resp = conn.getresponse()
+        assert resp.status == 400 and 'not found' in json.loads(resp.read())['error']
+
+        conn.request('GET', '/stats')
+        stats = json.loads(conn.getresponse().read())
+        assert (stats['requests'], stats['rendered'], stats['queue_depth']) == (1, 1, 0)
+        assert stats['latency_ms']['samples'] == 1
+
+        for length in ('-1', 'abc'):
+            conn.putrequest('POST', '/render')
+            conn.putheader('Content-Length', length)
+            conn.endheaders()
+            resp = conn.getresponse()
+            assert resp.status == 400 and 'Content-Length' in json.loads(resp.read())['error']
+            conn.close()
+    finally:
+        server.shutdown()
+        thread.join()
+
+    # A timed out job has its worker killed, so the only slot is free for the next request
+    server = RenderServer(workers=1, queue_size=0, timeout=3)
+    port = server.bind('127.0.0.1:0').server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=('',), daemon=True)
+    thread.start()
+    try:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('POST', '/render', body=('\x1b[32mslow line of text\n' * 400000).encode('utf-8'))
+        resp = conn.getresponse()
+        assert resp.status == 504 and json.loads(resp.read())['error'] == 'Render timed out'
+        conn.request('POST', '/render', body=text.encode('utf-8'))
+        resp = conn.getresponse()
+        assert resp.status == 200 and resp.read() == data
+        assert server.stats['timeouts'] == 1
+    finally:
+        server.shutdown()
+        thread.join()
+
+    # Jobs queued behind a stuck one wait for a worker without using up their timeout
+    server = RenderServer(workers=1, queue_size=3, timeout=3)
+    port = server.bind('127.0.0.1:0').server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=('',), daemon=True)
+    thread.start()
+    statuses = {}
+
+    def post(name, body):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        conn.request('POST', '/render', body=body.encode('utf-8'))
+        resp = conn.getresponse()
+        statuses[name] = (resp.status, resp.read())
+        conn.close()
+
+    try:
+        clients = [threading.Thread(target=post, args=('slow', '\x1b[32mslow line of text\n' * 400000))]
+        clients[0].start()
+        time.sleep(0.5)
+        # About half a second of work each, longer than what is left of a timeout counted from the request
+        clients += [threading.Thread(target=post, args=(n, '\x1b[33mqueued line\n' * 4000)) for n in range(3)]
+        for client in clients[1:]:
+            client.start()
+        for client in clients:
+            client.join()
+        assert statuses['slow'][0] == 504
+        assert [statuses[n][0] for n in range(3)] == [200] * 3
+        assert server.stats['timeouts'] == 1
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_lazy_import():
+    import subprocess
+
+    code = ('import sys, ansi2image.ansi2image; '
+            'print(sorted({m.split(".")[0] for m in sys.modules} & {"PIL", "colorama"}), sys.stdout is sys.__stdout__)')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, env=env, check=True)
+    assert out.stdout.decode().strip() == '[] True'
+
+
+def test_font_catalog(tmp_path, monkeypatch):
+    import shutil
+    from ansi2image.fonts.catalog import FontCatalog
+
+    fonts = tmp_path / 'fonts'
+    fonts.mkdir()
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'ansi2image', 'fonts', 'JetBrainsMono-Regular.ttf')
+    shutil.copy(src, str(fonts / 'Mono.ttf'))
+    (fonts / 'readme.txt').write_text('not a font')
+    cache = str(tmp_path / 'fonts.json')
+
+    probed = []
+    probe = FontCatalog.probe
+    monkeypatch.setattr(FontCatalog, 'probe', staticmethod(lambda path: probed.append(path) or probe(path)))
+
+    catalog = FontCatalog([str(fonts)], cache_path=cache)
+    assert catalog.find('jetbrains-mono') == (str(fonts / 'Mono.ttf'), 0)
+    assert catalog.truetype('JetBrains Mono Regular', 13) is catalog.truetype('JETBRAINS_MONO', 13)
+    assert catalog.find('Missing') is None
+    assert len(probed) == 1
+
+    # A new process reads the faces from the cache file
+    assert FontCatalog([str(fonts)], cache_path=cache).find('JetBrains Mono') is not None
+    assert len(probed) == 1
+
+    os.utime(str(fonts / 'Mono.ttf'), (1, 1))
+    assert FontCatalog([str(fonts)], cache_path=cache).find('JetBrains Mono') is not None
+    assert len(probed) == 2
+
+
+def test_renderer_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    from ansi2image.ansi2image import Renderer
+    from ansi2image.libs.palette import Palette
+
+    dark = Renderer(font_size=13)
+    light = Renderer(font_size=15, palette=Palette.from_theme({'foreground': '#000000', 'background': '#ffffff'}))
+    texts = ['\x1b[3%dmline %d\x1b[0m plain\n' % (i % 8, i) * (i % 5 + 1) for i in range(24)]
+    jobs = [(r, t) for t in texts for r in (dark, light)]
+
+    expected = [r.render(t) for r, t in jobs]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(lambda job: job[0].render(job[1]), jobs)) == expected
+
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    o.load(io.StringIO(texts[3]))
+    o.calc_size()
+    assert o.generate_image() == dark.render(texts[3])
+    assert not hasattr(Ansi2Image, 'lines') and not hasattr(Ansi2Image, '_background_color')
+
+
+def test_async_api():
+    import asyncio
+    from ansi2image.aio import AsyncRenderer, aiter_lines, render_async, render_pages_async
+    from ansi2image.ansi2image import Renderer
+
+    text = ''.join('\x1b[3%dmline %d\x1b[0m plain\n' % (i % 8, i) for i in range(30))
+
+    async def stream():
+        data = text.encode('utf-8')
+        for i in range(0, len(data), 7):
+            await asyncio.sleep(0)
+            yield data[i:i + 7]
+
+    async def main():
+        assert await render_async(stream(), font_size=13) == Renderer(font_size=13).render(text)
+
+        o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+        o.load(io.StringIO(text))
+        expected = [Ansi2Image._encode(img) for img in o.iter_pages(max_lines=12)]
+        assert [p async for p in render_pages_async(stream(), max_lines=12, font_size=13)] == expected
+
+        async with AsyncRenderer(max_concurrency=2, font_size=13) as renderer:
+            task = asyncio.ensure_future(renderer.render(text * 20))
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            results = await asyncio.gather(*[renderer.render(text) for _ in range(5)])
+            assert len(set(results)) == 1
+
+        # A line split in many chunks, invalid bytes are replaced like the other loaders do by default
+        async def chunks():
+            for part in [b'a' * 5] * 1000 + [b'\xff\n\xc3', b'\xa9\r\nend']:
+                yield part
+        assert [line async for line in aiter_lines(chunks())] == ['a' * 5000 + '\ufffd\n', '\xe9\r\n', 'end']
+        assert [line async for line in aiter_lines(b'\x84\n', errors='cp437')] == ['\xe4\n']
+        # Each element of an iterable of lines is a line, with or without its end
+        assert [line async for line in aiter_lines(['a', 'b\n', b'\x84'], errors='cp437')] == ['a', 'b\n', '\xe4']
+        with pytest.raises(UnicodeDecodeError):
+            await render_async(b'\xff', errors='strict', font_size=13)
+
+    asyncio.run(main())
+
+
+def test_background_grid():
+    from PIL import Image
+    from ansi2image.ansi2image import Renderer
+
+    r = Renderer(font_size=13)
+    document = r.document('\x1b[41mab\x1b[0m  \x1b[44m \x1b[0m\n\nplain\n\x1b[42m \x1b[0m\n')
+    canvas = Ansi2Image.TextColor(palette=r.palette).background_color
+    red, blue, green = [document.styles[run[1]].background_color
+                        for run in (document.runs[0][0], document.runs[0][2], document.runs[3][0])]
+
+    # Fractional cells: cell i covers the pixels int(x + i * w) to int(x + (i + 1) * w)
+    r.cell = (7.37, 15)
+    img = Image.new('RGB', (80, 80), canvas)
+    r.draw_backgrounds(img, document.runs, document.styles, 3.5, 2.0)
+    x = [int(3.5 + i * 7.37) for i in range(6)]
+    assert img.getpixel((x[0], 2)) == red and img.getpixel((x[2] - 1, 16)) == red
+    assert img.getpixel((x[2], 2)) == canvas and img.getpixel((x[4] - 1, 2)) == canvas
+    assert img.getpixel((x[4], 2)) == blue and img.getpixel((x[5] - 1, 2)) == blue
+    assert img.getpixel((x[5] + 1, 2)) == canvas and img.getpixel((x[0], 17)) == canvas
+    assert img.getpixel((x[0], 47)) == green and img.getpixel((x[0], 46)) == canvas
+
+    # Like a rectangle to x + w * len(run), a background reaches the first column after the line
+    assert img.getpixel((x[5], 2)) == blue
+    img = Image.new('RGB', (80, 80), canvas)
+    r.draw_backgrounds(img, document.runs[:1], document.styles, 3.5, 2.0, line_end=False)
+    assert img.getpixel((x[5] - 1, 2)) == blue and img.getpixel((x[5], 2)) == canvas
+
+
+def test_baseline_rendering():
+    from PIL import Image, ImageChops, ImageDraw
+
+    # Backgrounds, the canvas color set explicitly and glyphs at fractional positions
+    text = '\n'.join('\x1b[3%d;4%dm%s \x1b[0m%s \x1b[40mWAITING\x1b[45m_job|\x1b[0m \x1b[7m%d%%\x1b[0m'
+                     % (i % 8, (i + 3) % 8, 'worker' * (i % 3), 'retry' if i % 2 else '', i * 7) for i in range(12))
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13)
+    o.loads(text)
+    o.calc_size(margin=9.6)
+    with Image.open(io.BytesIO(o.generate_image(format='png'))) as img:
+        img = img.convert('RGB')
+
+    # The drawing of the previous versions: a rectangle and a text call per run
+    document = o.document.parse()
+    (w, h) = o.renderer.cell
+    expected = Image.new('RGB', img.size, o.background_color)
+    draw = ImageDraw.Draw(expected)
+    draw.fontmode = 'RGB'
+    y = float(o.margin)
+    for runs in document.runs:
+        x = float(o.margin)
+        for run, style_id in runs:
+            style = document.styles[style_id]
+            run = style.display(run)
+            if run and style.background_color is not None:
+                draw.rectangle([(x, y), (x + w * len(run), y + h - 1)], fill=style.background_color)
+            draw.text((x, y), text=run, font=o.renderer.font, fill=style.foreground_color)
+            x += float(w) * len(run)
+        y += float(h) * float(o.line_height)
+
+    assert ImageChops.difference(img, expected).getbbox() is None
+
+
+def test_encoder_profiles():
+    from PIL import Image
+    from ansi2image.ansi2image import Renderer
+    from ansi2image.libs.encoder import Encoder
+
+    renderer = Renderer(font_size=13)
+    img = renderer.render_image('\x1b[32mok\x1b[0m \x1b[41m fail \x1b[0m\n' * 4)
+
+    # The default profile writes the same PNG as Pillow's defaults
+    data = io.BytesIO()
+    img.save(data, format='png')
+    assert renderer.render('\x1b[32mok\x1b[0m \x1b[41m fail \x1b[0m\n' * 4) == data.getvalue()
+
+    sizes = {p: len(Encoder.encode(img, 'png', profile=p)) for p in Encoder.profiles()}
+    assert sizes['smallest'] <= sizes['balanced'] <= sizes['fast']
+
+    assert Encoder.normalize('.JPG') == 'jpeg'
+    # Any case, and the default profile saves like Pillow did before profiles existed
+    assert renderer.render('ok', format='PNG') == renderer.render('ok', format='png')
+    data = io.BytesIO()
+    img.save(data, format='jpeg', subsampling=0, quality=100)
+    assert Encoder.encode(img, 'JPEG') == data.getvalue()
+    assert Encoder.options('PNG', 'smallest')['compress_type'] == 0  # zlib.Z_DEFAULT_STRATEGY
+    if 'webp' in Encoder.formats():
+        webp = Image.open(io.BytesIO(Encoder.encode(img, 'webp', profile='fast'))).convert('RGB')
+        assert webp.tobytes() == img.tobytes()
+
+    with pytest.raises(ValueError):
+        Encoder.encode(img, 'png', profile='tiny')
+    with pytest.raises(ValueError):
+        Encoder.normalize('gif')
+
+
+def test_indexed_rendering():
+    from PIL import Image, ImageChops
+    from ansi2image.ansi2image import Renderer
+
+    text = ''.join('\x1b[3%dmline %d\x1b[0m \x1b[4%d;97m bar \x1b[0m\n' % (i % 8, i, i % 3) for i in range(40))
+    rgb = Renderer(font_size=13).render_image(text)
+    img = Renderer(font_size=13, indexed=True).render_image(text)
+    assert img.mode == 'P' and img.size == rgb.size and len(img.getpalette()) <= 256 * 3
+
+    # Antialias is quantized to 16 levels, solid colors are exact
+    diff = ImageChops.difference(rgb, img.convert('RGB'))
+    assert max(band.getextrema()[1] for band in diff.split()) <= 9
+    assert Image.open(io.BytesIO(Renderer(font_size=13, indexed=True).render(text))).mode == 'P'
+
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.get_default_font_name(), font_size=13, indexed=True)
+    o.loads(text)
+    o.calc_size()
+    assert o.generate_image(workers=2) == o.generate_image()
+
+    # Too many color pairs for one palette: drawn in RGB
+    many = ''.join('\x1b[38;5;%d;48;5;%dmx' % (i, 255 - i) for i in range(256)) + '\x1b[0m\n'
+    assert Renderer(font_size=13, indexed=True).render_image(many).mode == 'RGB'
+
+
+def test_vector_output(tmp_path):
+    import xml.etree.ElementTree as ET
+    from ansi2image.ansi2image import Renderer
+    from ansi2image.vector import VectorWriter
+
+    lines = ['\x1b[31mred\x1b[0m <&> \x1b[44m bar \x1b[0m\x07\n', '\x1b[31mred again\x1b[0m\n'] * 20
+    renderer = Renderer(font_size=13)
+    info = VectorWriter.save(renderer, iter(lines), str(tmp_path / 'out.svg'), embed_font=False)
+    assert info == dict(lines=40, columns=14)
+
+    # The header is patched with the size of the raster image
+    svg = ET.parse(str(tmp_path / 'out.svg')).getroot()
+    width, height = renderer.render_image(''.join(lines)).size
+    assert int(float(svg.get('width'))) == width and int(float(svg.get('height'))) == height
+
+    ns = '{http://www.w3.org/2000/svg}'
+    texts = svg.findall(ns + 'text')
+    assert texts[0].text == 'red' and texts[1].text == ' <&> '
+    assert len({t.get('class') for t in texts if t.text.startswith('red')}) == 1
+    assert len(svg.findall(ns + 'rect')) == 1 + 20
+
+    VectorWriter.save(renderer, lines, str(tmp_path / 'out.html'))
+    html = (tmp_path / 'out.html').read_text(encoding='utf-8')
+    assert '&lt;&amp;&gt;' in html and '@font-face' not in html and html.count('<span class="f0">red') == 40
+    assert "font-family:'%s'" % renderer.font.getname()[0] in html
+
+    # The font file is only embedded when asked
+    VectorWriter.save(renderer, lines, str(tmp_path / 'embedded.html'), embed_font=True)
+    assert '@font-face' in (tmp_path / 'embedded.html').read_text(encoding='utf-8')
+
+
+def test_recording_animation(tmp_path):
+    import json
+    from PIL import Image
+    from ansi2image.ansi2image import Renderer
+    from ansi2image.recording import Animator, Recording
+
+    events = [[0.0, 'o', '$ '], [0.5, 'o', 'l'], [0.6, 'o', 's\r\n'], [0.6, 'i', 'x'],
+              [0.7, 'o', '\x1b]0;title\x07\x1b[32mok\x1b[0m\r\n$ '], [0.8, 'o', '\x1b[3'], [9.0, 'o', '1mred']]
+    cast = tmp_path / 'demo.cast'
+    cast.write_text('\n'.join([json.dumps(dict(version=2, width=20, height=4, idle_time_limit=1.0))] +
+                              [json.dumps(e) for e in events]) + '\n', encoding='utf-8')
+    recording = Recording.open(str(cast))
+    assert (recording.columns, recording.rows) == (20, 4)
+
+    # Idle time is capped and a sequence split between events is kept whole
+    animator = Animator(Renderer(font_size=13), fps=5)
+    chunks = list(animator._chunks(recording.events(), recording.idle_time_limit))
+    assert chunks[-1] == (pytest.approx(1.8), '\x1b[31mred') and chunks[-2][1] == '\x1b[32mok\x1b[0m\r\n$ '
+
+    # Frames closer than 1/fps are merged, the last one is drawn like a full render
+    durations = [d for _, d in animator.frames(recording)]
+    assert durations == [500, 200, 200, 900, 1000]
+
+    info = animator.save(recording, str(tmp_path / 'demo.gif'))
+    with Image.open(str(tmp_path / 'demo.gif')) as img:
+        assert img.n_frames == info['frames'] == 5 and info['duration'] == 2.8
+
+    # script -t typescript and timing
+    (tmp_path / 'typescript').write_bytes(b'Script started on today\n$ \xc3\xa9cho\r\n')
+    # The second event ends in the middle of a UTF-8 character
+    (tmp_path / 'timing').write_text('0.1 2\n0.5 1\n0.2 6\n', encoding='utf-8')
+    script = Recording.open(str(tmp_path / 'typescript'), timing=str(tmp_path / 'timing'), size=(10, 2))
+    assert list(script.events()) == [(0.1, '$ '), (pytest.approx(0.8), '\xe9cho\r\n')]
+
+    # Frames redraw only the rows that changed and still match a full redraw, with style changes,
+    # glyphs that overhang their cell and scrolls
+    import random
+    from PIL import ImageChops
+    from ansi2image.ansi2image import Ansi2Image
+    from ansi2image.libs.screen import Screen
+    from ansi2image.recording import RowPainter
+
+    rnd = random.Random(6)
+    events = []
+    for n in range(200):
+        move = rnd.choice(['\x1b[%d;%dH' % (rnd.randrange(8) + 1, rnd.randrange(30) + 1), '\r\n', ''])
+        sgr = rnd.choice(['\x1b[0m', '\x1b[41m', '\x1b[44;33m', '\x1b[30m', '\x1b[7m', '\x1b[49m'])
+        events.append([n * 0.01, 'o', move + sgr + ''.join(rnd.choice('ab_|Wj\u2502\u253c ') for _ in range(4))])
+    cast = tmp_path / 'random.cast'
+    cast.write_text('\n'.join([json.dumps(dict(version=2, width=30, height=8))] +
+                              [json.dumps(e) for e in events]) + '\n', encoding='utf-8')
+    recording = Recording.open(str(cast))
+    r = Renderer(font_size=13)
+    animator = Animator(r, fps=1000, margin=0.03)
+    frames = [frame for frame, _ in animator.frames(recording)]
+    assert len(frames) > 100 and animator.stats['scrolls'] > 0
+
+    state = Ansi2Image.TextColor(foreground=r.foreground, background=r.background, palette=r.palette)
+    styles = Ansi2Image.StyleTable()
+    default_style = styles.intern(state)
+    screen = Screen(30, 8, 0)
+    for _, text in animator._chunks(recording.events(), None):
+        Ansi2Image._handle_terminal(text, state, styles, screen)
+    extent = Ansi2Image.Document.from_runs([[(' ' * 30, default_style)]] * 8, styles)
+    m, width, height = r.layout(extent, 0.03)
+    full = r.canvas((int(width), int(height)))
+    RowPainter(r, full, styles, default_style, m).paint_all(
+        [(list(chars), list(cell_styles)) for chars, cell_styles in screen.grid])
+    assert ImageChops.difference(frames[-1], full).getbbox() is None
+
+
+def test_incremental_renderer(tmp_path):
+    from PIL import ImageChops
+    from ansi2image.ansi2image import Renderer
+    from ansi2image.incremental import IncrementalRenderer
+
+    log = tmp_path / 'build.log'
+    log.write_bytes(b'')
+    renderer = Renderer(font_size=13)
+    follower = IncrementalRenderer(renderer, str(log))
+    assert follower.update() == 0 and follower.image() is None
+
+    # SGR state, CR LF and a line cut in the middle are carried between updates
+    parts = [b'\x1b[31mred ', b'still red\r', b'\n\x1b[0mplain\n\x1b[44m bar ', b'\x1b[0m and a longer line\n']
+    counts = []
+    for part in parts:
+        with open(str(log), 'ab') as f:
+            f.write(part)
+        counts.append(follower.update())
+    assert counts == [0, 0, 2, 1]
+
+    full = renderer.render_image(log.read_text(encoding='utf-8'))
+    assert ImageChops.difference(follower.image(), full).getbbox() is None
+    assert follower.save(str(tmp_path / 'out.png')) == [str(tmp_path / 'out.png')]
+    assert follower.save(str(tmp_path / 'out.png')) == []
+
+    # Pages already written are not encoded again
+    with open(str(log), 'ab') as f:
+        f.write(b'line\n' * 3)
+    paged = IncrementalRenderer(renderer, str(log), max_lines=4)
+    assert paged.update() == 6
+    assert paged.save(str(tmp_path / 'page.png')) == [str(tmp_path / 'page-0001.png'), str(tmp_path / 'page-0002.png')]
+    with open(str(log), 'ab') as f:
+        f.write(b'line\n')
+    paged.update()
+    assert paged.save(str(tmp_path / 'page.png')) == [str(tmp_path / 'page-0002.png')]
+
+    # A truncated file is read again from the start
+    log.write_bytes(b'new\n')
+    assert follower.update() == 1 and follower.stats['lines'] == 1
+
+
+def test_render_cache(tmp_path):
+    from ansi2image.libs.cache import RenderCache
+
+    cache = RenderCache(str(tmp_path / 'cache'))
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13, cache=cache)
+    o.loads('\x1b[32mcached\x1b[0m line\nsecond line')
+    o.calc_size()
+
+    first = o.generate_image()
+    assert o.generate_image() == first
+    assert o.generate_image(profile='fast') != first
+    assert cache.stats() == dict(hits=1, misses=2, bytes_saved=len(first), evicted=0)
+
+    # Keys change with the text and with any option, never with the worker count
+    options = o._cache_options('png', 'balanced')
+    assert cache.key(o.lines, options) != cache.key(o.lines + ['x'], options)
+    assert cache.key(o.lines, options) != cache.key(o.lines, dict(options, margin=options['margin'] + 1))
+
+    # The same text split in other lines is another document
+    a = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13, cache=cache)
+    a.loads('abc\nde')
+    b = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13, cache=cache)
+    b.loads('ab\ncde')
+    for doc in (a, b):
+        doc.calc_size()
+        doc.width, doc.height = 200, 60
+    assert cache.key(a.lines, a._cache_options('png', 'balanced')) != \
+        cache.key(b.lines, b._cache_options('png', 'balanced'))
+    a.generate_image()
+    cached = b.generate_image()
+    b.cache = None
+    assert b.generate_image() == cached
+
+    # Least recently used entries go first
+    small = RenderCache(str(tmp_path / 'small'), max_bytes=250)
+    keys = [small.key([str(n)], {}) for n in range(3)]
+    for n in (0, 1):
+        small.put(keys[n], b'x' * 100)
+        os.utime(small._path(keys[n]), (n, n))
+    assert small.get(keys[0]) is not None
+    small.put(keys[2], b'x' * 100)
+    assert small.get(keys[1]) is None and small.get(keys[0]) is not None and small.evicted == 1
+
+
+def test_benchmark_stages():
+    import json
+    from benchmarks.corpora import corpora
+    from benchmarks.stages import STAGES, compare, run
+
+    assert corpora(20, seed=3) == corpora(20, seed=3)
+    assert corpora(20, seed=3, names=['sgr16'])['sgr16'] == corpora(20, seed=3)['sgr16']
+
+    result = run(lines=10, repeat=1, names=['plain', 'progress'])
+    assert set(result['corpora']) == {'plain', 'progress'}
+    assert set(result['corpora']['progress']['stages']) == set(STAGES)
+
+    assert not any(r['regression'] for r in compare(result, result))
+    slower = json.loads(json.dumps(result))
+    for corpus in slower['corpora'].values():
+        corpus['stages']['draw']['best'] = 10.0
+    rows = compare(slower, result)
+    assert {r['stage'] for r in rows if r['regression']} == {'plain.draw', 'progress.draw'}
+
+
+def test_render_stats(tmp_path):
+    seen = []
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13, observer=seen.append)
+    o.loads('\x1b[31mred\x1b[0m plain\n\x1b[44m bar \x1b[0m\nlast')
+    o.calc_size()
+    data = o.generate_image()
+
+    assert len(seen) == 1
+    stats = seen[0]
+    assert {'load', 'metrics', 'parse', 'layout', 'draw', 'encode'} <= set(stats['stages'])
+    assert all(s['calls'] == 1 and s['wall'] >= 0 for s in stats['stages'].values())
+    counters = stats['counters']
+    assert counters['lines'] == 3 and counters['runs'] == 4 and counters['draw_calls'] == 4
+    assert counters['rectangles'] == 1 and counters['encoded_bytes'] == len(data)
+    assert counters['pixels'] == int(o.width) * int(o.height)
+
+    # Parsing happens once, a second render only draws and encodes again
+    o.generate_image()
+    assert seen[1]['stages']['parse']['calls'] == 1 and seen[1]['stages']['draw']['calls'] == 2
+
+    # --stats without a file prints only the JSON on stdout, the messages go to stderr
+    import json
+    import subprocess
+    (tmp_path / 'in.log').write_text('\x1b[31mred\x1b[0m\n', encoding='utf-8')
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, '-m', 'ansi2image', str(tmp_path / 'in.log'), '-o', str(tmp_path / 'out.png'),
+                           '--stats'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    assert json.loads(proc.stdout)['counters']['lines'] == 1 and b'Start time' in proc.stderr
+
+    # --stats before the input file is a flag, not the name of a stats file
+    proc = subprocess.run([sys.executable, '-m', 'ansi2image', '--stats', str(tmp_path / 'in.log'), '-o',
+                           str(tmp_path / 'first.png'), '--stats-file', str(tmp_path / 'stats.json')],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
+    assert proc.returncode == 0 and (tmp_path / 'first.png').exists()
+    assert json.loads(proc.stdout) == json.loads((tmp_path / 'stats.json').read_text(encoding='utf-8'))
+
+
+def test_mapped_lines(tmp_path):
+    from PIL import ImageChops
+    from ansi2image.libs import mapped
+    from ansi2image.libs.mapped import MappedLines
+
+    # Small chunks, so lines are split across the chunks of the index
+    mapped._CHUNK, chunk = 7, mapped._CHUNK
+    try:
+        data = ''.join('\x1b[3%dmline %d\x1b[0m é\r\n' % (n % 8, n) for n in range(300)) + 'no newline'
+        path = tmp_path / 'huge.log'
+        path.write_bytes(data.encode('utf-8'))
+        with open(str(path), 'r', encoding='utf-8', newline='') as f:
+            expected = f.readlines()
+        lines = MappedLines(str(path))
+    finally:
+        mapped._CHUNK = chunk
+
+    assert len(lines) == 301 and lines[:] == expected and list(lines) == expected
+    assert lines[-1] == 'no newline' and lines[10:12] == expected[10:12]
+    assert list(lines.tail(2)) == expected[-2:] and lines.view(-5, -3)[:] == expected[-5:-3]
+    assert len(lines.view(100, 50)) == 0 and lines.view(5, 8)[-1] == expected[7]
+
+    empty = tmp_path / 'empty.log'
+    empty.write_bytes(b'')
+    with MappedLines(str(empty)) as e:
+        assert len(e) == 0 and e[:] == []
+
+    # A selected range renders like the same lines loaded from text
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13)
+    o.load_from_file(str(path), mapped=True)
+    o.select(-20, None)
+    assert isinstance(o.lines, MappedLines) and len(o.lines) == 20
+    o.calc_size()
+    t = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13)
+    t.lines = expected[-20:]
+    t.calc_size()
+    image = o.renderer.render_image(o.document)
+    assert ImageChops.difference(image, t.renderer.render_image(t.document)).getbbox() is None
+    assert o.generate_image(workers=2)[:8] == b'\x89PNG\r\n\x1a\n'
+    lines.close()
+
+    # The map and its file are closed with the renderer, or when other lines are loaded
+    o.close()
+    assert o.lines._file.closed
+    with Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13) as o:
+        o.load_from_file(str(path), mapped=True)
+        view = o.lines
+        o.loads('text')
+        assert view._file.closed
+
+    # A CR alone ends a line, as when the file is read in full
+    progress = tmp_path / 'progress.log'
+    progress.write_bytes(b'10%\r50%\r100%\ndone\r\n')
+    with MappedLines(str(progress)) as p:
+        assert p[:] == ['10%\r', '50%\r', '100%\n', 'done\r\n']
+    for use_map in (True, False):
+        with Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13) as o:
+            o.load_from_file(str(progress), mapped=use_map)
+            assert [''.join(text for text, _ in runs) for runs in o.document.runs] == ['10%', '50%', '100%', 'done']
+
+
+def test_bytes_parsing(tmp_path):
+    from ansi2image.libs.decoding import decode
+
+    # Lines loaded from a file stay bytes and give the same runs as the decoded text
+    text = 'a\x1b[1;31mred é\x1b[0m\r\nprogress\rdone\n\x1b[38;5;99m\x1b[48;2;1;2;3mcolors\x1b[?25h│\n'
+    path = tmp_path / 'input.log'
+    path.write_bytes(text.encode('utf-8'))
+    o = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13)
+    o.load_from_file(str(path))
+    assert o.lines == [b'a\x1b[1;31mred \xc3\xa9\x1b[0m\r\n', b'progress\r', b'done\n',
+                       b'\x1b[38;5;99m\x1b[48;2;1;2;3mcolors\x1b[?25h\xe2\x94\x82\n']
+    t = Ansi2Image(0, 0, font_name=Ansi2Image.font_name, font_size=13)
+    t.loads(text.replace('\r\n', '\n').replace('\r', '\n'))
+    t.select(None, -1)
+    styles = [[(s, o.document.styles[i].key) for s, i in line] for line in o.document.parse().runs]
+    assert styles == [[(s, t.document.styles[i].key) for s, i in line] for line in t.document.parse().runs]
+
+    # Invalid UTF-8 no longer fails the render, the policy picks the replacement
+    path.write_bytes(b'\xff ok \x1b[32m\xc9\xcd\n')
+    o.load_from_file(str(path))
+    assert [s for s, _ in o.document.parse().runs[0]] == ['� ok ', '��']
+    o.errors = 'cp437'
+    assert [s for s, _ in o.document.parse().runs[0]] == ['\xa0 ok ', '╔═']
+    assert decode(b'\xc9\xcd', 'cp437') == '╔═'
+    o.errors = 'strict'
+    with pytest.raises(UnicodeDecodeError):
+        o.document.parse()